@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the smot command
+
+Measures the time to import smot.main with `python -X importtime` and the
+wall time of `smot --version` above a bare interpreter start. The slowest
+imports are listed and the exit status is non-zero when the import time is
+over budget. Run it with bytecode caching enabled (the default), otherwise
+compiling the sources dominates.
+
+  python benchmarks/bench_startup.py --budget 80
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """
+    Self and cumulative import times (in microseconds) of every module
+    imported with `module`
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        (self_us, cumulative_us, name) = line[len("import time:") :].split("|")
+        if self_us.strip().isdigit():
+            times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def wall_time(args: List[str], repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(args, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--budget", type=float, default=80, help="Import time budget in ms"
+    )
+    args = parser.parse_args()
+
+    # the first run warms the bytecode cache
+    import_times("smot.main")
+    best = min(
+        (import_times("smot.main") for _ in range(args.repeats)),
+        key=lambda times: times[-1][2],
+    )
+    total_ms = best[-1][2] / 1000
+
+    print("slowest imports (self ms, cumulative ms):")
+    slowest = sorted(best, key=lambda x: -x[1])[: args.top]
+    for (name, self_us, cumulative_us) in slowest:
+        print(f"  {self_us / 1000:7.1f} {cumulative_us / 1000:7.1f}  {name}")
+
+    bare = wall_time([sys.executable, "-c", "pass"], args.repeats)
+    version = wall_time(
+        [sys.executable, "-c", "from smot.main import main; main()", "--version"],
+        args.repeats,
+    )
+    print(f"import smot.main\t{total_ms:.1f} ms")
+    print(f"smot --version\t{(version - bare) * 1000:.1f} ms over a bare interpreter")
+
+    if total_ms > args.budget:
+        print(f"over the {args.budget:g} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the newick writer
+
+Builds a synthetic tree (see treegen.py), colors half of its branches and
+times how long it takes to write it with the default and the exact branch
+length formatters.
+
+  python benchmarks/bench_writer.py --tips 100000
+"""
+
+import argparse
+import io
+import random
+import sys
+import time
+
+from treegen import SHAPES, random_tree
+
+from smot.format import write_newick
+
+COLORS = ["#FF0000", "#00FF00", "#0000FF"]
+
+
+def color_branches(node, rng: random.Random) -> None:
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.kids and rng.random() < 0.5:
+            node.data.form["!color"] = rng.choice(COLORS)
+        stack.extend(node.kids)
+
+
+def time_writer(node, precision, repeats):
+    best = float("inf")
+    size = 0
+    for _ in range(repeats):
+        fh = io.StringIO()
+        start = time.perf_counter()
+        write_newick(node, fh, precision=precision)
+        best = min(best, time.perf_counter() - start)
+        size = len(fh.getvalue())
+    return (best, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--tips", type=int, default=100000)
+    parser.add_argument("--shape", choices=SHAPES, default="coalescent")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    sys.setrecursionlimit(1000000)
+    node = random_tree(args.shape, args.tips, seed=args.seed)
+    color_branches(node, random.Random(args.seed))
+    for (name, precision) in [("precision=3", 3), ("exact", None)]:
+        (seconds, size) = time_writer(node, precision, args.repeats)
+        print(f"{name}\t{args.tips} tips\t{size} chars\t{seconds:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
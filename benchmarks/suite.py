@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the smot command line
+
+Generates synthetic trees (see treegen.py) of every shape and size, then runs
+each benchmarked subcommand on them in a fresh process with SMOT_TIMINGS=json,
+so the results hold both the total wall time and the time of every stage
+(read, factor, sample, clean, write). Commands other than parsing read the
+trees in the binary format, so that they measure the command rather than the
+parser.
+
+Results are written as JSON. Given a baseline from an earlier run, cases that
+became slower than --threshold times the baseline are listed and the exit
+status is non-zero.
+
+  python benchmarks/suite.py --sizes 1e3 1e4 --output results.json
+  python benchmarks/suite.py --baseline results.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from treegen import SHAPES, parse_size, random_tree, write_factor_table
+
+from smot.binary import write_binary
+from smot.classes import makeTree
+from smot.format import write_newick
+
+CAPTURE = "(1[AB]\\.[^|]*)"
+
+# (name, arguments) of each benchmarked command, {tre} is the newick tree,
+# {smot} the binary tree and {table} a factor table for it
+CASES: List[Tuple[str, List[str]]] = [
+    ("parse", ["convert", "--to", "binary", "{tre}"]),
+    ("write", ["convert", "--to", "nexus", "{smot}"]),
+    ("tips", ["tips", "{smot}"]),
+    ("factor capture", ["factor", "table", "--factor-by-capture", CAPTURE, "{smot}"]),
+    ("factor field", ["factor", "table", "--factor-by-field", "6", "{smot}"]),
+    ("factor table", ["factor", "table", "--factor-by-table", "{table}", "{smot}"]),
+    (
+        "factor impute",
+        ["factor", "table", "--impute", "--factor-by-table", "{table}", "{smot}"],
+    ),
+    (
+        "factor patristic",
+        ["factor", "table", "--patristic", "--factor-by-table", "{table}", "{smot}"],
+    ),
+    (
+        "sample equal",
+        [
+            "sample",
+            "equal",
+            "--factor-by-capture",
+            CAPTURE,
+            "--max-tips",
+            "5",
+            "{smot}",
+        ],
+    ),
+    (
+        "sample mono",
+        ["sample", "mono", "--factor-by-capture", CAPTURE, "-p", "0.1", "{smot}"],
+    ),
+    (
+        "sample para",
+        ["sample", "para", "--factor-by-capture", CAPTURE, "-p", "0.1", "{smot}"],
+    ),
+    ("grep", ["grep", "-P", "swine.*2020-", "{smot}"]),
+    (
+        "filter",
+        [
+            "filter",
+            "--factor-by-capture",
+            CAPTURE,
+            "--all-match",
+            "swine",
+            "--remove",
+            "{smot}",
+        ],
+    ),
+    ("color leaf", ["color", "leaf", "-P", "-p", "swine", "#FFA000", "{smot}"]),
+    (
+        "color branch mono",
+        ["color", "branch", "mono", "--factor-by-capture", CAPTURE, "{smot}"],
+    ),
+    (
+        "color branch para",
+        ["color", "branch", "para", "--factor-by-capture", CAPTURE, "{smot}"],
+    ),
+]
+
+
+def make_inputs(shape: str, ntips: int, seed: int, workdir: str) -> Dict[str, str]:
+    node = random_tree(shape, ntips, seed)
+    paths = {
+        key: os.path.join(workdir, f"{shape}-{ntips}.{ext}")
+        for (key, ext) in [("tre", "tre"), ("smot", "smot"), ("table", "tab")]
+    }
+    with open(paths["tre"], "w") as fh:
+        write_newick(node, fh)
+        fh.write("\n")
+    with open(paths["smot"], "wb") as fh:
+        write_binary(makeTree(node), fh)
+    with open(paths["table"], "w") as fh:
+        write_factor_table(node, fh)
+    return paths
+
+
+def run_case(args: List[str], timeout: float) -> Dict[str, Any]:
+    """
+    Run smot once, returning the wall time and the stage timings
+    """
+    env = dict(os.environ, SMOT_TIMINGS="json")
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-c", "from smot.main import main; main()"] + args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            env=env,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return dict(error=f"timed out after {timeout:g} s")
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines() or ["(no message)"]
+        return dict(error=f"exit status {proc.returncode}: {lines[-1]}")
+    report = json.loads(proc.stderr[proc.stderr.find("[") :])
+    # name nested stages by their path, e.g. "sample para/factor"
+    stages: Dict[str, float] = dict()
+    path: List[str] = []
+    for record in report:
+        path[record["depth"] :] = [record["stage"]]
+        name = "/".join(path)
+        stages[name] = stages.get(name, 0.0) + record["wall"]
+    return dict(
+        wall=wall,
+        stages=stages,
+        max_rss_bytes=max(r["max_rss_bytes"] or 0 for r in report),
+    )
+
+
+def run_suite(
+    shapes: List[str],
+    sizes: List[int],
+    cases: List[str],
+    repeats: int,
+    seed: int,
+    timeout: float,
+) -> List[Dict[str, Any]]:
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for shape in shapes:
+            for ntips in sizes:
+                paths = make_inputs(shape, ntips, seed, workdir)
+                for (name, template) in CASES:
+                    if cases and name not in cases:
+                        continue
+                    args = [arg.format(**paths) for arg in template]
+                    runs = [run_case(args, timeout) for _ in range(repeats)]
+                    failed = [run for run in runs if "error" in run]
+                    # keep the fastest run, or the first error
+                    best = failed[0] if failed else min(runs, key=lambda r: r["wall"])
+                    result = dict(case=name, shape=shape, tips=ntips, **best)
+                    results.append(result)
+                    print(format_result(result), file=sys.stderr)
+    return results
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    key = f"{result['case']:<20}{result['shape']:<12}{result['tips']:>9}"
+    if "error" in result:
+        return f"{key}  {result['error']}"
+    stages = " ".join(f"{k}={v:.3f}" for (k, v) in result["stages"].items())
+    return f"{key}{result['wall']:>9.3f} s  {stages}"
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], threshold: float
+) -> List[str]:
+    """
+    Describe every case that is slower than `threshold` times its baseline or
+    that fails where the baseline did not
+    """
+    old = {(r["case"], r["shape"], r["tips"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = old.get((result["case"], result["shape"], result["tips"]))
+        if before is None or "error" in before:
+            continue
+        key = f"{result['case']} ({result['shape']}, {result['tips']} tips)"
+        if "error" in result:
+            regressions.append(f"{key}: {result['error']}")
+        elif result["wall"] > threshold * before["wall"]:
+            regressions.append(
+                f"{key}: {result['wall']:.3f} s, was {before['wall']:.3f} s"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=SHAPES)
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=parse_size,
+        default=[1000, 10000],
+        help="Numbers of tips, e.g., 1e3 1e4 1e5 1e6",
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        choices=[name for (name, _) in CASES],
+        default=[],
+        help="Run only these cases (default: all)",
+    )
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="Seconds allowed for each run"
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Report cases slower than this multiple of the baseline",
+    )
+    args = parser.parse_args(argv)
+
+    sys.setrecursionlimit(1000000)
+    results = run_suite(
+        args.shapes, args.sizes, args.cases, args.repeats, args.seed, args.timeout
+    )
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+            fh.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic trees for benchmarking
+
+Trees have influenza-style tip labels (e.g.,
+"CVV|A/swine/Iowa/A0000042/2020|H1N2|swine|USA|1B.2.1|2020-07-08") and come
+in four shapes:
+
+  balanced     a perfectly balanced binary tree
+  caterpillar  a ladder, every internal node has one tip child (maximal depth)
+  star         a single polytomy holding every tip
+  coalescent   random pairwise merges with exponential waiting times, shaped
+               like a Kingman coalescent (the most realistic of the four)
+
+The same shape, size and seed always give the same tree.
+
+  python benchmarks/treegen.py --shape coalescent --tips 100000 > big.tre
+"""
+
+import argparse
+import random
+import sys
+from typing import List, Optional
+
+from smot.classes import makeNode
+from smot.format import write_newick
+
+SHAPES = ["balanced", "caterpillar", "star", "coalescent"]
+
+SOURCES = ["CVV", "publicIAV", "IAV-lab"]
+HOSTS = ["human", "swine"]
+STATES = ["Iowa", "Minnesota", "Ohio", "Texas", "North_Carolina"]
+SUBTYPES = ["H1N1", "H1N2", "H3N2"]
+CLADES = ["1A.1.1", "1A.3.3.2", "1A.3.3.3", "1B.2.1", "1B.2.2.1", "1B.2.2.2"]
+
+
+def make_labels(ntips: int, rng: random.Random) -> List[str]:
+    labels = []
+    for i in range(ntips):
+        host = rng.choice(HOSTS)
+        year = rng.randint(2009, 2023)
+        date = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        strain = f"A/{host}/{rng.choice(STATES)}/A{i:07d}/{year}"
+        labels.append(
+            "|".join(
+                [
+                    rng.choice(SOURCES),
+                    strain,
+                    rng.choice(SUBTYPES),
+                    host,
+                    "USA",
+                    rng.choice(CLADES),
+                    date,
+                ]
+            )
+        )
+    return labels
+
+
+def random_tree(shape: str, ntips: int, seed: int = 42):
+    """
+    Build a tree of the given shape, all branches have lengths
+    """
+    rng = random.Random(f"{shape}-{ntips}-{seed}")
+    tips = [
+        makeNode(label=label, length=rng.expovariate(100))
+        for label in make_labels(ntips, rng)
+    ]
+
+    if shape == "star":
+        return makeNode(kids=tips)
+
+    if shape == "caterpillar":
+        node = tips[0]
+        for tip in tips[1:]:
+            node = makeNode(kids=[node, tip], length=rng.expovariate(1000))
+        return node
+
+    if shape == "balanced":
+        level = tips
+        while len(level) > 1:
+            paired = [
+                makeNode(kids=level[i : i + 2], length=rng.expovariate(1000))
+                for i in range(0, len(level) - 1, 2)
+            ]
+            if len(level) % 2 == 1:
+                paired.append(level[-1])
+            level = paired
+        return level[0]
+
+    if shape == "coalescent":
+        # merge two random lineages at a time; the waiting time for k lineages
+        # is exponential with rate k(k-1)/2, so branches near the tips are short
+        lineages = list(tips)
+        heights = [0.0] * len(lineages)
+        now = 0.0
+        while len(lineages) > 1:
+            k = len(lineages)
+            now += rng.expovariate(k * (k - 1) / 2)
+            merged = []
+            for _ in range(2):
+                i = rng.randrange(len(lineages))
+                (lineages[i], lineages[-1]) = (lineages[-1], lineages[i])
+                (heights[i], heights[-1]) = (heights[-1], heights[i])
+                node = lineages.pop()
+                node.data.length = now - heights.pop()
+                merged.append(node)
+            lineages.append(makeNode(kids=merged))
+            heights.append(now)
+        return lineages[0]
+
+    raise ValueError(f"Unknown tree shape '{shape}', expected one of {SHAPES}")
+
+
+def write_factor_table(node, fh, every: int = 10) -> None:
+    """
+    Write a --factor-by-table file assigning the clade of every nth tip
+    """
+    stack = [node]
+    i = 0
+    while stack:
+        node = stack.pop()
+        if node.kids:
+            stack.extend(reversed(node.kids))
+        else:
+            if i % every == 0:
+                fh.write(f"{node.data.label}\t{node.data.label.split('|')[5]}\n")
+            i += 1
+
+
+def parse_size(size: str) -> int:
+    # accept sizes like 1e5
+    return int(float(size))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--shape", choices=SHAPES, default="coalescent")
+    parser.add_argument("--tips", type=parse_size, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    write_newick(random_tree(args.shape, args.tips, args.seed), sys.stdout)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,25 @@
 import smot.parser as sp
 from smot.classes import makeNode
 import smot.algorithm as alg
+import smot.binary as sb
+import smot.format as sf
+import smot.server as ss
+import smot.timing as timing
+import smot.counters as counters
+import smot.stream as stream
+import smot.distance as distance
+import smot.bipartition as bp
+import smot.stats as st
+import smot.sharing as sharing
 import parsec as psc
 import unittest
 import random
-from smot.format import newick
+import os
+import tempfile
+from smot.format import newick, nexus, write_newick, write_nexus, quote, quoteIf
+import io
+import subprocess
+import sys
 
 
 class TestParsers(unittest.TestCase):
@@ -311,6 +326,53 @@ class TestParsers(unittest.TestCase):
         )
 
 
+    def test_translate(self):
+        nexus_file = "\n".join(
+            [
+                "#NEXUS",
+                "begin trees;",
+                "\tTranslate",
+                "\t\t1 A_x,",
+                "\t\t2 'B C',",
+                "\t\t3 'it''s'",
+                "\t\t;",
+                "\ttree TREE1 = [&R] (1:0.1,(2:0.2,3,4):0.1);",
+                "end;",
+                "",
+            ]
+        )
+        self.assertEqual(
+            sp.p_tree.parse(nexus_file).tree,
+            sp.p_tree.parse("(A_x:0.1,('B C':0.2,'it''s',4):0.1);").tree,
+        )
+
+    def test_opaque_blocks(self):
+        data = "dimensions ntax=2 nchar=4;\nformat datatype=dna;\nmatrix\n'A;1' ACGT\nB TT-A\n;\n"
+        nexus_file = "\n".join(
+            [
+                "#NEXUS",
+                "BEGIN DATA;",
+                data + "END;",
+                "",
+                "begin trees;",
+                "\ttree tree_1 = [&R] ('A;1',B);",
+                "end;",
+                "",
+                "begin assumptions;",
+                "\tcharset first = 1-2;",
+                "endblock;",
+                "",
+            ]
+        )
+        tree = sp.p_tree.parse(nexus_file)
+        self.assertEqual(tree.tree, sp.p_tree.parse("('A;1',B);").tree)
+        self.assertEqual(tree.meta["data"], data)
+        self.assertEqual(tree.meta["assumptions"], "\tcharset first = 1-2;\n")
+        # the blocks are written back verbatim
+        self.assertIn(f"begin data;\n{data}end;\n", nexus(tree))
+        self.assertEqual(sp.p_tree.parse(nexus(tree)).meta, tree.meta)
+
+
 class TestStringify(unittest.TestCase):
     def test_stringify(self):
         s = "(B|a,(A|b,C|b,E|b),D|c);"
@@ -326,6 +388,719 @@ class TestStringify(unittest.TestCase):
         s = """('that"s !@#$%^&)(*&^[]cool'[&!color=#000000]:0.3);"""
         self.assertEqual(newick(sp.p_tree.parse(s)), s)
 
+    def test_write_streams(self):
+        s = "(B|a:0.1,(A|b,'C|b'[&!color=#000000]:2,E|b)X:1.5e-05,D|c);"
+        tree = sp.p_tree.parse(s)
+        fh = io.StringIO()
+        write_newick(tree, fh)
+        self.assertEqual(fh.getvalue(), s)
+
+        tree.colmap = {"A|b": "#FF0000"}
+        tree.meta = {"figtree": ["set layout.zoom=0"]}
+        fh = io.StringIO()
+        write_nexus(tree, fh)
+        self.assertEqual(fh.getvalue(), nexus(tree))
+        self.assertEqual(
+            nexus(tree),
+            "\n".join(
+                [
+                    "#NEXUS",
+                    "begin taxa;",
+                    "\tdimensions ntax=5;",
+                    "\ttaxlabels",
+                    "\t'A|b'[&!color=#FF0000]",
+                    "\t'B|a'",
+                    "\t'C|b'",
+                    "\t'D|c'",
+                    "\t'E|b'",
+                    ";",
+                    "end;\n",
+                    "begin trees;",
+                    f"\ttree tree_1 = [&R] {s}",
+                    "end;\n",
+                    "begin figtree;",
+                    "\tset layout.zoom=0;",
+                    "end;\n",
+                ]
+            ),
+        )
+        # tip colors are written on the tips in newick, if asked for
+        fh = io.StringIO()
+        write_newick(tree, fh, colors=sf.tipColors(tree))
+        self.assertEqual(fh.getvalue(), s.replace("A|b", "'A|b'[&!color=#FF0000]"))
+
+    def test_precision(self):
+        tree = sp.p_tree.parse("(A:0.123456789,B:1e-07)C:2;")
+        self.assertEqual(newick(tree), "(A:0.123,B:1e-07)C:2;")
+        self.assertEqual(newick(tree, precision=5), "(A:0.12346,B:1e-07)C:2;")
+        self.assertEqual(newick(tree, precision=None), "(A:0.123456789,B:1e-07)C:2.0;")
+        # exact lengths read back as the same floats
+        self.assertEqual(sp.p_tree.parse(newick(tree, precision=None)).tree, tree.tree)
+        with self.assertRaises(ValueError):
+            newick(tree, precision=0)
+
+    def test_quoting(self):
+        self.assertEqual(quoteIf("A|b"), "A|b")
+        self.assertEqual(quoteIf("A(b)"), "'A(b)'")
+        self.assertEqual(quoteIf("A^b"), "'A^b'")
+        self.assertEqual(quoteIf("A[b]"), "'A[b]'")
+        self.assertEqual(quoteIf("it's"), "\"it's\"")
+        self.assertEqual(quote('it\'s "x"'), '"it\'s \\"x\\""')
+
+    def test_translate(self):
+        tree = sp.p_tree.parse("(('A|x':0.1,B:0.2)Y:0.3,'it''s'[&!color=#FF0000],A|x);")
+        tree.colmap = {"B": "#00FF00"}
+        s = nexus(tree, translate=True)
+        self.assertIn("\t\t1 'A|x',\n\t\t2 'B',\n\t\t3 \"it's\"\n\t;\n", s)
+        self.assertIn("[&R] ((1:0.1,2:0.2)Y:0.3,3[&!color=#FF0000],1);", s)
+        # translated trees read back to the original tree
+        self.assertEqual(nexus(sp.p_tree.parse(s)), nexus(tree))
+
+    def test_write_deep_tree(self):
+        # the writer is iterative, so very deep trees do not hit the recursion limit
+        node = makeNode(label="A0")
+        for i in range(1, 5000):
+            node = makeNode(kids=[makeNode(label=f"A{i}"), node])
+        s = newick(node)
+        self.assertTrue(s.startswith("(A4999,(A4998,"))
+        self.assertTrue(s.endswith("(A1,A0)" + ")" * 4998 + ";"))
+
+
+class TestBinary(unittest.TestCase):
+    def test_roundtrip(self):
+        s = "(('A|x':0.1,B:0.2)Y[&!color=#000000]:0.3,'it''s'[&!color=#FF0000,a=b],A|x,'':1e-09);"
+        tree = sp.p_tree.parse(s)
+        tree.colmap = {"B": "#00FF00"}
+        tree.meta = {"figtree": ["set layout.zoom=0"]}
+        tree2 = sb.read_binary(sb.binary(tree))
+        self.assertEqual(tree2.tree, tree.tree)
+        self.assertEqual(tree2.colmap, tree.colmap)
+        self.assertEqual(tree2.meta, tree.meta)
+        self.assertEqual(nexus(tree2), nexus(tree))
+        with self.assertRaises(ValueError):
+            sb.read_binary(b"#NEXUS" + bytes(32))
+
+    def test_cache(self):
+        data = b"(A:0.1,(B,C)D);"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            tree = sb.read_bytes(data, cache_dir=cache_dir)
+            path = sb.cache_path(cache_dir, data)
+            self.assertTrue(os.path.exists(path))
+            with open(path, "rb") as fh:
+                self.assertEqual(sb.read_binary(fh.read()).tree, tree.tree)
+            self.assertEqual(sb.read_bytes(data, cache_dir=cache_dir).tree, tree.tree)
+        # binary input is recognized without a cache
+        self.assertEqual(sb.read_bytes(sb.binary(tree)).tree, tree.tree)
+
+
+class TestServer(unittest.TestCase):
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, f"{name}.tre") for name in "ab"]
+            for path in paths:
+                with open(path, "w") as fh:
+                    fh.write("(A,(B,C));")
+            size = len(sb.binary(sp.p_tree.parse("(A,(B,C));")))
+            cache = ss.TreeCache(max_bytes=size + 1)
+            self.assertEqual(newick(cache.get(paths[0])), "(A,(B,C));")
+            self.assertEqual(newick(cache.get(paths[0])), "(A,(B,C));")
+            # the least recently used tree is dropped to stay under the limit
+            cache.get(paths[1])
+            self.assertEqual(cache.stats()["trees"], [os.path.realpath(paths[1])])
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+            # changed files are read again
+            with open(paths[1], "w") as fh:
+                fh.write("(X,Y,Z);")
+            self.assertEqual(newick(cache.get(paths[1])), "(X,Y,Z);")
+
+    def test_tables(self):
+        from smot.main import readColormap, readFactorTable
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "table.tab")
+            with open(path, "w") as fh:
+                fh.write("X1|H\tfoo\n")
+            table = readFactorTable(path)
+            self.assertEqual(table, {"X1|H": "foo"})
+            # callers get their own copies
+            table["X1|H"] = "bar"
+            self.assertEqual(readFactorTable(path), {"X1|H": "foo"})
+            # an edited file is read again, as a server must
+            with open(path, "w") as fh:
+                fh.write("X1|H\tbaz\nX2|H\tfoo\n")
+            self.assertEqual(readFactorTable(path), {"X1|H": "baz", "X2|H": "foo"})
+            with open(path, "w") as fh:
+                fh.write("foo\t#ff0000\n")
+            self.assertEqual(readColormap(path), {"foo": "#FF0000"})
+
+    def test_request(self):
+        import click
+        from smot.main import cli, answerRequest
+
+        cache = ss.TreeCache(max_bytes=1 << 20)
+        ctx = click.Context(cli, obj=dict(precision=3))
+        path = os.path.join(os.path.dirname(__file__), "test-data", "fork.tre")
+        response = answerRequest(ctx, cache, dict(tree=path, stages=["grep Y", "tips"]))
+        self.assertEqual(
+            response, dict(ok=True, output="Y1|H\nY2|H\nY3|H\nY4|H\nY5|H\n")
+        )
+        response = answerRequest(ctx, cache, dict(tree=path, stages=["nope"]))
+        self.assertFalse(response["ok"])
+        self.assertIn("nope", response["error"])
+
+    def test_socket(self):
+        import json
+        import socket
+        import time
+
+        data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-data")
+        with tempfile.TemporaryDirectory() as tmp:
+            bad = os.path.join(tmp, "bad.tre")
+            with open(bad, "w") as fh:
+                fh.write("(A,(B,C);")
+            socket_path = os.path.join(tmp, "smot.sock")
+            server = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-c",
+                    "from smot.main import main; main()",
+                    "serve",
+                    "--socket",
+                    socket_path,
+                ],
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                for _ in range(100):
+                    if os.path.exists(socket_path):
+                        break
+                    time.sleep(0.1)
+                client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                client.connect(socket_path)
+                with client, client.makefile("rwb") as fh:
+
+                    def ask(tree, stages):
+                        request = dict(tree=tree, stages=stages)
+                        fh.write(json.dumps(request).encode("utf-8") + b"\n")
+                        fh.flush()
+                        return json.loads(fh.readline())
+
+                    fork = os.path.join(data, "fork.tre")
+                    # errors are answered and the connection is still usable
+                    for (tree, stages) in [(bad, ["tips"]), (fork, ["grep --perl ("])]:
+                        response = ask(tree, stages)
+                        self.assertFalse(response["ok"])
+                        self.assertTrue(response["error"])
+                    response = ask(fork, ["grep Y1", "tips"])
+                    self.assertEqual(response, dict(ok=True, output="Y1|H\n"))
+            finally:
+                server.terminate()
+                server.wait()
+
+
+class TestTiming(unittest.TestCase):
+    def tearDown(self):
+        timing._records = None
+
+    def test_stages(self):
+        tree = sp.p_tree.parse("(A,(B,C));")
+        # nothing is recorded until timings are enabled
+        with timing.stage("read") as stage:
+            stage.count(tree)
+        self.assertIsNone(timing._records)
+
+        timing.enable()
+        with timing.stage("outer") as stage:
+            timing.timed("inner")(alg.clean)(tree.tree)
+            stage.count(tree)
+        out = io.StringIO()
+        timing.report(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("outer "))
+        self.assertTrue(lines[2].startswith("  inner "))
+        self.assertEqual([r["nodes"] for r in timing._records], [5, 5])
+        self.assertEqual([r["depth"] for r in timing._records], [0, 1])
+
+    def test_traced_peak(self):
+        import tracemalloc
+
+        # tracemalloc.reset_peak is new in Python 3.9
+        reset_peak = getattr(tracemalloc, "reset_peak", None)
+        timing.enable()
+        tracemalloc.start()
+        try:
+            for missing in [False, True]:
+                if missing and reset_peak is not None:
+                    del tracemalloc.reset_peak
+                with timing.stage("outer"):
+                    with timing.stage("inner"):
+                        data = [0] * 100000
+                    del data
+                (outer, inner) = timing.take()
+                self.assertGreaterEqual(inner["peak_bytes"], 800000)
+                self.assertGreaterEqual(outer["peak_bytes"], inner["peak_bytes"])
+        finally:
+            tracemalloc.stop()
+            if reset_peak is not None:
+                tracemalloc.reset_peak = reset_peak
+
+    def test_merge(self):
+        self.assertEqual(timing.take(), [])
+        timing.enable()
+        with timing.stage("sample"):
+            pass
+        records = timing.take()
+        self.assertEqual([r["stage"] for r in records], ["sample"])
+        self.assertEqual(timing._records, [])
+        # a worker's stages nest under the stage running in the main process
+        with timing.stage("batch"):
+            timing.merge(records)
+        self.assertEqual([r["stage"] for r in timing._records], ["batch", "sample"])
+        self.assertEqual([r["depth"] for r in timing._records], [0, 1])
+
+
+class TestStream(unittest.TestCase):
+    def tearDown(self):
+        stream.CHUNK_SIZE = 1 << 16
+
+    def streamTips(self, text):
+        return list(stream.tips(io.BytesIO(text.encode("utf-8"))))
+
+    def test_tips(self):
+        newick = "('A B':0.1,\"C,D\"[&x='](,;']:1,(E,'it''s')F:2)G;"
+        expected = ["A B", "C,D", "E", "it's"]
+        self.assertEqual(alg.tips(sp.p_tree.parse(newick).tree), expected)
+        # tokens split across chunks in every possible place
+        for size in [1, 2, 3, 5, 64]:
+            stream.CHUNK_SIZE = size
+            self.assertEqual(self.streamTips(newick), expected)
+
+    def test_nexus(self):
+        nexus = (
+            "#NEXUS\nbegin taxa;\n\tdimensions ntax=2;\nend;\n\n"
+            "begin trees;\n\ttranslate\n\t\t1 'A|x',\n\t\t2 B\n;\n"
+            "\ttree tree_1 = [&R] (1:1,(2,C):2);\nend;\n"
+        )
+        for size in [1, 64]:
+            stream.CHUNK_SIZE = size
+            self.assertEqual(self.streamTips(nexus), ["A|x", "B", "C"])
+            crlf = nexus.replace("\n", "\r\n")
+            self.assertEqual(self.streamTips(crlf), ["A|x", "B", "C"])
+
+    def test_prune(self):
+        trees = [
+            "(A:1,(B:2,C:3)N:4)R:5;",
+            "(((A:0.1)X:0.2)Y:0.3,(B:0.4,(C:0.5,D:0.6):0.7):0.8);",
+            "(('A|x'[&c=1]:1,(B:2,C:3):4):5,((D:6,E:7):8,F:9):10);",
+        ]
+        for text in trees:
+            for kept in ["", "A", "B", "CD", "ABF", "ACE", "ABCDEF"]:
+                keep = lambda label: label[0] in kept
+                pruned = sp.p_tree.parse(text).tree
+                pruned = alg.treecut(
+                    pruned,
+                    lambda n: [k for k in n.kids if k.kids or keep(k.data.label)],
+                )
+                expected = newick(alg.clean(pruned))
+                for size in [1, 64]:
+                    stream.CHUNK_SIZE = size
+                    fh = io.BytesIO(text.encode("utf-8"))
+                    got = "".join(stream.prune(fh, keep, 3)) + ";"
+                    self.assertEqual(got, expected, (text, kept))
+
+    def test_relabel(self):
+        fh = io.BytesIO(b"(A|x:1,(B|y,'C|z'[&c=1])N|w:2);")
+        got = "".join(stream.relabel(fh, lambda x: x.replace("|", "_"), 3))
+        self.assertEqual(got, "(A_x:1,(B_y,'C_z'[&c=1])N_w:2)")
+
+    def test_depths(self):
+        text = "((A:1,B:2)'x y'[&a=1]:3,(C:4,(D:5,E:6):7):1e-3):9;"
+        expected = [
+            (node.data.label, depth)
+            for (node, depth) in alg.nodeDepths(sp.p_tree.parse(text).tree)
+            if node.data.isLeaf
+        ]
+        for size in [1, 64]:
+            stream.CHUNK_SIZE = size
+            got = list(stream.depths(io.BytesIO(text.encode("utf-8"))))
+            self.assertEqual(got, expected)
+        for text in ["(A:1,B);", "((A:1,B:1),C:1);", "(A:-1,B:1);"]:
+            fh = io.BytesIO(text.encode("utf-8"))
+            self.assertRaises(stream.StreamError, list, stream.depths(fh))
+
+    def test_split_trees(self):
+        newick = "(A,B)C;\n('x;y',[;]B);\n\n(C,D);\n"
+        nexus = (
+            "#NEXUS\nbegin trees;\n\ttranslate 1 A, 2 B;\n"
+            "\ttree t1 = (1,2);\n\ttree t2 = [&U] ('x;y',2);\nend;\n"
+            "begin figtree;\nend;\n"
+        )
+        for size in [1, 3, 64]:
+            stream.CHUNK_SIZE = size
+            (header, trees) = stream.split_trees(io.BytesIO(newick.encode("utf-8")))
+            self.assertEqual(header, "")
+            self.assertEqual(list(trees), ["(A,B)C;", "('x;y',[;]B);", "(C,D);"])
+            (header, trees) = stream.split_trees(io.BytesIO(nexus.encode("utf-8")))
+            self.assertTrue(header.endswith("\ttranslate 1 A, 2 B;\n"))
+            self.assertEqual(
+                list(trees), ["\ttree t1 = (1,2);", "\ttree t2 = [&U] ('x;y',2);"]
+            )
+        (_, trees) = stream.split_trees(io.BytesIO(b"(A,B);\n(A,'B);\n"))
+        self.assertRaises(stream.StreamError, list, trees)
+
+    def test_errors(self):
+        self.assertRaises(stream.StreamError, self.streamTips, "(A,B")
+        self.assertRaises(stream.StreamError, self.streamTips, "(A,[&x=1)")
+        # an unterminated quote is part of an unquoted label, as in the parser
+        self.assertEqual(self.streamTips("(A,'B);"), ["A", "'B"])
+
+    def test_peekable(self):
+        from smot.main import peekable, rewritable, streamable
+
+        class Chunked(io.RawIOBase):
+            # a pipe that delivers a few bytes at a time
+            def __init__(self, data):
+                self.data = data
+
+            def readable(self):
+                return True
+
+            def readinto(self, buffer):
+                chunk = self.data[: min(3, len(buffer))]
+                self.data = self.data[len(chunk) :]
+                buffer[: len(chunk)] = chunk
+                return len(chunk)
+
+        tree = sp.p_tree.parse("(A,(B,C));")
+        for (data, text) in [(sb.binary(tree), False), (b"(A,(B,C));", True)]:
+            fh = io.BufferedReader(Chunked(data))
+            self.assertLess(len(fh.peek(len(sb.MAGIC))), len(sb.MAGIC))
+            fh = peekable(io.BufferedReader(Chunked(data)))
+            self.assertEqual(streamable(fh), text)
+            self.assertEqual(fh.read(), data)
+        # nexus input is not rewritten as it streams
+        fh = peekable(io.BufferedReader(Chunked(nexus(tree).encode("utf-8"))))
+        self.assertFalse(rewritable(fh))
+        self.assertTrue(rewritable(fh, newick=True))
+        # input shorter than the prefix is left whole
+        fh = peekable(io.BufferedReader(Chunked(b"(A);")))
+        self.assertEqual(fh.read(), b"(A);")
+
+
+class TestDistance(unittest.TestCase):
+    def tearDown(self):
+        distance.BLOCK_SIZE = 1 << 22
+
+    def test_patristicProfile(self):
+        tree = sp.p_tree.parse("((A:1,B:2):3,(C:4,(D:5,E:6):7):8):9;").tree
+        (tipNodes, depths, between) = alg.patristicProfile(tree)
+        self.assertEqual([tip.data.label for tip in tipNodes], list("ABCDE"))
+        self.assertEqual(depths, [4, 5, 12, 20, 21])
+        self.assertEqual(between, [3, 0, 8, 15])
+        with self.assertRaises(ValueError):
+            alg.patristicProfile(sp.p_tree.parse("((A:1,B):3,C:4);").tree)
+
+    def test_distances(self):
+        tree = sp.p_tree.parse("((A:1,B:2):3,(C:4,(D:5,E:6):7):8):9;").tree
+        (_, depths, between) = alg.patristicProfile(tree)
+        expected = [
+            [0, 3, 16, 24, 25],
+            [3, 0, 17, 25, 26],
+            [16, 17, 0, 16, 17],
+            [24, 25, 16, 0, 11],
+            [25, 26, 17, 11, 0],
+        ]
+        # whole blocks, blocks of a few rows (tiles that split the matrix on
+        # either side of the diagonal), and single rows without NumPy
+        for (size, vectorize) in [(1 << 22, True), (7, True), (1, True), (1, False)]:
+            distance.BLOCK_SIZE = size
+            rows = [
+                list(row)
+                for (_, block) in distance.distanceBlocks(depths, between, vectorize)
+                for row in block
+            ]
+            self.assertEqual(rows, expected)
+            nearest = list(distance.nearest(depths, between, 2, vectorize))
+            self.assertEqual(nearest[0], [(1, 3), (2, 16)])
+            # ties are broken by tip order
+            self.assertEqual(nearest[2], [(0, 16), (3, 16)])
+            self.assertEqual(nearest[4], [(3, 11), (2, 17)])
+
+
+class TestBipartition(unittest.TestCase):
+    def splits(self, text, keys, rooted=False, tips=None):
+        return bp.splitSet(sp.p_tree.parse(text).tree, keys, rooted, tips)
+
+    def test_robinsonFoulds(self):
+        keys = bp.TipKeys()
+        a = self.splits("((A,B),(C,D),E);", keys)
+        # the same splits, with the children in another order
+        self.assertEqual(a, self.splits("((D,C),E,(B,A));", keys))
+        self.assertEqual(bp.robinsonFoulds(a, a), (2, 0, 0.0))
+        b = self.splits("((A,C),(B,D),E);", keys)
+        self.assertEqual(bp.robinsonFoulds(a, b), (0, 4, 1.0))
+        # rooting moves a clade but not a split
+        c = "((A,B),(C,D));"
+        d = "(A,(B,(C,D)));"
+        self.assertEqual(self.splits(c, keys), self.splits(d, keys))
+        self.assertEqual(
+            bp.robinsonFoulds(
+                self.splits(c, keys, rooted=True), self.splits(d, keys, rooted=True)
+            ),
+            (1, 2, 0.5),
+        )
+        # splits of the tips shared with a subsampled tree
+        full = "((A,B),((C,D),(E,F)));"
+        tips = {"A", "B", "C", "E"}
+        self.assertEqual(
+            self.splits(full, keys, tips=tips), self.splits("((A,B),(C,E));", keys)
+        )
+
+    def test_splitSupport(self):
+        ref = sp.p_tree.parse("(((A,B)X,C)Y,(D,E)Z,F)R;").tree
+        trees = [
+            sp.p_tree.parse(text).tree
+            for text in ["((A,B),C,(D,E,F));", "((A,C),B,(D,E),F);", "((A,B),(D,F));"]
+        ]
+        (counts, ntrees) = bp.splitSupport(ref, trees, bp.TipKeys())
+        labels = {}
+        stack = [ref]
+        while stack:
+            node = stack.pop()
+            if id(node) in counts:
+                labels[node.data.label] = counts[id(node)]
+            stack.extend(node.kids)
+        self.assertEqual(ntrees, 3)
+        # the split of Y is ABC|DEF, which the third tree holds on its tips
+        self.assertEqual(labels, {"X": 2, "Y": 2, "Z": 1})
+
+
+class TestStats(unittest.TestCase):
+    def test_treeStats(self):
+        tree = sp.p_tree.parse(
+            "(((a|A:1,b|A:2):1,c|A:1,d|B:4):1,(e|B:1,f:2,g|B:1,h|B:1):3,i|A);"
+        ).tree
+        stats = st.treeStats(
+            tree, lambda x: alg.factorByFieldFun(x, 2), lambda x: x == "h|B", 3
+        )
+        self.assertEqual(stats.tips, 9)
+        self.assertEqual(stats.nodes, 4)
+        self.assertEqual(stats.maxDepth, 3)
+        # i has no branch length
+        self.assertIsNone(stats.maxHeight)
+        self.assertEqual(stats.missingLengths, 1)
+        self.assertEqual(stats.lengths, [1, 1, 1, 1, 1, 1, 1, 2, 2, 3, 4])
+        self.assertEqual(stats.polytomies, {3: 2, 4: 1})
+        self.assertEqual(stats.factors, {"A": 4, "B": 4, None: 1})
+        self.assertEqual(
+            sorted(stats.groups, key=str),
+            [("A", 1, 0), ("A", 1, 0), ("A", 2, 0), ("B", 1, 0), ("B", 4, 1)],
+        )
+        self.assertEqual(stats.equalGroups, [("B", 4)])
+        self.assertEqual(st.equalSize(stats, [], 3), 8)
+        self.assertEqual(st.equalSize(stats, ["B"], 3), 9)
+
+    def test_sample_sizes(self):
+        # the predicted sizes match the samplers on a random factored tree
+        random.seed(42)
+        nodes = [makeNode(label=f"t{i}|{random.choice('ABC')}") for i in range(200)]
+        while len(nodes) > 1:
+            k = random.choice([2, 2, 3])
+            kids = [nodes.pop(random.randrange(len(nodes))) for _ in range(k)]
+            nodes.append(makeNode(kids=kids))
+        text = newick(nodes[0])
+
+        def tree():
+            return alg.factorByField(sp.p_newick.parse(text), 2)
+
+        for (kwargs, keep) in [
+            (dict(proportion=0.3, minTips=2), []),
+            (dict(scale=2), ["B"]),
+            (dict(number=3, keep_regex="t1"), []),
+        ]:
+            stats = st.treeStats(
+                tree(),
+                lambda x: alg.factorByFieldFun(x, 2),
+                (lambda x: x.startswith("t1")) if "keep_regex" in kwargs else None,
+            )
+            counts = dict(kwargs)
+            counts.pop("keep_regex", None)
+            mono = alg.sampleMonophyletic(tree(), keep=keep, seed=1, **kwargs)
+            self.assertEqual(
+                st.monoSize(stats, keep, alg.monophyleticCounter(**counts)),
+                len(alg.tips(mono)),
+            )
+            para = alg.sampleParaphyletic(tree(), keep=keep, seed=1, **kwargs)
+            self.assertGreaterEqual(
+                st.paraSize(stats, keep, alg.paraphyleticCounter(**counts)),
+                len(alg.tips(para)),
+            )
+        self.assertEqual(
+            st.equalSize(stats, ["C"], 5),
+            len(alg.tips(alg.sampleEqual(tree(), keep=["C"], maxTips=5))),
+        )
+
+
+class TestSharing(unittest.TestCase):
+    def test_intern(self):
+        table = sharing.SubtreeTable()
+        texts = ["((A:1,B:1):1,(C:1,D:1):2);", "((A:1,B:1):1,(C:1,D:2):2);"]
+        (a, b) = [table.intern(sp.p_newick.parse(text)) for text in texts]
+        self.assertEqual([newick(a), newick(b)], texts)
+        # (A,B) is shared, (C,D) differs in a length, C is shared
+        self.assertIs(a.kids[0], b.kids[0])
+        self.assertIsNot(a.kids[1], b.kids[1])
+        self.assertIs(a.kids[1].kids[0], b.kids[1].kids[0])
+        self.assertEqual((table.seen, len(table)), (14, 10))
+        # a tree interned again is the same tree
+        self.assertIs(table.intern(sp.p_newick.parse(texts[0])), a)
+
+        table = sharing.SubtreeTable(lengths=False)
+        (a, b) = [table.intern(sp.p_newick.parse(text)) for text in texts]
+        self.assertIs(a, b)
+        self.assertEqual(newick(a), "((A,B),(C,D));")
+
+    def test_unshare(self):
+        table = sharing.SubtreeTable()
+        (a, b) = [
+            table.intern(sp.p_newick.parse(text))
+            for text in ["((A,B),(C,D));", "((A,B),(C,E));"]
+        ]
+        c = sharing.unshare(a)
+        self.assertEqual(newick(c), newick(a))
+        alg.clean(alg.treecut(c, lambda node: node.kids[:1]))
+        alg.treemap(c, lambda data: setattr(data, "label", "X") or data)
+        self.assertEqual(newick(a), "((A,B),(C,D));")
+        self.assertEqual(newick(b), "((A,B),(C,E));")
+        # each copied node has a list of children of its own
+        tip = a.kids[0].kids[0]
+        self.assertIsNot(sharing._copy(tip).kids, sharing._copy(tip).kids)
+
+    def test_snapshot(self):
+        text = "((A:1,B:1)X:1,((C:1,D:1)Y:1,E:1)Z:1,F:1)R;"
+        tree = sp.p_newick.parse(text)
+        snapshot = sharing.Snapshot(tree)
+        (x, z) = (tree.kids[0], tree.kids[1])
+        fork = snapshot.remove(["C", "D", "F"])
+        self.assertEqual(newick(fork), "((A:1,B:1)X:1,E:2)R;")
+        # the untouched clade is shared, the changed path is copied
+        self.assertIs(fork.kids[0], x)
+        self.assertIsNot(fork, tree)
+        self.assertEqual(
+            newick(snapshot.keep(["C", "D", "E"])), "((C:1,D:1)Y:1,E:1)Z:1;"
+        )
+        self.assertEqual(newick(snapshot.keep(["A"])), "(A:2);")
+        self.assertIsNone(snapshot.keep([]))
+        self.assertIs(snapshot.remove([]), tree)
+        fork = snapshot.replace(z.kids[1], makeNode(label="G", length=2))
+        self.assertEqual(newick(fork), "((A:1,B:1)X:1,((C:1,D:1)Y:1,G:2)Z:1,F:1)R;")
+        self.assertIs(fork.kids[1].kids[0], z.kids[0])
+        self.assertEqual(newick(tree), text)
+
+        # forks match cutting and cleaning a copy of the tree
+        random.seed(42)
+        nodes = [makeNode(label=f"t{i}", length=1) for i in range(40)]
+        while len(nodes) > 1:
+            k = min(len(nodes), random.choice([2, 2, 3]))
+            kids = [nodes.pop(random.randrange(len(nodes))) for _ in range(k)]
+            nodes.append(makeNode(kids=kids, length=0.5))
+        text = newick(nodes[0])
+        snapshot = sharing.Snapshot(sp.p_newick.parse(text))
+        labels = [f"t{i}" for i in range(40)]
+        for _ in range(20):
+            keep = set(random.sample(labels, random.randint(1, 40)))
+            expected = alg.clean(
+                alg.treecut(
+                    sp.p_newick.parse(text),
+                    lambda node: [
+                        k for k in node.kids if k.kids or k.data.label in keep
+                    ],
+                )
+            )
+            self.assertEqual(newick(snapshot.keep(keep)), newick(expected))
+            self.assertEqual(
+                newick(snapshot.remove(set(labels) - keep)), newick(expected)
+            )
+        self.assertEqual(newick(snapshot.root), text)
+
+    def test_read_trees(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trees.tre")
+            with open(path, "w") as fh:
+                fh.write("((A,B),(C,D));\n((A,B),(D,C));\n((A,B),(C,D));\n")
+            table = sharing.SubtreeTable()
+            trees = [tree_obj.tree for tree_obj in sp.read_trees(path, table)]
+            self.assertEqual(
+                [newick(tree) for tree in trees],
+                ["((A,B),(C,D));", "((A,B),(D,C));", "((A,B),(C,D));"],
+            )
+            self.assertIs(trees[0], trees[2])
+            self.assertIs(trees[0].kids[0], trees[1].kids[0])
+            self.assertEqual(len(table), 9)
+
+
+def caterpillarTree(n: int):
+    # tips alternate between two factors, so every clade is paraphyletic
+    node = makeNode(label="t0|A")
+    for i in range(1, n):
+        node = makeNode(kids=[node, makeNode(label=f"t{i}|{'AB'[i % 2]}")])
+    return node
+
+
+def balancedTree(n: int):
+    level = [makeNode(label=f"t{i}|{'AB'[i % 3 == 0]}", length=1) for i in range(n)]
+    while len(level) > 1:
+        level = [
+            makeNode(kids=level[i : i + 2], length=1) for i in range(0, len(level), 2)
+        ]
+    return level[0]
+
+
+class TestCounters(unittest.TestCase):
+    def setUp(self):
+        # the counting wrappers double the depth of the recursion
+        self.limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(10000)
+
+    def tearDown(self):
+        sys.setrecursionlimit(self.limit)
+
+    def visits(self, make, n, run):
+        with counters.counting() as counts:
+            run(alg.factorByField(make(n), field=2))
+        return counts.total
+
+    def test_linear(self):
+        # quadrupling the tree must not much more than quadruple the work
+        algorithms = [
+            lambda t: alg.sampleParaphyletic(t, proportion=0.1, seed=1),
+            lambda t: alg.sampleMonophyletic(t, proportion=0.1, seed=1),
+            lambda t: alg.sampleEqual(t, maxTips=2),
+            lambda t: alg.imputeMonophyleticFactors(alg.setFactorCounts(t)),
+            lambda t: alg.colorMono(alg.setFactorCounts(t), {"A": "#000000"}),
+            alg.clean,
+        ]
+        for make in [caterpillarTree, balancedTree]:
+            for run in algorithms:
+                small = self.visits(make, 256, run)
+                large = self.visits(make, 1024, run)
+                self.assertLess(large, 4.5 * small)
+
+    def test_counts(self):
+        node = sp.p_tree.parse("((A,B),(C,D));").tree
+        with counters.counting() as counts:
+            alg.clean(alg.factorByField(node, field=1))
+        # 7 nodes, visited once by treemap and once by setNLeafs
+        self.assertEqual(counts.visits, {"treemap": 7, "setNLeafs": 7})
+        self.assertEqual(
+            counts.calls, {"factorByField": 7, "factorByLabel": 7, "clean": 7}
+        )
+        self.assertEqual(counts.ncalls["factorByField"], 1)
+        # the original functions are restored
+        self.assertEqual(alg.treemap.__module__, "smot.algorithm")
+        self.assertFalse(hasattr(alg.treemap, "__wrapped__"))
+
 
 class TestALgorithms(unittest.TestCase):
     def test_treemap(self):
@@ -651,6 +1426,59 @@ class TestALgorithms(unittest.TestCase):
         self.assertEqual(alg.distribute(10, 3, [3, 100, 0]), [3, 7, 0])
         self.assertEqual(alg.distribute(1, 2, [0, 10]), [0, 1])
 
+    def test_samplingPlan(self):
+        # a plan draws exactly the tips the sampler keeps with the same seed
+        random.seed(7)
+        nodes = [
+            makeNode(label=f"t{i}|{random.choice('xyz')}", length=1) for i in range(60)
+        ]
+        while len(nodes) > 1:
+            kids = [nodes.pop(random.randrange(len(nodes))) for _ in range(2)]
+            nodes.append(makeNode(kids=kids, length=0.5))
+        text = newick(nodes[0])
+
+        def parse():
+            return alg.factorByField(sp.p_newick.parse(text), field=2)
+
+        kwargss = [
+            dict(proportion=0.3, minTips=2),
+            dict(number=2, keep=["x"]),
+            dict(scale=2, keep_regex="t[0-9]$"),
+            # clades may be left with one tip or none
+            dict(proportion=0.1, minTips=0),
+        ]
+        for kwargs in kwargss:
+            tree = parse()
+            mono = alg.monophyleticPlan(tree, **kwargs)
+            para = alg.paraphyleticPlan(tree, **kwargs)
+            snapshot = sharing.Snapshot(tree)
+            for seed in range(1, 6):
+                self.assertEqual(
+                    newick(snapshot.keep(alg.drawSample(mono, seed), mono.clades)),
+                    newick(alg.sampleMonophyletic(parse(), seed=seed, **kwargs)),
+                )
+                self.assertEqual(
+                    newick(snapshot.keep(alg.drawSample(para, seed))),
+                    newick(alg.sampleParaphyletic(parse(), seed=seed, **kwargs)),
+                )
+            self.assertEqual(newick(tree), text)
+
+        # the clades that filterMono acts on are each drawn with a new generator
+        tree = parse()
+        plan = alg.filterPlan(
+            alg.setFactorCounts(tree),
+            condition=lambda node: len(alg.tips(node)) > 2,
+            cladePlan=lambda node: alg.monophyleticPlan(node, proportion=0.5),
+        )
+        self.assertGreater(len(plan.segments), 1)
+        selected = alg.drawSample(plan, 3)
+        expected = alg.filterMono(
+            alg.setFactorCounts(parse()),
+            condition=lambda node: len(alg.tips(node)) > 2,
+            action=lambda node: alg.sampleMonophyletic(node, proportion=0.5, seed=3),
+        )
+        self.assertEqual(selected, set(alg.tips(expected)))
+
     def test_sampleN(self):
         self.assertEqual(
             newick(alg.sampleN(sp.p_tree.parse("(B,(A,C,E),D);").tree, 2)), "(B,A);"
@@ -658,6 +1486,239 @@ class TestALgorithms(unittest.TestCase):
         with self.assertRaises(ValueError):
             newick(alg.sampleN(sp.p_tree.parse("(B,(A,C,E),D);").tree, 0))
 
+    def test_traversals(self):
+        tree = sp.p_tree.parse("((A,B)X,(C,(D,E)Y)Z)R;").tree
+
+        def labels(visits):
+            return [
+                (node.data.label, depth, parent and parent.data.label)
+                for (node, depth, parent) in visits
+            ]
+
+        self.assertEqual(
+            labels(alg.preorder(tree)),
+            [
+                ("R", 0, None),
+                ("X", 1, "R"),
+                ("A", 2, "X"),
+                ("B", 2, "X"),
+                ("Z", 1, "R"),
+                ("C", 2, "Z"),
+                ("Y", 2, "Z"),
+                ("D", 3, "Y"),
+                ("E", 3, "Y"),
+            ],
+        )
+        self.assertEqual(
+            [label for (label, _, _) in labels(alg.postorder(tree))],
+            ["A", "B", "X", "C", "D", "E", "Y", "Z", "R"],
+        )
+        self.assertEqual(
+            [label for (label, _, _) in labels(alg.levelorder(tree))],
+            ["R", "X", "Z", "A", "B", "C", "Y", "D", "E"],
+        )
+        self.assertEqual(
+            [label for (label, _, _) in labels(alg.leaves(tree))], alg.tips(tree)
+        )
+        self.assertEqual(labels(alg.leaves(tree))[3], ("D", 3, "Y"))
+
+        # a search that stops early does not look into the rest of the tree
+        class Untouchable(list):
+            def __iter__(self):
+                raise AssertionError("visited")
+
+            __reversed__ = __iter__
+
+        tree.kids[1].kids = Untouchable(tree.kids[1].kids)
+        (node, _, _) = next(alg.leaves(tree))
+        self.assertEqual(node.data.label, "A")
+        found = next(v for v in alg.postorder(tree) if v[0].data.label == "X")
+        self.assertEqual(found[1:], (1, tree))
+
+        # deep trees do not recurse
+        node = makeNode(label="t0")
+        for i in range(1, 20000):
+            node = makeNode(kids=[node, makeNode(label=f"t{i}")])
+        for traversal in [alg.preorder, alg.postorder, alg.levelorder]:
+            self.assertEqual(sum(1 for _ in traversal(node)), 39999)
+        self.assertEqual(max(depth for (_, depth, _) in alg.leaves(node)), 19999)
+
+    def test_nodeDepths(self):
+        tree = sp.p_tree.parse("((A:1,B:2)X:3,C:4)R:5;").tree
+        self.assertEqual(
+            [(node.data.label, depth) for (node, depth) in alg.nodeDepths(tree)],
+            [("R", 0), ("X", 3), ("A", 4), ("B", 5), ("C", 4)],
+        )
+        with self.assertRaises(ValueError):
+            list(alg.nodeDepths(sp.p_tree.parse("((A:1,B:2),C:4);").tree))
+
+    def test_MRCAIndex(self):
+        tree = sp.p_tree.parse("((A,(B,C)X)Y,((D,E)Z,F,(G,H)W)V)R;").tree
+        index = alg.MRCAIndex(tree)
+        self.assertEqual([tip.data.label for tip in index.tipNodes], alg.tips(tree))
+
+        def mrca(labels):
+            node = index.mrcaOfMatches(lambda label: label in labels)
+            return node.data.label
+
+        self.assertEqual(mrca("A"), "A")
+        self.assertEqual(mrca("BC"), "X")
+        self.assertEqual(mrca("AC"), "Y")
+        self.assertEqual(mrca("DF"), "V")
+        self.assertEqual(mrca("EG"), "V")
+        self.assertEqual(mrca("GH"), "W")
+        self.assertEqual(mrca("CD"), "R")
+        self.assertEqual(mrca("ABCDEFGH"), "R")
+        self.assertIsNone(index.mrcaOfMatches(lambda label: False))
+        self.assertEqual(index.lca(6, 3).data.label, "V")
+        self.assertEqual(index.tipIndices("E"), [4])
+
+        # every pair of tips of a random tree agrees with a search for the
+        # smallest clade holding both
+        random.seed(42)
+        nodes = [makeNode(label=f"t{i}") for i in range(40)]
+        while len(nodes) > 1:
+            kids = [nodes.pop(random.randrange(len(nodes))) for _ in range(2)]
+            nodes.append(makeNode(kids=kids))
+        index = alg.MRCAIndex(nodes[0])
+        for i in range(40):
+            for j in range(40):
+                pair = {f"t{i}", f"t{j}"}
+                node = nodes[0]
+                while True:
+                    kids = [k for k in node.kids if pair <= alg.tipSet(k)]
+                    if not kids:
+                        break
+                    node = kids[0]
+                self.assertIs(index.mrca([index.tipIndices(t)[0] for t in pair]), node)
+
+
+    def test_reroot(self):
+        tree = sp.p_newick.parse(
+            "((A:1,B:2)90[&!color=#ff0000]:1,(C:1,(D:1,E:5)80:2)70:1);"
+        )
+        self.assertEqual(
+            newick(alg.rootOutgroup(tree, lambda label: label == "A")),
+            "(A:0.5,((C:1,(D:1,E:5)80:2)70:2,B:2):0.5);",
+        )
+        # the branch data moves with the branch as the path to the root flips
+        tree = sp.p_newick.parse("(((A:1,B:2)90[&!color=#ff0000]:1,C:1)70:1,D:1);")
+        self.assertEqual(
+            newick(alg.rootOutgroup(tree, lambda label: label == "A")),
+            "(A:0.5,((D:2,C:1)'90'[&!color=#ff0000]:1,B:2):0.5);",
+        )
+        # an outgroup already beside the root only moves the root along its branch
+        tree = sp.p_newick.parse("((A:1,B:2):1,(C:1,D:1):3);")
+        self.assertEqual(
+            newick(alg.rootOutgroup(tree, lambda label: label in "CD")),
+            "((A:1,B:2):2,(C:1,D:1):2);",
+        )
+        tree = sp.p_newick.parse("(A:1,(B:1,C:1)X:2,(D:1,E:1)Y:3)R;")
+        self.assertEqual(
+            newick(alg.reroot(tree, tree.kids[2].kids[0], 0.25)),
+            "(D:0.25,((A:1,(B:1,C:1)X:2)Y:3,E:1):0.75);",
+        )
+        tree = sp.p_newick.parse("((A:1,B:1):1,(C:1,D:1):1);")
+        with self.assertRaises(ValueError):
+            alg.rootOutgroup(tree, lambda label: label in "AC")
+        self.assertIsNone(alg.rootOutgroup(tree, lambda label: False))
+
+    def test_rootMidpoint(self):
+        tree = sp.p_newick.parse(
+            "(X1:0.3,(X2:0.3,(X3:0.3,(X4:0.3,(X5:0.3,X6:0.3):0.3):0.3):0.3):0.3);"
+        )
+        self.assertEqual(
+            newick(alg.rootMidpoint(tree)),
+            "((X4:0.3,(X5:0.3,X6:0.3):0.3):0.3,(X3:0.3,(X2:0.3,X1:0.6):0.3):0);",
+        )
+        with self.assertRaises(ValueError):
+            alg.rootMidpoint(sp.p_newick.parse("((A:1,B):1,C:1);"))
+
+        # on random trees, the deepest tips on each side of the new root are
+        # equally deep and the distances between tips do not change
+        random.seed(42)
+        for _ in range(20):
+            nodes = [
+                makeNode(label=f"t{i}", length=random.random()) for i in range(30)
+            ]
+            while len(nodes) > 1:
+                kids = [nodes.pop(random.randrange(len(nodes))) for _ in range(2)]
+                nodes.append(makeNode(kids=kids, length=random.random()))
+
+            def distances(tree):
+                (tipNodes, depths, between) = alg.patristicProfile(tree)
+                labels = [tip.data.label for tip in tipNodes]
+                return {
+                    (labels[i], labels[j]): round(d, 9)
+                    for i in range(len(labels))
+                    for (j, d) in enumerate(distance.distanceRow(depths, between, i))
+                }
+
+            before = distances(nodes[0])
+            tree = alg.rootMidpoint(nodes[0])
+            deepest = [
+                max(depth for (_, depth) in alg.nodeDepths(kid)) + kid.data.length
+                for kid in tree.kids
+            ]
+            self.assertEqual(len(deepest), 2)
+            self.assertAlmostEqual(deepest[0], deepest[1])
+            self.assertAlmostEqual(max(before.values()), 2 * deepest[0], places=6)
+            self.assertEqual(distances(tree), before)
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        # the parser and the algorithms are not loaded just to start the CLI
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, smot.main; print(sorted(m for m in sys.modules if m.startswith('smot')))",
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        ).stdout
+        self.assertNotIn("smot.parser", loaded)
+        self.assertNotIn("smot.algorithm", loaded)
+        # but the package exports still resolve
+        import smot
+
+        self.assertIs(smot.read_text, sp.read_text)
+        self.assertIs(smot.tips, alg.tips)
+
+    def test_exports(self):
+        import ast
+        import importlib
+        import smot
+
+        # every public name resolves lazily in a fresh interpreter
+        resolved = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import smot; print([n for n in smot.__all__ if not getattr(smot, n)])",
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        ).stdout
+        self.assertEqual(resolved.strip(), "[]")
+        for name in smot.__all__:
+            module = importlib.import_module(smot._origins[name])
+            self.assertIs(getattr(smot, name), getattr(module, name))
+        # and the imports for type checkers name the same functions
+        with open(smot.__file__) as fh:
+            checked = ast.parse(fh.read()).body[1]
+        self.assertIsInstance(checked, ast.If)
+        imported = {
+            alias.name
+            for statement in ast.walk(checked)
+            if isinstance(statement, ast.ImportFrom)
+            for alias in statement.names
+        }
+        self.assertEqual(sorted(imported), smot.__all__)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,68 +1,107 @@
-from smot.algorithm import (
-    treemap,
-    treefold,
-    treecut,
-    treepull,
-    treepush,
-    tips,
-    clean,
-    factorByField,
-    factorByCapture,
-    factorByTable,
-    isMonophyletic,
-    imputeMonophyleticFactors,
-    imputePatristicFactors,
-    getLeftmost,
-    sampleN,
-    sampleRandom,
-    sampleMonophyletic,
-    sampleParaphyletic,
-    sampleEqual,
-    colorTree,
-    colorMono,
-    colorPara,
-    filterMono,
-)
+from typing import TYPE_CHECKING
 
-from smot.parser import read_file, read_text
+# For type checkers, the public names of _exports (below)
+if TYPE_CHECKING:
+    from smot.algorithm import (  # noqa: F401
+        treemap,
+        treefold,
+        treecut,
+        treepull,
+        treepush,
+        preorder,
+        postorder,
+        leaves,
+        levelorder,
+        tips,
+        clean,
+        factorByField,
+        factorByCapture,
+        factorByTable,
+        isMonophyletic,
+        imputeMonophyleticFactors,
+        imputePatristicFactors,
+        getLeftmost,
+        sampleN,
+        sampleRandom,
+        sampleMonophyletic,
+        sampleParaphyletic,
+        sampleEqual,
+        colorTree,
+        colorMono,
+        colorPara,
+        filterMono,
+        MRCAIndex,
+    )
 
-from smot.format import newick, nexus
+    from smot.parser import read_file, read_text, read_trees  # noqa: F401
 
-from smot.classes import (
-    makeTree,
-    makeNodeData,
-    makeNode,
-)
+    from smot.sharing import SubtreeTable, Snapshot, unshare  # noqa: F401
 
-__all__ = [
-    "treemap",
-    "treefold",
-    "treecut",
-    "treepull",
-    "treepush",
-    "tips",
-    "clean",
-    "factorByField",
-    "factorByCapture",
-    "factorByTable",
-    "isMonophyletic",
-    "imputeMonophyleticFactors",
-    "imputePatristicFactors",
-    "getLeftmost",
-    "sampleN",
-    "sampleRandom",
-    "sampleMonophyletic",
-    "sampleParaphyletic",
-    "sampleEqual",
-    "colorTree",
-    "colorMono",
-    "colorPara",
-    "filterMono",
-    "read_file",
-    "read_text",
-    "newick",
-    "nexus",
-    "makeTree",
-    "makeNodeData",
-    "makeNode",
-]
+    from smot.format import newick, nexus, write_newick, write_nexus  # noqa: F401
+
+    from smot.binary import read_binary, write_binary  # noqa: F401
+
+    from smot.classes import (  # noqa: F401
+        makeTree,
+        makeNodeData,
+        makeNode,
+    )
+
+# The public functions are imported from their modules on first use, so that
+# importing smot (or running the smot command) does not pay for the parser
+# grammar and the algorithms until they are needed.
+_exports = {
+    "smot.algorithm": [
+        "treemap",
+        "treefold",
+        "treecut",
+        "treepull",
+        "treepush",
+        "preorder",
+        "postorder",
+        "leaves",
+        "levelorder",
+        "tips",
+        "clean",
+        "factorByField",
+        "factorByCapture",
+        "factorByTable",
+        "isMonophyletic",
+        "imputeMonophyleticFactors",
+        "imputePatristicFactors",
+        "getLeftmost",
+        "sampleN",
+        "sampleRandom",
+        "sampleMonophyletic",
+        "sampleParaphyletic",
+        "sampleEqual",
+        "colorTree",
+        "colorMono",
+        "colorPara",
+        "filterMono",
+        "MRCAIndex",
+    ],
+    "smot.parser": ["read_file", "read_text", "read_trees"],
+    "smot.sharing": ["SubtreeTable", "Snapshot", "unshare"],
+    "smot.format": ["newick", "nexus", "write_newick", "write_nexus"],
+    "smot.binary": ["read_binary", "write_binary"],
+    "smot.classes": ["makeTree", "makeNodeData", "makeNode"],
+}
+
+_origins = {name: module for (module, names) in _exports.items() for name in names}
+
+__all__ = sorted(_origins)
+
+
+def __getattr__(name):
+    if name in _origins:
+        import importlib
+
+        value = getattr(importlib.import_module(_origins[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module 'smot' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -4,6 +4,7 @@ from typing import (
     Callable,
     Dict,
     Iterable,
+    Iterator,
     List,
     Optional,
     Pattern,
@@ -15,7 +16,7 @@ from typing import (
 )
 
 from smot.classes import Node, NodeData, F, LC, FC, BL, AnyNode, AnyNodeData, makeNode
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
 import re
 import math
 import random
@@ -103,6 +104,65 @@ def treepush(
     return node
 
 
+# A node with its depth (the root is at depth 0) and parent (None for the root)
+Visit = Tuple[AnyNode, int, Optional[AnyNode]]
+
+
+def preorder(node: AnyNode) -> Iterator[Visit]:
+    """
+    Yield the nodes of a tree, each before its children, as (node, depth,
+    parent). Nodes are visited as they are yielded, so a search that stops
+    early does not walk the rest of the tree.
+    """
+    stack: List[Visit] = [(node, 0, None)]
+    while stack:
+        visit = stack.pop()
+        yield visit
+        (node, depth, _) = visit
+        stack.extend(
+            (kid, depth + 1, node) for kid in reversed(node.kids) if kid is not None
+        )
+
+
+def postorder(node: AnyNode) -> Iterator[Visit]:
+    """
+    Yield the nodes of a tree, each after its children, as (node, depth,
+    parent)
+    """
+    stack: List[Tuple[AnyNode, int, Optional[AnyNode], Iterator[AnyNode]]] = [
+        (node, 0, None, iter(node.kids))
+    ]
+    while stack:
+        (node, depth, parent, kids) = stack[-1]
+        for kid in kids:
+            if kid is not None:
+                stack.append((kid, depth + 1, node, iter(kid.kids)))
+                break
+        else:
+            stack.pop()
+            yield (node, depth, parent)
+
+
+def leaves(node: AnyNode) -> Iterator[Visit]:
+    """
+    Yield the tips of a tree in order, as (node, depth, parent)
+    """
+    return (visit for visit in preorder(node) if visit[0].data.isLeaf)
+
+
+def levelorder(node: AnyNode) -> Iterator[Visit]:
+    """
+    Yield the nodes of a tree by depth, the root first, as (node, depth,
+    parent)
+    """
+    queue: deque = deque([(node, 0, None)])
+    while queue:
+        visit = queue.popleft()
+        yield visit
+        (node, depth, _) = visit
+        queue.extend((kid, depth + 1, node) for kid in node.kids if kid is not None)
+
+
 def unnone(xs: List[Optional[A]]) -> List[A]:
     return [x for x in xs if x is not None]
 
@@ -126,6 +186,26 @@ def requireBranchLengths(node: Node[F, LC, FC, BL]) -> Node[F, LC, FC, float]:
         return node_
 
 
+def nodeDepths(node: AnyNode) -> Iterator[Tuple[AnyNode, float]]:
+    """
+    Yield each node with its distance from the root, in preorder.
+
+    The length of the root branch is not counted. As with requireBranchLengths,
+    an error is raised unless all branches below the root are positive and
+    defined.
+    """
+    stack: List[Tuple[AnyNode, float]] = [(node, 0.0)]
+    while stack:
+        (node, depth) = stack.pop()
+        yield (node, depth)
+        for kid in reversed(node.kids):
+            if kid.data.length is None:
+                raise ValueError("Expected all branch lengths to be defined")
+            elif kid.data.length < 0:
+                raise ValueError("Expected all branch lengths to be positive")
+            stack.append((kid, depth + kid.data.length))
+
+
 def setNLeafs(node: Node[F, LC, FC, BL]) -> Node[F, int, FC, BL]:
     """
     Count the number of leafs descending from each branch.
@@ -270,24 +350,27 @@ def factorByLabel(
     return treemap(node, mapfun)
 
 
-def factorByField(node: AnyNode, field: int, sep: str = "|") -> AnyNode:
+def factorByFieldFun(name: Optional[str], field: int, sep: str = "|") -> Optional[str]:
     """
-    Factor by the <field>th 1-based index in the tip label.
+    Determine a tip factor from the <field>th 1-based index in the tip label.
     """
-
-    def _fun(name: Optional[str]) -> Optional[str]:
-        if name is None:
+    if name is None:
+        return None
+    else:
+        fields = name.split(sep)
+        try:
+            return fields[field - 1]
+        except IndexError:
+            # if there are not enough fields in this taxon,
+            # leave the taxon unlabeled
             return None
-        else:
-            fields = name.split(sep)
-            try:
-                return fields[field - 1]
-            except IndexError:
-                # if there are not enough fields in this taxon,
-                # leave the taxon unlabeled
-                return None
 
-    return factorByLabel(node, _fun)
+
+def factorByField(node: AnyNode, field: int, sep: str = "|") -> AnyNode:
+    """
+    Factor by the <field>th 1-based index in the tip label.
+    """
+    return factorByLabel(node, lambda x: factorByFieldFun(x, field, sep=sep))
 
 
 def factorByCaptureFun(
@@ -317,15 +400,21 @@ def factorByCapture(
     return factorByLabel(node, lambda x: factorByCaptureFun(x, pat, default=default))
 
 
-def factorByTable(node: AnyNode, table: Dict[str, str], default=None):
-    def _fun(name):
-        if name:
-            for k, v in table.items():
-                if k in name:
-                    return v
-        return default
+def factorByTableFun(
+    name: Optional[str], table: Dict[str, str], default: Optional[str] = None
+) -> Optional[str]:
+    """
+    Determine a tip factor from the first key of a table found in the label.
+    """
+    if name:
+        for k, v in table.items():
+            if k in name:
+                return v
+    return default
 
-    return factorByLabel(node, _fun)
+
+def factorByTable(node: AnyNode, table: Dict[str, str], default=None):
+    return factorByLabel(node, lambda x: factorByTableFun(x, table, default=default))
 
 
 def isMonophyletic(node: Node[F, LC, Counter, BL]) -> bool:
@@ -473,24 +562,13 @@ def sampleRandom(
     Sample N random tips from node
     """
 
-    def _collect(b, d):
-        if d.isLeaf:
-            b.append(d.label)
-        return b
-
-    keepers: List[str]
-    samplers: List[str]
-    (keepers, samplers) = partition_list(treefold(node, _collect, []), keep_fun)
-
-    # use the given function count_fun to decide how many tips to sample, but
-    # never sample more than there are
-    n = count_fun(samplers)
+    (keepers, samplers, n) = _randomGroup(node, count_fun, keep_fun)
 
     # if we are sampling everything, just return the origin
-    if n >= len(samplers):
+    if not samplers:
         return node
 
-    chosen = set(rng.sample(samplers, n) + keepers)
+    chosen = set(rng.sample(samplers, n)) | keepers
 
     def _cull(node):
         chosenOnes = [
@@ -503,6 +581,33 @@ def sampleRandom(
     return sampledTree
 
 
+def _randomGroup(
+    node: AnyNode,
+    count_fun: Callable[[Sized], int],
+    keep_fun: Callable[[str], bool],
+) -> Tuple[Set[str], List[str], int]:
+    """
+    The tips that sampleRandom keeps, the tips it samples from and the number
+    it draws. If all tips are kept, there are none to sample from.
+    """
+
+    def _collect(b, d):
+        if d.isLeaf:
+            b.append(d.label)
+        return b
+
+    keepers: List[str]
+    samplers: List[str]
+    (keepers, samplers) = partition_list(treefold(node, _collect, []), keep_fun)
+
+    # use the given function count_fun to decide how many tips to sample, but
+    # never sample more than there are
+    n = count_fun(samplers)
+    if n >= len(samplers):
+        return (set(keepers + samplers), [], 0)
+    return (set(keepers), samplers, n)
+
+
 def distribute(count: int, groups: int, sizes: Optional[List[int]] = None) -> List[int]:
     """
     Break n into k groups
@@ -603,24 +708,15 @@ def sampleParaphyletic(
     return subsampled_tree
 
 
-# Prepare the sampling function for the paraphyletic sampling algorithms
-#
-# sampleParaphyletic finds sampling groups as it traverses the tree, the groups
-# are downsampled using the function produced here. Most of the algorithmic
-# complexity is in sampleParaphyletic, but most of the parameterization happens
-# here in the sampler.
-def _makeParaphyleticSampler(
-    keep: List[str] = [],
-    keep_regex: str = "",
+def paraphyleticCounter(
     proportion: Optional[float] = None,
     scale: Optional[float] = None,
     number: Optional[int] = None,
     minTips: int = 1,
-    seed: Optional[int] = None,
-    keep_ends: bool = False,
-) -> Callable[[Set[str], Optional[str], List[Optional[str]]], Set[str]]:
-
-    rng = random.Random(seed)
+) -> Callable[[Sized], int]:
+    """
+    The number of tips that paraphyletic sampling keeps from a sampling group
+    """
 
     # Choose a sampling algorithm
     # proportional selects samples from the sampling group with 0-1 probability
@@ -654,15 +750,78 @@ def _makeParaphyleticSampler(
 
         raise ValueError("No sampling strategy given")
 
-    def keep_search(x: str) -> bool:
-        return bool(re.search(keep_regex, x))
+    return _sample
+
+
+# Prepare the sampling function for the paraphyletic sampling algorithms
+#
+# sampleParaphyletic finds sampling groups as it traverses the tree, the groups
+# are downsampled using the function produced here. Most of the algorithmic
+# complexity is in sampleParaphyletic, but most of the parameterization happens
+# here in the sampler.
+def _makeParaphyleticSampler(
+    keep: List[str] = [],
+    keep_regex: str = "",
+    proportion: Optional[float] = None,
+    scale: Optional[float] = None,
+    number: Optional[int] = None,
+    minTips: int = 1,
+    seed: Optional[int] = None,
+    keep_ends: bool = False,
+) -> Callable[[Set[str], Optional[str], List[Optional[str]]], Set[str]]:
+
+    rng = random.Random(seed)
+
+    _group = _makeParaphyleticGrouper(
+        keep=keep,
+        keep_regex=keep_regex,
+        proportion=proportion,
+        scale=scale,
+        number=number,
+        minTips=minTips,
+        keep_ends=keep_ends,
+    )
 
     #  Internal sampling function used by sampleParaphyletic
     def _sampleLabels(
         labels: Set[str], factor: Optional[str], ends: List[Optional[str]]
     ) -> Set[str]:
+        (keepers, samplers, N) = _group(labels, factor, ends)
+        try:
+            sample = set(rng.sample(samplers, N))
+        except ValueError:
+            raise ValueError(
+                f"Bad sample size ({N}) for population of size ({len(labels)})"
+            )
+        return sample | keepers
+
+    return _sampleLabels
+
+
+# Split a paraphyletic sampling group into the tips that are always kept, the
+# tips that are sampled from (sorted, for reproducibility) and the number drawn
+def _makeParaphyleticGrouper(
+    keep: List[str] = [],
+    keep_regex: str = "",
+    proportion: Optional[float] = None,
+    scale: Optional[float] = None,
+    number: Optional[int] = None,
+    minTips: int = 1,
+    keep_ends: bool = False,
+) -> Callable[
+    [Set[str], Optional[str], List[Optional[str]]], Tuple[Set[str], List[str], int]
+]:
+
+    _sample = paraphyleticCounter(proportion, scale, number, minTips)
+
+    def keep_search(x: str) -> bool:
+        return bool(re.search(keep_regex, x))
+
+    def _groupLabels(
+        labels: Set[str], factor: Optional[str], ends: List[Optional[str]]
+    ) -> Tuple[Set[str], List[str], int]:
         if factor is not None and factor in keep:
-            return labels
+            return (labels, [], 0)
         else:
             keepers: Set[str] = set()
             samplers: Set[str] = labels
@@ -674,17 +833,9 @@ def _makeParaphyleticSampler(
                 keepers.update(unnone(ends))
                 samplers = {s for s in samplers if s not in ends}
 
-            N = _sample(samplers)
-            try:
-                # sort for reproducibility
-                sample = set(rng.sample(sorted(list(samplers)), N))
-            except ValueError:
-                raise ValueError(
-                    f"Bad sample size ({N}) for population of size ({len(labels)})"
-                )
-            return sample | keepers
+            return (keepers, sorted(list(samplers)), _sample(samplers))
 
-    return _sampleLabels
+    return _groupLabels
 
 
 # recursive function for creating sampling groups
@@ -767,23 +918,16 @@ def _selectParaphyletic(
     return selected
 
 
-def sampleMonophyletic(
-    node: AnyNode,
+def monophyleticCounter(
     proportion: Optional[float] = None,
     scale: Optional[float] = None,
     number: Optional[int] = None,
-    keep: List[str] = [],
-    keep_regex: str = "",
     minTips: int = 1,
-    seed: Optional[int] = None,
-) -> Node[Optional[str], int, Counter, BL]:
-
-    # Pull factor sets up into each node, this is a performance optimization.
-    # Without it I would have to traverse the entire subtree beneath each node.
-    factoredNode = setFactorCounts(node)
-
-    rng = random.Random(seed)
-
+) -> Callable[[Sized], int]:
+    """
+    The number of tips that monophyletic sampling draws from a clade (all of
+    them if this is at least the size of the clade)
+    """
     count_fun: Callable[[Sized], int]
     if proportion is not None:
 
@@ -805,6 +949,28 @@ def sampleMonophyletic(
         def count_fun(xs):
             return len(xs)
 
+    return count_fun
+
+
+def sampleMonophyletic(
+    node: AnyNode,
+    proportion: Optional[float] = None,
+    scale: Optional[float] = None,
+    number: Optional[int] = None,
+    keep: List[str] = [],
+    keep_regex: str = "",
+    minTips: int = 1,
+    seed: Optional[int] = None,
+) -> Node[Optional[str], int, Counter, BL]:
+
+    # Pull factor sets up into each node, this is a performance optimization.
+    # Without it I would have to traverse the entire subtree beneath each node.
+    factoredNode = setFactorCounts(node)
+
+    rng = random.Random(seed)
+
+    count_fun = monophyleticCounter(proportion, scale, number, minTips)
+
     if keep_regex:
         keep_fun = lambda label: bool(re.search(keep_regex, label))
     else:
@@ -830,6 +996,150 @@ def sampleMonophyletic(
     return clean(_sampleMonophyletic(factoredNode))
 
 
+# Sampling plans, for replicate samples of one tree
+#
+# The samplers above find their sampling groups as they walk the tree and draw
+# from each group as it is found. A plan records the groups instead: the tips
+# that are always kept and, for each group, the tips that are sampled from and
+# the number that are drawn. Drawing from the groups of a plan in order, with
+# the generator a sampler would use, draws exactly the tips that the sampler
+# would keep with the same seed. So the tree is factored and grouped once, and
+# each further replicate only costs its draws.
+
+
+class SamplingPlan:
+    """
+    The sampling groups of a tree, see `drawSample`
+    """
+
+    def __init__(self) -> None:
+        # the tips kept in every sample
+        self.kept: Set[str] = set()
+        # the groups as (tips to sample from, number drawn), in the order they
+        # are drawn in. Each segment is drawn with a newly seeded generator.
+        self.segments: List[List[Tuple[List[str], int]]] = []
+        # the clades that the sampler cuts and cleans on their own (see
+        # `smot.sharing.Snapshot.keep`)
+        self.clades: List[AnyNode] = []
+
+    def update(self, plan: SamplingPlan) -> None:
+        """
+        Add the groups of another plan, drawn after those of this plan
+        """
+        self.kept.update(plan.kept)
+        self.segments.extend(plan.segments)
+        self.clades.extend(plan.clades)
+
+
+def drawSample(plan: SamplingPlan, seed: Optional[int] = None) -> Set[str]:
+    """
+    The tips that one sample of a plan keeps
+    """
+    selected = set(plan.kept)
+    for segment in plan.segments:
+        rng = random.Random(seed)
+        for (samplers, n) in segment:
+            selected.update(rng.sample(samplers, n))
+    return selected
+
+
+def paraphyleticPlan(node: AnyNode, **kwargs: Any) -> SamplingPlan:
+    """
+    The plan of sampleParaphyletic, which takes the same arguments but a seed
+    """
+    plan = SamplingPlan()
+    groups: List[Tuple[List[str], int]] = []
+    _group = _makeParaphyleticGrouper(**kwargs)
+
+    def _record(
+        labels: Set[str], factor: Optional[str], ends: List[Optional[str]]
+    ) -> Set[str]:
+        (keepers, samplers, n) = _group(labels, factor, ends)
+        plan.kept.update(keepers)
+        # an empty draw does not advance the generator
+        if n > 0:
+            groups.append((samplers, n))
+        return set()
+
+    _selectParaphyletic(
+        node=setFactorCounts(node),
+        sampler=_record,
+        selected=set(),
+        paraGroup=set(),
+        paraFactor=None,
+    )
+    plan.segments.append(groups)
+    return plan
+
+
+def monophyleticPlan(
+    node: AnyNode,
+    proportion: Optional[float] = None,
+    scale: Optional[float] = None,
+    number: Optional[int] = None,
+    keep: List[str] = [],
+    keep_regex: str = "",
+    minTips: int = 1,
+) -> SamplingPlan:
+    """
+    The plan of sampleMonophyletic, which takes the same arguments but a seed
+    """
+    plan = SamplingPlan()
+    groups: List[Tuple[List[str], int]] = []
+
+    count_fun = monophyleticCounter(proportion, scale, number, minTips)
+
+    if keep_regex:
+        keep_fun = lambda label: bool(re.search(keep_regex, label))
+    else:
+        keep_fun = lambda label: False
+
+    def _plan(node_):
+        nfactors = len(node_.data.factorCount)
+        if nfactors == 1 and list(node_.data.factorCount.keys())[0] in keep:
+            plan.kept.update(tips(node_))
+        elif nfactors <= 1:
+            (keepers, samplers, n) = _randomGroup(node_, count_fun, keep_fun)
+            plan.kept.update(keepers)
+            if samplers:
+                groups.append((samplers, n))
+                plan.clades.append(node_)
+            if not node_.kids:
+                # sampleRandom never cuts a lone tip, even if it draws none
+                plan.kept.update(samplers)
+        else:
+            for kid in node_.kids:
+                _plan(kid)
+
+    _plan(setFactorCounts(node))
+    plan.segments.append(groups)
+    return plan
+
+
+def filterPlan(
+    node: Node[F, LC, Counter, BL],
+    condition: Callable[[Node[F, LC, Counter, BL]], bool],
+    cladePlan: Callable[[Node[F, LC, Counter, BL]], SamplingPlan],
+) -> SamplingPlan:
+    """
+    The plan that samples each clade that filterMono would act on with the
+    plan of the clade, keeping all other tips
+    """
+    plan = SamplingPlan()
+
+    def _plan(node_):
+        if len(node_.data.factorCount) == 1 and condition(node_):
+            plan.update(cladePlan(node_))
+        elif len(node_.data.factorCount) == 1 or not node_.kids:
+            plan.kept.update(tips(node_))
+        else:
+            for kid in node_.kids:
+                _plan(kid)
+
+    _plan(node)
+    return plan
+
+
 def colorTree(node: AnyNode, color: str) -> AnyNode:
     def fun_(d):
         d.form["!color"] = color
@@ -896,3 +1206,293 @@ def colorPara(
                 pass
         node.kids = [colorPara(kid, colormap) for kid in node.kids]
     return node
+
+
+class MRCAIndex:
+    """
+    Answers most recent common ancestor (MRCA) queries over the tips of a tree
+    in constant time, after a linear-time walk of the tree.
+
+    Tips are numbered in the order of `tips`. The Euler tour of the tree visits
+    the tips in this order, and the shallowest node the tour visits between
+    tips i and j is their MRCA. So the index keeps, for each pair of adjacent
+    tips, the shallowest node between them, and a sparse table of the minima
+    over every power-of-two run of these pairs. The MRCA of any set of tips is
+    the MRCA of its first and last tip.
+
+    The index must be rebuilt if the topology of the tree changes.
+    """
+
+    def __init__(self, node: AnyNode):
+        from array import array
+
+        # nodes are keyed by their depth and preorder index, so the smallest
+        # key is the shallowest node
+        self.nodes: List[AnyNode] = []
+        self.tipNodes: List[AnyNode] = []
+        between = array("q")
+
+        # the tour goes up from a tip to the parent of the next node in
+        # preorder, which is the MRCA of that tip and the next
+        afterTip = False
+        stack = [(node, -1)]
+        while stack:
+            (node, parentKey) = stack.pop()
+            if afterTip:
+                between.append(parentKey)
+            key = (((parentKey >> 32) + 1) << 32) | len(self.nodes)
+            self.nodes.append(node)
+            afterTip = node.data.isLeaf
+            if afterTip:
+                self.tipNodes.append(node)
+            else:
+                stack.extend((kid, key) for kid in reversed(node.kids))
+
+        # table[k][i] is the shallowest node between tips i and i + 2^k
+        self._table = [between]
+        width = 1
+        while 2 * width <= len(between):
+            last = self._table[-1]
+            self._table.append(array("q", map(min, last[:-width], last[width:])))
+            width *= 2
+
+        self._tipIndices: Optional[Dict[str, List[int]]] = None
+
+    def lca(self, i: int, j: int) -> AnyNode:
+        """
+        The MRCA of the ith and jth tips
+        """
+        if i > j:
+            (i, j) = (j, i)
+        if i == j:
+            return self.tipNodes[i]
+        k = (j - i).bit_length() - 1
+        level = self._table[k]
+        key = min(level[i], level[j - (1 << k)])
+        return self.nodes[key & 0xFFFFFFFF]
+
+    def mrca(self, indices: Iterable[int]) -> Optional[AnyNode]:
+        """
+        The MRCA of a set of tips, given by their indices, or None if the set
+        is empty
+        """
+        indices = list(indices)
+        if not indices:
+            return None
+        return self.lca(min(indices), max(indices))
+
+    def tipIndices(self, label: str) -> List[int]:
+        """
+        The indices of the tips with a label
+        """
+        if self._tipIndices is None:
+            self._tipIndices = defaultdict(list)
+            for (i, tip) in enumerate(self.tipNodes):
+                self._tipIndices[tip.data.label].append(i)
+        return self._tipIndices.get(label, [])
+
+    def mrcaOfMatches(self, matcher: Callable[[str], bool]) -> Optional[AnyNode]:
+        """
+        The MRCA of the tips whose labels match, or None if no tip matches
+        """
+        return self.mrca(
+            i for (i, tip) in enumerate(self.tipNodes) if matcher(tip.data.label)
+        )
+
+
+def patristicProfile(node: AnyNode) -> Tuple[List[AnyNode], List[float], List[float]]:
+    """
+    Measure a tree for patristic distances (see smot.distance).
+
+    Returns the tips (in the order of `tips`), the distance from the root to
+    each tip, and the distance from the root to the MRCA of each pair of
+    adjacent tips. The length of the root branch is not counted. An error is
+    raised unless all branches below the root are positive and defined.
+    """
+    tipNodes: List[AnyNode] = []
+    depths: List[float] = []
+    between: List[float] = []
+
+    # as in MRCAIndex, the parent of the node after a tip in preorder is the
+    # MRCA of that tip and the next
+    afterTip = False
+    stack: List[Tuple[AnyNode, float, float]] = [(node, 0.0, 0.0)]
+    while stack:
+        (node, parentDepth, depth) = stack.pop()
+        if afterTip:
+            between.append(parentDepth)
+        afterTip = node.data.isLeaf
+        if afterTip:
+            tipNodes.append(node)
+            depths.append(depth)
+        else:
+            for kid in reversed(node.kids):
+                length = kid.data.length
+                if length is None:
+                    raise ValueError("Expected all branch lengths to be defined")
+                elif length < 0:
+                    raise ValueError("Expected all branch lengths to be positive")
+                stack.append((kid, depth, depth + length))
+    return (tipNodes, depths, between)
+
+
+def _preorder(node: AnyNode) -> Tuple[List[AnyNode], List[int]]:
+    """
+    The nodes of a tree in preorder, with the index of the parent of each
+    """
+    nodes: List[AnyNode] = []
+    parents: List[int] = []
+    stack = [(node, -1)]
+    while stack:
+        (node, parent) = stack.pop()
+        nodes.append(node)
+        parents.append(parent)
+        stack.extend((kid, len(nodes) - 1) for kid in reversed(node.kids))
+    return (nodes, parents)
+
+
+def _addLengths(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return a if b is None else (b if a is None else a + b)
+
+
+def reroot(
+    node: AnyNode, target: AnyNode, distance: Optional[float] = None
+) -> AnyNode:
+    """
+    Root a tree on the branch above `target`, `distance` above it (by default,
+    halfway along the branch).
+
+    The branches on the path from the target to the old root are reversed.
+    The data of a branch (its length, form and, for internal nodes, the label,
+    such as a support value) moves with it to the node that is now below it.
+    The old root is removed if it is left with one child, joining its two
+    branches, as in `clean`. Runs in linear time.
+    """
+    (nodes, parents) = _preorder(node)
+    index = {id(n): i for (i, n) in enumerate(nodes)}
+    path = [index[id(target)]]
+    while parents[path[-1]] >= 0:
+        path.append(parents[path[-1]])
+    if len(path) == 1:
+        return node
+
+    length = target.data.length
+    if distance is None and length is not None:
+        distance = length / 2
+
+    # from the old root down, each node on the path gives up the child below it
+    # and takes the node above it (reversed already) as a child in its place
+    above: Optional[AnyNode] = None
+    for i in range(len(path) - 1, 0, -1):
+        upper = nodes[path[i]]
+        lower = nodes[path[i - 1]]
+        j = next(j for (j, kid) in enumerate(upper.kids) if kid is lower)
+        if above is None:
+            upper.kids = upper.kids[:j] + upper.kids[j + 1 :]
+        else:
+            upper.kids = upper.kids[:j] + [above] + upper.kids[j + 1 :]
+        form = lower.data.form
+        upper.data.form = None if form is None else dict(form)
+        upper.data.label = None if lower.data.isLeaf else lower.data.label
+        if i > 1:
+            upper.data.length = lower.data.length
+        elif length is None or distance is None:
+            upper.data.length = None
+        else:
+            # the branch above the target is split at the new root
+            upper.data.length = length - distance
+        above = upper
+        if i == len(path) - 1 and len(upper.kids) == 1:
+            above = upper.kids[0]
+            above.data.length = _addLengths(above.data.length, upper.data.length)
+        elif not upper.kids:
+            above = None
+
+    target.data.length = distance
+    root = makeNode(kids=[target] + ([] if above is None else [above]))
+    return root
+
+
+def rootMidpoint(node: AnyNode) -> AnyNode:
+    """
+    Root a tree halfway between the two tips that are farthest apart.
+
+    The farthest tips are found in one pass: the two deepest tips below each
+    node, through different children, are the farthest pair of tips that meet
+    at that node. An error is raised unless all branches below the root are
+    positive and defined.
+    """
+    (nodes, parents) = _preorder(node)
+    # the deepest and second deepest tips below each node, through different
+    # children, as (distance, tip index)
+    first: List[Optional[Tuple[float, int]]] = [None] * len(nodes)
+    second: List[Optional[Tuple[float, int]]] = [None] * len(nodes)
+    (diameter, a, meet) = (-1.0, 0, 0)
+    for i in range(len(nodes) - 1, -1, -1):
+        top = first[i]
+        if top is None:
+            top = first[i] = (0.0, i)
+        elif second[i] is not None:
+            d = cast(Tuple[float, int], second[i])[0]
+            if top[0] + d > diameter:
+                (diameter, a, meet) = (top[0] + d, top[1], i)
+        p = parents[i]
+        if p < 0:
+            break
+        length = nodes[i].data.length
+        if length is None:
+            raise ValueError("Expected all branch lengths to be defined")
+        elif length < 0:
+            raise ValueError("Expected all branch lengths to be positive")
+        deepest = (top[0] + length, top[1])
+        if first[p] is None or deepest[0] > cast(Tuple[float, int], first[p])[0]:
+            (first[p], second[p]) = (deepest, first[p])
+        elif second[p] is None or deepest[0] > cast(Tuple[float, int], second[p])[0]:
+            second[p] = deepest
+    if diameter <= 0:
+        return node
+
+    # the midpoint is on the path from the deeper of the two tips up to where
+    # the two paths meet
+    x = a
+    distance = diameter / 2
+    while parents[x] != meet:
+        length = cast(float, nodes[x].data.length)
+        if distance <= length or math.isclose(distance, length):
+            break
+        distance -= length
+        x = parents[x]
+    # a midpoint within rounding of a node is on the node
+    length = cast(float, nodes[x].data.length)
+    if distance > length or math.isclose(distance, length):
+        distance = length
+    return reroot(node, nodes[x], distance)
+
+
+def rootOutgroup(node: AnyNode, matcher: Callable[[str], bool]) -> Optional[AnyNode]:
+    """
+    Root a tree halfway along the branch above the MRCA of the tips that
+    match. If the matching tips span the root, the tree is rooted above the
+    MRCA of the other tips instead. Returns None if no tip matches.
+
+    An error is raised if all tips match or if neither side can be separated
+    from the other by one branch.
+    """
+    index = MRCAIndex(node)
+    matches = [matcher(tip.data.label) for tip in index.tipNodes]
+    target = index.mrca(i for (i, m) in enumerate(matches) if m)
+    if target is None:
+        return None
+    if target is node:
+        target = index.mrca(i for (i, m) in enumerate(matches) if not m)
+        if target is None:
+            raise ValueError("Expected some tips outside of the outgroup")
+        elif target is node:
+            raise ValueError("Expected the outgroup to be monophyletic")
+    if len(node.kids) == 2 and any(kid is target for kid in node.kids):
+        # already rooted on this branch, balance the two halves of it
+        (a, b) = (node.kids[0].data.length, node.kids[1].data.length)
+        if a is not None and b is not None:
+            node.kids[0].data.length = node.kids[1].data.length = (a + b) / 2
+        return node
+    return reroot(node, target)
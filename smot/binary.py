@@ -0,0 +1,235 @@
+from __future__ import annotations
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from smot.classes import Node, Tree, AnyNode, makeNodeData, makeTree
+from array import array
+import math
+import os
+import struct
+import sys
+
+# The binary format is laid out as follows (all integers little-endian):
+#
+#   header   MAGIC, version (u32), node count (u64), string count (u64)
+#   strings  character length of each string (u32[]), then the UTF-8 blob of
+#            all strings (u64 length + bytes)
+#   kids     number of children of each node in preorder (u32[])
+#   labels   string index of each node label, -1 for no label (i32[])
+#   lengths  branch length of each node, NaN for no length (f64[])
+#   forms    number of format entries of each node (u32[]), then key and
+#            value string indices for every entry (u64 count + i32[])
+#   extra    JSON encoded colmap and meta (u64 length + bytes)
+
+MAGIC = b"SMOTTREE"
+VERSION = 1
+
+_header = struct.Struct("<8sIQQ")
+_u64 = struct.Struct("<Q")
+
+
+def is_binary(data: bytes) -> bool:
+    return data[: len(MAGIC)] == MAGIC
+
+
+def _pack(typecode: str, xs: List) -> bytes:
+    arr = array(typecode, xs)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack(
+    typecode: str, data: memoryview, offset: int, n: int
+) -> Tuple[array, int]:
+    arr = array(typecode)
+    end = offset + n * arr.itemsize
+    arr.frombytes(data[offset:end])
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return (arr, end)
+
+
+def binary(tree: Tree) -> bytes:
+    """
+    Serialize a tree into the compact smot binary format
+    """
+    import json
+
+    strings: Dict[str, int] = dict()
+
+    def _index(s: Optional[str]) -> int:
+        if s is None:
+            return -1
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+
+    kids: List[int] = []
+    labels: List[int] = []
+    lengths: List[float] = []
+    nforms: List[int] = []
+    forms: List[int] = []
+
+    stack: List[AnyNode] = [tree.tree]
+    while stack:
+        node = stack.pop()
+        node_kids = [k for k in node.kids if k is not None]
+        kids.append(len(node_kids))
+        labels.append(_index(node.data.label))
+        lengths.append(math.nan if node.data.length is None else node.data.length)
+        nforms.append(len(node.data.form))
+        for (k, v) in node.data.form.items():
+            forms.append(_index(k))
+            forms.append(_index(v))
+        stack.extend(reversed(node_kids))
+
+    blob = "".join(strings.keys()).encode("utf-8")
+    extra = json.dumps(dict(colmap=tree.colmap, meta=tree.meta)).encode("utf-8")
+
+    return b"".join(
+        [
+            _header.pack(MAGIC, VERSION, len(kids), len(strings)),
+            _pack("I", [len(s) for s in strings.keys()]),
+            _u64.pack(len(blob)),
+            blob,
+            _pack("I", kids),
+            _pack("i", labels),
+            _pack("d", lengths),
+            _pack("I", nforms),
+            _u64.pack(len(forms)),
+            _pack("i", forms),
+            _u64.pack(len(extra)),
+            extra,
+        ]
+    )
+
+
+def read_binary(data: bytes) -> Tree:
+    """
+    Deserialize a tree from the compact smot binary format
+    """
+    import json
+
+    view = memoryview(data)
+    (magic, version, nnodes, nstrings) = _header.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a smot binary tree")
+    if version != VERSION:
+        raise ValueError(
+            f"Unsupported smot binary version {version}, expected {VERSION}"
+        )
+    offset = _header.size
+
+    (strlens, offset) = _unpack("I", view, offset, nstrings)
+    (bloblen,) = _u64.unpack_from(view, offset)
+    offset += _u64.size
+    blob = str(view[offset : offset + bloblen], "utf-8")
+    offset += bloblen
+    strings: List[str] = []
+    i = 0
+    for n in strlens:
+        strings.append(blob[i : i + n])
+        i += n
+
+    (kids, offset) = _unpack("I", view, offset, nnodes)
+    (labels, offset) = _unpack("i", view, offset, nnodes)
+    (lengths, offset) = _unpack("d", view, offset, nnodes)
+    (nforms, offset) = _unpack("I", view, offset, nnodes)
+    (nformidx,) = _u64.unpack_from(view, offset)
+    offset += _u64.size
+    (forms, offset) = _unpack("i", view, offset, nformidx)
+    (extralen,) = _u64.unpack_from(view, offset)
+    offset += _u64.size
+    extra = json.loads(str(view[offset : offset + extralen], "utf-8"))
+
+    # rebuild the tree from the preorder child counts, the stack holds the
+    # nodes that are still waiting for children
+    root: Optional[AnyNode] = None
+    stack: List[Tuple[AnyNode, int]] = []
+    f = 0
+    for i in range(nnodes):
+        form = dict()
+        for _ in range(nforms[i]):
+            form[strings[forms[f]]] = strings[forms[f + 1]]
+            f += 2
+        length: Optional[float] = lengths[i]
+        if length != length:
+            length = None
+        node: AnyNode = Node()
+        node.kids = []
+        node.data = makeNodeData(
+            label=strings[labels[i]] if labels[i] >= 0 else None,
+            form=form,
+            length=length,
+            isLeaf=kids[i] == 0,
+        )
+        if stack:
+            (parent, remaining) = stack[-1]
+            parent.kids.append(node)
+            if remaining == 1:
+                stack.pop()
+            else:
+                stack[-1] = (parent, remaining - 1)
+        else:
+            root = node
+        if kids[i] > 0:
+            stack.append((node, kids[i]))
+
+    if root is None:
+        raise ValueError("Expected at least one node in smot binary tree")
+
+    return makeTree(tree=root, colmap=extra["colmap"], meta=extra["meta"])
+
+
+def write_binary(tree: Tree, fh: BinaryIO) -> None:
+    fh.write(binary(tree))
+
+
+def cache_path(cache_dir: str, data: bytes) -> str:
+    """
+    The cache file for a tree is named by the hash of the raw input content
+    """
+    import hashlib
+
+    digest = hashlib.sha256(data).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.v{VERSION}.smot")
+
+
+def read_bytes(data: bytes, cache_dir: Optional[str] = None) -> Tree:
+    """
+    Read a tree from newick, nexus or smot binary content.
+
+    If a cache directory is given, a parsed text tree is stored there in binary
+    form and later reads of identical content load the binary copy.
+    """
+    if is_binary(data):
+        return read_binary(data)
+
+    if cache_dir is not None:
+        path = cache_path(cache_dir, data)
+        try:
+            with open(path, "rb") as fh:
+                return read_binary(fh.read())
+        except (OSError, ValueError, struct.error):
+            pass
+
+    from smot.parser import read_text
+
+    text = data.decode("utf-8")
+    # match the universal newline handling of files opened in text mode
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    tree = read_text(text)
+
+    if cache_dir is not None:
+        import tempfile
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first so concurrent readers never see a
+        # partially written cache entry
+        (fd, tmp) = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            write_binary(tree, fh)
+        os.replace(tmp, path)
+
+    return tree
@@ -0,0 +1,143 @@
+from __future__ import annotations
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import random
+
+from smot.classes import AnyNode
+
+# Hashed bipartitions (splits) of the tips of trees
+#
+# Every tip label gets an integer ID and every ID a random 64-bit key. The tips
+# below a node are hashed as the XOR of their keys, which is a hash of the tip
+# bitset of the clade: the hash of a node is the XOR of the hashes of its
+# children, so the splits of a tree are all hashed in one pass, whatever their
+# size, and each is stored in eight bytes. Two different splits share a hash
+# with a chance of about 2^-64 (per pair of splits).
+#
+# In an unrooted tree, a clade and the tips outside it are the same split, and
+# the hash of the outside is the hash of the clade XOR the hash of all tips, so
+# each split is hashed as the smaller of the two. Splits with one tip on a side
+# are in every tree and are skipped (in rooted trees, so is the root).
+#
+# Tip labels are expected to be unique within a tree.
+
+
+class TipKeys:
+    """
+    The integer IDs and the random keys of tip labels, shared by the trees
+    that are compared
+    """
+
+    def __init__(self, seed: int = 42):
+        self.ids: Dict[str, int] = dict()
+        self.keys: List[int] = []
+        self._rng = random.Random(seed)
+
+    def key(self, label: Optional[str]) -> int:
+        i = self.ids.get(label or "")
+        if i is None:
+            i = self.ids[label or ""] = len(self.keys)
+            self.keys.append(self._rng.getrandbits(64))
+        return self.keys[i]
+
+
+def splitHashes(
+    node: AnyNode,
+    keys: TipKeys,
+    rooted: bool = False,
+    tips: Optional[Set[str]] = None,
+) -> Iterator[Tuple[AnyNode, int]]:
+    """
+    Yield each node that splits the tips of a tree with the hash of its split,
+    children before parents.
+
+    If `tips` is given, other tips are ignored, as if they had been pruned.
+    """
+    # the nodes in preorder with the index of their parents
+    nodes: List[AnyNode] = []
+    parents: List[int] = []
+    stack = [(node, -1)]
+    while stack:
+        (node, parent) = stack.pop()
+        parents.append(parent)
+        nodes.append(node)
+        i = len(nodes) - 1
+        stack.extend((kid, i) for kid in node.kids)
+
+    # the hash and tip count of each node, children before parents
+    hashes = [0] * len(nodes)
+    counts = [0] * len(nodes)
+    for i in range(len(nodes) - 1, -1, -1):
+        data = nodes[i].data
+        if data.isLeaf and (tips is None or data.label in tips):
+            hashes[i] = keys.key(data.label)
+            counts[i] = 1
+        if parents[i] >= 0:
+            hashes[parents[i]] ^= hashes[i]
+            counts[parents[i]] += counts[i]
+
+    total = hashes[0]
+    n = counts[0]
+    largest = n - 1 if rooted else n - 2
+    for i in range(len(nodes) - 1, 0, -1):
+        if 1 < counts[i] <= largest:
+            yield (nodes[i], hashes[i] if rooted else min(hashes[i], hashes[i] ^ total))
+
+
+def splitSet(
+    node: AnyNode,
+    keys: TipKeys,
+    rooted: bool = False,
+    tips: Optional[Set[str]] = None,
+) -> Set[int]:
+    """
+    The hashes of the splits of a tree
+    """
+    return {h for (_, h) in splitHashes(node, keys, rooted, tips)}
+
+
+def robinsonFoulds(a: Set[int], b: Set[int]) -> Tuple[int, int, float]:
+    """
+    Compare the splits of two trees. Returns the number of shared splits, the
+    Robinson-Foulds distance (the number of splits in only one tree) and the
+    distance divided by the number of splits in both trees.
+    """
+    shared = len(a & b)
+    rf = len(a) + len(b) - 2 * shared
+    total = len(a) + len(b)
+    return (shared, rf, rf / total if total else 0.0)
+
+
+def splitSupport(
+    reference: AnyNode,
+    trees: Iterable[AnyNode],
+    keys: TipKeys,
+    rooted: bool = False,
+) -> Tuple[Dict[int, int], int]:
+    """
+    Count the trees that hold the split of each node of a reference tree.
+
+    Returns the counts by the id of each node of the reference and the number
+    of trees. Splits are compared on the tips that the trees share with the
+    reference. Only the splits of one tree are held at a time.
+    """
+    from smot.algorithm import tipSet
+
+    refTips = tipSet(reference)
+    refSplits = list(splitHashes(reference, keys, rooted))
+    counts: Dict[int, int] = {id(node): 0 for (node, _) in refSplits}
+    ntrees = 0
+    for tree in trees:
+        ntrees += 1
+        common = refTips & tipSet(tree)
+        if common == refTips:
+            ref = refSplits
+        else:
+            ref = list(splitHashes(reference, keys, rooted, common))
+        found = splitSet(tree, keys, rooted, common)
+        for (node, h) in ref:
+            # a split of all tips may not be a split of the shared tips, and
+            # the other way around
+            if h in found and id(node) in counts:
+                counts[id(node)] += 1
+    return (counts, ntrees)
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Optional, Dict, List, Generic, TypeVar, Any
+from typing import Optional, Dict, Iterable, List, Generic, TypeVar, Any
 
 from collections import Counter
 
@@ -10,10 +10,18 @@ BL = TypeVar("BL", None, Optional[float], float)
 
 
 class Tree:
-    def __init__(self, colmap: Dict[str, str] = dict(), meta: Dict[str, str] = dict()):
-        self.meta: Dict[str, str] = meta
-        self.colmap: Dict[str, str] = colmap
+    def __init__(
+        self,
+        colmap: Optional[Dict[str, str]] = None,
+        meta: Optional[Dict[str, str]] = None,
+    ):
+        # each tree has its own dictionaries, since commands modify them
+        self.meta: Dict[str, str] = dict() if meta is None else meta
+        self.colmap: Dict[str, str] = dict() if colmap is None else colmap
         self.tree: Any
+        # sampled versions of the tree (see `--replicates`), which are written
+        # in its place. They may be made as they are written.
+        self.replicates: Optional[Iterable[Any]] = None
 
 
 class NodeData(Generic[F, LC, FC, BL]):
@@ -62,8 +70,8 @@ BaseNode = Node[Optional[str], None, None, Optional[float]]
 
 def makeTree(
     tree: AnyNode,
-    colmap: Dict[str, str] = dict(),
-    meta: Dict[str, str] = dict(),
+    colmap: Optional[Dict[str, str]] = None,
+    meta: Optional[Dict[str, str]] = None,
 ):
     x = Tree(colmap, meta)
     x.tree = tree
@@ -0,0 +1,124 @@
+from __future__ import annotations
+from typing import Any, Callable, Counter, Dict, Iterator, List
+
+import collections
+import contextlib
+import functools
+
+# Opt-in counters of the work done by the algorithms in smot.algorithm
+#
+# While counting, the tree primitives and the public algorithms in
+# smot.algorithm are replaced with wrappers. The primitives are recursive and
+# call themselves through the module, so every call of a wrapped primitive is
+# one node visit. Outside of `counting` the original functions are in place and
+# there is no overhead at all.
+#
+#     with counting() as counts:
+#         alg.sampleParaphyletic(node, proportion=0.1)
+#     counts.visits["setFactorCounts"]    # nodes visited by one primitive
+#     counts.calls["sampleParaphyletic"]  # nodes visited by all primitives
+#                                         # within calls of this algorithm
+#
+# Only calls made through the smot.algorithm module are counted, functions
+# imported by name elsewhere (e.g., `from smot.algorithm import clean`) before
+# counting started are not.
+
+# Recursive functions that visit each node of the tree once per call
+PRIMITIVES = [
+    "treemap",
+    "treefold",
+    "treecut",
+    "treepull",
+    "treepush",
+    "setNLeafs",
+    "setFactorCounts",
+    "requireBranchLengths",
+    "getLeftmost",
+]
+
+# Public algorithms, the visits of all primitives within them are counted
+ALGORITHMS = [
+    "tips",
+    "tipSet",
+    "clean",
+    "factorByLabel",
+    "factorByField",
+    "factorByCapture",
+    "factorByTable",
+    "imputeMonophyleticFactors",
+    "imputePatristicFactors",
+    "sampleN",
+    "sampleRandom",
+    "sampleEqual",
+    "sampleParaphyletic",
+    "sampleMonophyletic",
+    "colorTree",
+    "colorMono",
+    "colorPara",
+    "filterMono",
+]
+
+
+class Counts:
+    def __init__(self) -> None:
+        # node visits of each primitive
+        self.visits: Counter[str] = collections.Counter()
+        # node visits of all primitives within each public algorithm (a
+        # recursive algorithm is only counted at its outermost call)
+        self.calls: Counter[str] = collections.Counter()
+        # number of outermost calls of each public algorithm
+        self.ncalls: Counter[str] = collections.Counter()
+        self.total = 0
+
+    def __repr__(self) -> str:
+        return f"Counts(total={self.total}, visits={dict(self.visits)}, calls={dict(self.calls)})"
+
+
+def _countVisits(counts: Counts, name: str, f: Callable) -> Callable:
+    @functools.wraps(f)
+    def _f(*args: Any, **kwargs: Any) -> Any:
+        counts.visits[name] += 1
+        counts.total += 1
+        return f(*args, **kwargs)
+
+    return _f
+
+
+def _countCalls(counts: Counts, name: str, f: Callable, active: List[str]) -> Callable:
+    @functools.wraps(f)
+    def _f(*args: Any, **kwargs: Any) -> Any:
+        if name in active:
+            return f(*args, **kwargs)
+        active.append(name)
+        start = counts.total
+        try:
+            return f(*args, **kwargs)
+        finally:
+            active.pop()
+            counts.ncalls[name] += 1
+            counts.calls[name] += counts.total - start
+
+    return _f
+
+
+@contextlib.contextmanager
+def counting() -> Iterator[Counts]:
+    """
+    Count node visits in smot.algorithm within a block
+    """
+    import smot.algorithm as alg
+
+    counts = Counts()
+    active: List[str] = []
+    originals: Dict[str, Callable] = dict()
+    for name in PRIMITIVES:
+        originals[name] = getattr(alg, name)
+        setattr(alg, name, _countVisits(counts, name, originals[name]))
+    for name in ALGORITHMS:
+        originals[name] = getattr(alg, name)
+        setattr(alg, name, _countCalls(counts, name, originals[name], active))
+    try:
+        yield counts
+    finally:
+        for (name, f) in originals.items():
+            setattr(alg, name, f)
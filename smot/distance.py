@@ -0,0 +1,187 @@
+from __future__ import annotations
+from typing import Any, Callable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+import heapq
+import itertools
+
+# Patristic distances between the tips of a tree
+#
+# Tips are numbered in the order of smot.algorithm.tips. The distance between
+# tips i and j is depths[i] + depths[j] - 2 * depth(MRCA of i and j), where a
+# depth is the distance from the root. The MRCA of tips i < j is the shallowest
+# MRCA of the adjacent tips between them, so with between[k] the depth of the
+# MRCA of tips k and k + 1 (see smot.algorithm.patristicProfile)
+#
+#     depth(MRCA of i and j) = min(between[i:j])
+#
+# and a whole row of the distance matrix is a running minimum over `between`,
+# outwards from the diagonal. With NumPy, rows are computed in blocks: the
+# MRCA depths of a block of rows against the columns to its right are the
+# outer minimum of the running minima within the block and the running minima
+# to the right of it (and likewise to the left), so each block takes a few
+# whole-array operations. Without NumPy, rows are computed one at a time.
+
+# The number of matrix entries computed at once, which bounds the memory used
+BLOCK_SIZE = 1 << 22
+
+
+def _numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def distanceRow(
+    depths: Sequence[float], between: Sequence[float], i: int
+) -> List[float]:
+    """
+    The distances from the ith tip to every tip
+    """
+    n = len(depths)
+    row = [0.0] * n
+    di = depths[i]
+    for (j, m) in enumerate(itertools.accumulate(between[i:], min), i + 1):
+        row[j] = di + depths[j] - 2 * m
+    left = itertools.accumulate(reversed(between[:i]), min)
+    for (j, m) in zip(range(i - 1, -1, -1), left):
+        row[j] = di + depths[j] - 2 * m
+    return row
+
+
+def _mrcaDepths(np: Any, between: Any, start: int, stop: int, n: int) -> Any:
+    """
+    The depths of the MRCAs of the tips start to stop against every tip, with
+    the depth of each tip on the diagonal left as infinity
+    """
+    inf = np.full(1, np.inf)
+    m = np.empty((stop - start, n))
+    inner = between[start : stop - 1]
+    # min(between[i:stop - 1]) and min(between[start:i]) for each row i
+    toStop = np.concatenate([np.minimum.accumulate(inner[::-1])[::-1], inf])
+    fromStart = np.concatenate([inf, np.minimum.accumulate(inner)])
+    if stop < n:
+        right = np.minimum.accumulate(between[stop - 1 :])
+        np.minimum(toStop[:, None], right[None, :], out=m[:, stop:])
+    if start > 0:
+        left = np.minimum.accumulate(between[:start][::-1])[::-1]
+        np.minimum(fromStart[:, None], left[None, :], out=m[:, :start])
+    for i in range(start, stop):
+        row = m[i - start]
+        row[i] = np.inf
+        row[i + 1 : stop] = np.minimum.accumulate(inner[i - start :])
+        row[start:i] = np.minimum.accumulate(inner[: i - start][::-1])[::-1]
+    return m
+
+
+def distanceBlocks(
+    depths: Sequence[float], between: Sequence[float], vectorize: bool = True
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Yield the rows of the distance matrix in blocks, as the index of the first
+    row and a sequence of rows. The blocks are NumPy arrays if NumPy is
+    installed (and `vectorize` is set), otherwise they hold a single row.
+    """
+    n = len(depths)
+    np = _numpy() if vectorize else None
+    if np is None:
+        for i in range(n):
+            yield (i, [distanceRow(depths, between, i)])
+        return
+
+    d = np.asarray(depths, dtype=float)
+    w = np.asarray(between, dtype=float)
+    size = max(1, BLOCK_SIZE // max(n, 1))
+    for start in range(0, n, size):
+        stop = min(n, start + size)
+        block = (
+            d[start:stop, None] + d[None, :] - 2 * _mrcaDepths(np, w, start, stop, n)
+        )
+        # the diagonal was infinity, tips are at distance zero from themselves
+        block[np.arange(stop - start), np.arange(start, stop)] = 0.0
+        yield (start, block)
+
+
+def nearest(
+    depths: Sequence[float], between: Sequence[float], k: int, vectorize: bool = True
+) -> Iterator[List[Tuple[int, float]]]:
+    """
+    Yield the k nearest other tips of each tip, as (index, distance) pairs from
+    nearest to farthest, with ties broken by tip order
+    """
+    np = _numpy() if vectorize else None
+    for (start, block) in distanceBlocks(depths, between, vectorize):
+        if np is None:
+            for (i, row) in enumerate(block, start):
+                others = (j for j in range(len(row)) if j != i)
+                yield [
+                    (j, row[j]) for j in heapq.nsmallest(k, others, key=row.__getitem__)
+                ]
+            continue
+        block[np.arange(len(block)), np.arange(start, start + len(block))] = np.inf
+        m = min(k, block.shape[1] - 1)
+        for row in block:
+            if m < 1:
+                yield []
+                continue
+            js = (
+                np.argpartition(row, m - 1)[:m] if m < len(row) else np.arange(len(row))
+            )
+            js = js[np.lexsort((js, row[js]))]
+            yield [(int(j), float(row[j])) for j in js]
+
+
+def write_distance_table(
+    labels: List[str],
+    depths: Sequence[float],
+    between: Sequence[float],
+    fh: TextIO,
+    formatLength: Callable[[float], str],
+) -> None:
+    """
+    Write the distance matrix as a TAB-delimited table with a header of tip
+    labels and the tip label at the start of each row
+    """
+    fh.write("\t" + "\t".join(labels) + "\n")
+    for (start, block) in distanceBlocks(depths, between):
+        for (label, row) in zip(labels[start:], block):
+            values = row if isinstance(row, list) else row.tolist()
+            fh.write(label + "\t" + "\t".join(map(formatLength, values)) + "\n")
+
+
+def write_nearest_table(
+    labels: List[str],
+    depths: Sequence[float],
+    between: Sequence[float],
+    k: int,
+    fh: TextIO,
+    formatLength: Callable[[float], str],
+) -> None:
+    """
+    Write the k nearest neighbors of each tip as TAB-delimited rows of tip,
+    neighbor and distance
+    """
+    for (label, neighbors) in zip(labels, nearest(depths, between, k)):
+        for (j, dist) in neighbors:
+            fh.write(f"{label}\t{labels[j]}\t{formatLength(dist)}\n")
+
+
+def write_distance_matrix(
+    path: str, depths: Sequence[float], between: Sequence[float]
+) -> Optional[str]:
+    """
+    Write the distance matrix as a float32 NumPy array (.npy) that can be read
+    back with numpy.load(path, mmap_mode="r"). Returns an error message if
+    NumPy is not installed.
+    """
+    np = _numpy()
+    if np is None:
+        return "Writing a distance matrix requires NumPy"
+    n = len(depths)
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(n, n))
+    for (start, block) in distanceBlocks(depths, between):
+        matrix[start : start + len(block)] = block
+    matrix.flush()
+    del matrix
+    return None
@@ -1,20 +1,40 @@
 from __future__ import annotations
 from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
     List,
     Optional,
+    TextIO,
     Tuple,
     Union,
 )
 
 from smot.classes import Node, Tree, makeTree, AnyNode, AnyNodeData
-import smot.algorithm as alg
+import functools
+import io
 import re
 
+# Chunks are collected and written to the output handle once this many
+# characters have accumulated
+BUFFER_SIZE = 1 << 16
 
+# Number of distinct labels and format values whose quoted forms are cached
+QUOTE_CACHE_SIZE = 1 << 14
+
+# Default number of significant digits used when writing branch lengths
+DEFAULT_PRECISION = 3
+
+# Characters that require a label to be quoted
+_special_chars = re.compile("[\\^,:;()[\\]'\"]")
+
+
+@functools.lru_cache(maxsize=QUOTE_CACHE_SIZE)
 def quote(x: str) -> str:
     if "'" in x:
         # escape any double quotes
-        x = re.sub('"', '\\"', x)
+        x = x.replace('"', '\\"')
         # double quote the expression
         x = f'"{x}"'
     else:
@@ -23,53 +43,156 @@ def quote(x: str) -> str:
     return x
 
 
+@functools.lru_cache(maxsize=QUOTE_CACHE_SIZE)
 def quoteIf(x: str) -> str:
-    if set("^,:;()[]'\"").intersection(set(x)):
+    if _special_chars.search(x):
         return quote(x)
     else:
         return x
 
 
-def newick(node: Union[Tree, AnyNode]) -> str:
-    if isinstance(node, Tree):
-        node_obj = node.tree
-    else:
-        node_obj = node
+@functools.lru_cache(maxsize=QUOTE_CACHE_SIZE)
+def _formString(items: Tuple[Tuple[str, str], ...]) -> str:
+    return "[&" + ",".join([k + "=" + quoteIf(v) for (k, v) in items]) + "]"
+
+
+def makeLengthFormatter(
+    precision: Optional[int] = DEFAULT_PRECISION,
+) -> Callable[[float], str]:
+    """
+    Make a function that writes branch lengths with `precision` significant
+    digits. If precision is None, write the shortest string that reads back as
+    exactly the same float.
+    """
+    if precision is None:
+        return repr
+    elif precision < 1:
+        raise ValueError(f"Expected a precision of at least 1, got {precision}")
+    spec = f".{precision}g"
+    return lambda x: format(x, spec)
+
+
+def _write_chunks(chunks: Iterable[str], fh: TextIO) -> None:
+    """
+    Write an iterable of string chunks to a file handle, buffering small chunks
+    into larger writes.
+    """
+    buf: List[str] = []
+    size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= BUFFER_SIZE:
+            fh.write("".join(buf))
+            buf = []
+            size = 0
+    if buf:
+        fh.write("".join(buf))
+
+
+def nodeInfo(
+    d: AnyNodeData,
+    formatLength: Callable[[float], str],
+    token: Optional[str] = None,
+    color: Optional[str] = None,
+) -> str:
+    """
+    Render the label, format, and branch length that follow a node. If a token
+    is given, it is written verbatim in place of the label. If a color is
+    given, it is written as the "!color" of the format.
+    """
+    form = d.form
+    if color is not None:
+        form = dict(form, **{"!color": color})
+    s = ""
+    if token is not None:
+        s += token
+    elif d.label:
+        if form:
+            s += quote(d.label)
+        else:
+            s += quoteIf(d.label)
+    if form:
+        s += _formString(tuple(form.items()))
+    if d.length is not None:
+        s += ":" + formatLength(d.length)
+    return s
 
-    return _newick(node_obj) + ";"
 
+def _newick_chunks(
+    node: AnyNode,
+    precision: Optional[int] = DEFAULT_PRECISION,
+    translate: Optional[Dict[str, int]] = None,
+    colors: Optional[Dict[str, str]] = None,
+) -> Iterator[str]:
+    """
+    Iteratively generate the newick string for a node (without the final
+    semicolon). The stack holds either nodes that have yet to be opened or
+    strings (commas and closing node info) that are emitted when popped.
 
-def _newick(node: AnyNode) -> str:
+    If a translation table is given, tip labels are replaced by their integer
+    index. If a map of tip colors is given, the colors are written in the
+    formats of the tips.
+    """
+    formatLength = makeLengthFormatter(precision)
+    stack: List[Union[AnyNode, str]] = [node]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, str):
+            yield x
+        elif x.kids:
+            yield "("
+            stack.append(")" + nodeInfo(x.data, formatLength))
+            for (i, kid) in enumerate(reversed(x.kids)):
+                if i > 0:
+                    stack.append(",")
+                stack.append(kid)
+        elif translate and x.data.label in translate:
+            yield nodeInfo(x.data, formatLength, str(translate[x.data.label]))
+        elif colors and x.data.label in colors:
+            yield nodeInfo(x.data, formatLength, color=colors[x.data.label])
+        else:
+            yield nodeInfo(x.data, formatLength)
+
+
+def _asNode(node: Union[Tree, AnyNode]) -> AnyNode:
     # allow input to be a Tree object
     if isinstance(node, Tree):
-        node = node.tree
-    if node.kids:
-        s = "(" + ",".join([_newick(kid) for kid in node.kids]) + ")"
+        return node.tree
     else:
-        s = ""
-    if node.data.label:
-        label = node.data.label
-        if node.data.form or set("^,:;()[]'\"").intersection(set(label)):
-            label = quote(label)
-        s += label
-    if node.data.form:
-        form_str = ",".join([k + "=" + quoteIf(v) for (k, v) in node.data.form.items()])
-        s += "[&" + form_str + "]"
-    if node.data.length is not None:
-        s += ":" + "{:0.3g}".format(node.data.length)
-    return s
+        return node
 
 
-def nexus(treeOrNode: Union[AnyNode, Tree]) -> str:
-    # allow input to be a Node object
-    if isinstance(treeOrNode, Node):
-        tree = makeTree(tree=treeOrNode)
-    else:
-        tree = treeOrNode
+def write_newick(
+    node: Union[Tree, AnyNode],
+    fh: TextIO,
+    precision: Optional[int] = DEFAULT_PRECISION,
+    colors: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    Write a tree in newick format directly to a file handle
+
+    Newick has no taxa block, so tip colors (e.g., from `tipColors`) are only
+    written if given, as [&!color=...] comments on the tips.
+    """
+    _write_chunks(_newick_chunks(_asNode(node), precision, colors=colors), fh)
+    fh.write(";")
+
+
+def newick(
+    node: Union[Tree, AnyNode], precision: Optional[int] = DEFAULT_PRECISION
+) -> str:
+    fh = io.StringIO()
+    write_newick(node, fh, precision)
+    return fh.getvalue()
+
 
-    def _fun(
-        b: List[Tuple[str, Optional[str]]], x: AnyNodeData
-    ) -> List[Tuple[str, Optional[str]]]:
+def _colortips(tree: Tree) -> List[Tuple[str, Optional[str]]]:
+    colortips: List[Tuple[str, Optional[str]]] = []
+    stack = [tree.tree]
+    while stack:
+        node = stack.pop()
+        x = node.data
         if x.isLeaf:
             # if colors were set by grep, they will be stored here and they
             # should over-ride the default colors
@@ -81,13 +204,48 @@ def nexus(treeOrNode: Union[AnyNode, Tree]) -> str:
             # no colors are available
             else:
                 color = None
-            b.append((x.label, color))
-        return b
+            colortips.append((x.label, color))
+        stack.extend(reversed([k for k in node.kids if k is not None]))
+    return colortips
 
+
+def tipColors(tree: Tree) -> Dict[str, str]:
+    """
+    Map the colored tips of a tree to the colors written in its taxa block
+    """
+    return {tip: color for (tip, color) in _colortips(tree) if color is not None}
+
+
+def _translationTable(node: AnyNode) -> Dict[str, int]:
+    """
+    Number the tip labels from 1 in the order they appear in the tree
+    """
+    table: Dict[str, int] = dict()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if not node.kids:
+            if node.data.label and node.data.label not in table:
+                table[node.data.label] = len(table) + 1
+        else:
+            stack.extend(reversed([k for k in node.kids if k is not None]))
+    return table
+
+
+def _nexus_chunks(
+    tree: Tree,
+    precision: Optional[int] = DEFAULT_PRECISION,
+    translate: bool = False,
+    body: Optional[Iterable[str]] = None,
+) -> Iterator[str]:
+    """
+    Generate a nexus file for a tree. If `body` is given, it is written as the
+    newick tree in place of `tree.tree`. If the tree has replicates, each is
+    written as a tree of the trees block.
+    """
     s = ["#NEXUS"]
     if tree.colmap:
-        colortips: List[Tuple[str, Optional[str]]]
-        colortips = alg.treefold(tree.tree, _fun, [])
+        colortips = _colortips(tree)
         s.append("begin taxa;")
         s.append(f"\tdimensions ntax={str(len(colortips))};")
         s.append("\ttaxlabels")
@@ -100,11 +258,84 @@ def nexus(treeOrNode: Union[AnyNode, Tree]) -> str:
         s.append(";")
         s.append("end;\n")
     s.append("begin trees;")
-    s.append(f"\ttree tree_1 = [&R] {newick(tree)}")
-    s.append("end;\n")
+    yield "\n".join(s) + "\n"
+
+    table: Optional[Dict[str, int]] = None
+    if translate:
+        table = _translationTable(tree.tree)
+    if table:
+        yield "\ttranslate\n"
+        yield ",\n".join([f"\t\t{i} {quote(tip)}" for (tip, i) in table.items()])
+        yield "\n\t;\n"
+
+    bodies: Iterable[Iterable[str]]
+    if body is not None:
+        bodies = [body]
+    else:
+        nodes = [tree.tree] if tree.replicates is None else tree.replicates
+        bodies = (_newick_chunks(node, precision, table) for node in nodes)
+    for (i, body) in enumerate(bodies):
+        if i > 0:
+            yield "\n"
+        yield f"\ttree tree_{i + 1} = [&R] "
+        yield from body
+        yield ";"
+
+    s = ["end;\n"]
     for (k, vs) in tree.meta.items():
-        s.append(f"begin {k};")
-        for v in vs:
-            s.append(f"\t{v};")
-        s.append("end;\n")
-    return "\n".join(s)
+        if isinstance(vs, str):
+            # the verbatim body of a block read from a nexus file
+            s.append(f"begin {k};\n{vs}end;\n")
+        else:
+            s.append(f"begin {k};")
+            for v in vs:
+                s.append(f"\t{v};")
+            s.append("end;\n")
+    yield "\n" + "\n".join(s)
+
+
+def write_nexus(
+    treeOrNode: Union[AnyNode, Tree],
+    fh: TextIO,
+    precision: Optional[int] = DEFAULT_PRECISION,
+    translate: bool = False,
+) -> None:
+    """
+    Write a tree in nexus format directly to a file handle
+
+    If `translate` is set, a TRANSLATE table is written and tips in the tree
+    are written as integer indices into the table.
+    """
+    # allow input to be a Node object
+    if isinstance(treeOrNode, Node):
+        tree = makeTree(tree=treeOrNode)
+    else:
+        tree = treeOrNode
+    _write_chunks(_nexus_chunks(tree, precision, translate), fh)
+
+
+def write_newick_chunks(chunks: Iterable[str], fh: TextIO) -> None:
+    """
+    Write a newick tree that is given as string chunks (without the final
+    semicolon), e.g., by the streaming commands in smot.stream
+    """
+    _write_chunks(chunks, fh)
+    fh.write(";")
+
+
+def write_nexus_chunks(chunks: Iterable[str], fh: TextIO) -> None:
+    """
+    Write a newick tree that is given as string chunks as a nexus file with
+    only a trees block
+    """
+    _write_chunks(_nexus_chunks(Tree(colmap=dict(), meta=dict()), body=chunks), fh)
+
+
+def nexus(
+    treeOrNode: Union[AnyNode, Tree],
+    precision: Optional[int] = DEFAULT_PRECISION,
+    translate: bool = False,
+) -> str:
+    fh = io.StringIO()
+    write_nexus(treeOrNode, fh, precision, translate)
+    return fh.getvalue()
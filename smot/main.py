@@ -1,8 +1,29 @@
 from __future__ import annotations
-from typing import List, Optional, TextIO, Callable, Tuple, Dict, Counter
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Callable,
+    Counter,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    cast,
+)
 
 from smot.version import __version__
 import click
+import contextlib
+import functools
+import inspect
+import io
+import os
 import sys
 from smot.classes import (
     Node,
@@ -13,10 +34,11 @@ from smot.classes import (
     LC,
     BL,
     makeNode,
-    makeTree,
 )
 from smot.util import die
+from smot.server import DEFAULT_MAX_MEMORY, TreeCache
 import smot.format as sf
+import smot.timing as timing
 
 INT_SENTINEL = 9999
 
@@ -88,6 +110,28 @@ class ListOfStringsType(click.ParamType):
             )
 
 
+class PrecisionType(click.ParamType):
+    name = "?nat|exact"
+
+    def convert(self, value, param, ctx):
+        if value is None or isinstance(value, int):
+            return value
+        if str(value).lower() == "exact":
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            self.fail(
+                f"expected a positive integer or 'exact', got {value!r}", param, ctx
+            )
+        if value < 1:
+            self.fail(f"expected an integer greater than 0, got {value}", param, ctx)
+        return value
+
+
+Precision = PrecisionType()
+
+
 def checkColor(color: str) -> None:
     try:
         if color[0] != "#":
@@ -112,15 +156,68 @@ dec_default = click.option(
 )
 
 
-def factorTree(
-    node: AnyNode,
+def fileStamp(filename: str) -> Tuple[str, int, int]:
+    """
+    The path, modification time and size of a file, which change when the
+    file is edited
+    """
+    info = os.stat(filename)
+    return (os.path.realpath(filename), info.st_mtime_ns, info.st_size)
+
+
+# Tables and color maps are cached by their file stamps, so in batch mode they
+# are read only once by each worker process, and `smot serve` reads them again
+# when they are edited. Each caller gets its own copy.
+def readFactorTable(filename: str) -> Dict[str, str]:
+    return dict(_readFactorTable(*fileStamp(filename)))
+
+
+def readColormap(filename: str) -> Dict[str, str]:
+    return dict(_readColormap(*fileStamp(filename)))
+
+
+@functools.lru_cache(maxsize=64)
+def _readFactorTable(filename: str, mtime: int, size: int) -> Dict[str, str]:
+    table: Dict[str, str] = dict()
+    with open(filename, "r") as fh:
+        try:
+            table = {
+                k: v for (k, v) in [row.strip().split("\t") for row in fh.readlines()]
+            }
+        except ValueError:
+            die("Expected two columns in --factor-by-table file")
+    return table
+
+
+@functools.lru_cache(maxsize=64)
+def _readColormap(filename: str, mtime: int, size: int) -> Dict[str, str]:
+    colormap: Dict[str, str] = dict()
+    with open(filename, "r") as f:
+        try:
+            colormap = {
+                f.strip(): c.strip().upper()
+                for (f, c) in [p.strip().split("\t") for p in f.readlines()]
+            }
+            for clade, color in colormap.items():
+                if color[0] != "#":
+                    colormap[clade] = "#" + color
+                if len(color) != 7:
+                    die('Expected colors in hexadecimal (e.g., "#AA10FF")')
+        except ValueError:
+            die("Invalid color map: expected TAB-delimited, two-column file")
+    return colormap
+
+
+def factorLabeler(
     factor_by_capture: Optional[str] = None,
     factor_by_field: Optional[int] = None,
     factor_by_table: Optional[str] = None,
     default: Optional[str] = None,
-    impute: bool = False,
-    patristic: bool = False,
-) -> Node[Optional[str], LC, Counter, BL]:
+) -> Optional[Callable[[Optional[str]], Optional[str]]]:
+    """
+    The function that finds the factor of a tip label, or None if no factoring
+    option is given
+    """
     import smot.algorithm as alg
     import re
 
@@ -134,23 +231,31 @@ def factorTree(
             die(
                 "I'm sorry, I can't let you do that. Using --default with --factor-by-field is unsafe."
             )
-        factoredNode = alg.factorByField(node, field_index)
+        return lambda x: alg.factorByFieldFun(x, field_index)
     elif factor_by_capture is not None:
         pattern = re.compile(factor_by_capture)
-        factoredNode = alg.factorByCapture(node, pat=pattern, default=default)
+        return lambda x: alg.factorByCaptureFun(x, pattern, default=default)
     elif factor_by_table is not None:
-        with open(factor_by_table, "r") as fh:
-            try:
-                table = {
-                    k: v
-                    for (k, v) in [row.strip().split("\t") for row in fh.readlines()]
-                }
-            except ValueError:
-                die("Expected two columns in --factor-by-table file")
-
-            factoredNode = alg.factorByTable(node, table=table, default=default)
+        table = readFactorTable(factor_by_table)
+        return lambda x: alg.factorByTableFun(x, table, default=default)
     else:
-        factoredNode = node
+        return None
+
+
+@timing.timed("factor")
+def factorTree(
+    node: AnyNode,
+    factor_by_capture: Optional[str] = None,
+    factor_by_field: Optional[int] = None,
+    factor_by_table: Optional[str] = None,
+    default: Optional[str] = None,
+    impute: bool = False,
+    patristic: bool = False,
+) -> Node[Optional[str], LC, Counter, BL]:
+    import smot.algorithm as alg
+
+    fun = factorLabeler(factor_by_capture, factor_by_field, factor_by_table, default)
+    factoredNode = node if fun is None else alg.factorByLabel(node, fun)
 
     factoredCountedNode = alg.setFactorCounts(factoredNode)
 
@@ -162,32 +267,591 @@ def factorTree(
         return factoredCountedNode
 
 
-def read_tree(treefile: TextIO) -> Tree:
-    from smot.parser import read_fh
+def settings() -> Dict[str, Any]:
+    """
+    Global options set on the top-level smot command
+    """
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None and ctx.obj:
+        return ctx.obj
+    else:
+        return dict()
 
-    return read_fh(treefile)
 
+def read_tree(treefile: BinaryIO) -> Tree:
+    from smot.binary import read_bytes
 
-dec_tree = click.argument("TREE", default=sys.stdin, type=click.File())
+    with timing.stage("read") as stage:
+        tree_obj = read_bytes(treefile.read(), cache_dir=settings().get("cache_dir"))
+        stage.count(tree_obj)
+    return tree_obj
 
 
-#      smot tips [<filename>]
-@click.command()
-@dec_tree
-def tips(tree: TextIO) -> None:
+def read_trees(path: str) -> Generator[Tree, None, None]:
     """
-    Print the tree tip labels. The order of tips matches the order in the tree
-    (top-to-bottom).
+    Read the trees of a file that may hold many (e.g., a posterior or bootstrap
+    set), one at a time
     """
-    import smot.algorithm as alg
+    from smot.parser import read_text
+    from smot.stream import StreamError, split_trees, tree_text
+
+    with click.open_file(path, "rb") as opened:
+        fh = peekable(cast(BinaryIO, opened))
+        if not streamable(fh):
+            yield read_tree(fh)
+            return
+        try:
+            (header, statements) = split_trees(fh)
+            for statement in statements:
+                with timing.stage("read") as stage:
+                    tree_obj = read_text(tree_text(header, statement))
+                    stage.count(tree_obj)
+                yield tree_obj
+        except StreamError as e:
+            die(f"Failed to split the trees in '{path}': {e}")
 
-    tree_obj = read_tree(tree)
-    tree_obj.tree = alg.setNLeafs(tree_obj.tree)
+
+def write_tree(tree_obj: Tree, newick: bool = False) -> None:
+    """
+    Stream a tree to STDOUT in nexus (default) or newick format. The
+    replicates of a tree, if any, are written in its place, as one nexus file
+    or one newick tree per line.
+    """
+    multi = multiOutput()
+    precision = settings().get("precision", sf.DEFAULT_PRECISION)
+    if newick or multi:
+        # nexus output is written as newick with --multi, keeping the tip colors
+        colors = None if newick else sf.tipColors(tree_obj)
+        nodes = tree_obj.replicates
+        for (i, node) in enumerate([tree_obj.tree] if nodes is None else nodes):
+            if i > 0:
+                sys.stdout.write("\n")
+            sf.write_newick(node, sys.stdout, precision=precision, colors=colors)
+    else:
+        sf.write_nexus(
+            tree_obj,
+            sys.stdout,
+            precision=precision,
+            translate=settings().get("translate", False),
+        )
+    sys.stdout.write("\n")
+
+
+def emit_tree(tree_obj: Tree, newick: bool = False, **kwargs: Any) -> None:
+    """
+    The default output of a subcommand, the transformed tree
+    """
+    write_tree(tree_obj, newick=newick)
+
+
+def write_stream(chunks: Iterable[str], newick: bool = False) -> None:
+    """
+    Write a newick tree generated by smot.stream to STDOUT, as write_tree does
+    """
+    multi = multiOutput()
+    if newick or multi:
+        sf.write_newick_chunks(chunks, sys.stdout)
+    else:
+        sf.write_nexus_chunks(chunks, sys.stdout)
+    sys.stdout.write("\n")
+
+
+def multiOutput() -> bool:
+    """
+    Check whether a tree is written as one of many with --multi, where each
+    tree is written as one line of newick (see runMulti). Commands that write
+    nexus write newick instead, with the tip colors of the taxa block kept as
+    [&!color=...] comments on the tips. A TRANSLATE table has no place in
+    newick, so --translate is refused.
+    """
+    multi = bool(settings().get("multi"))
+    if multi and settings().get("translate"):
+        die("--translate cannot be used with --multi, which writes newick trees")
+    return multi
+
+
+def rewritable(fh: BinaryIO, newick: bool = False, **kwargs: Any) -> bool:
+    """
+    Check whether a streamed rewrite of a tree (a handle from peekable) is
+    written just as the full tree would be. Nexus output from Nexus input may
+    need tip colors and other blocks, and a TRANSLATE table needs every tip, so
+    those read the full tree.
+    """
+    if newick:
+        return True
+    nexus = peekHead(fh, 6) == b"#NEXUS"
+    return not nexus and not settings().get("translate", False)
+
+
+# A transformation takes a parsed tree and subcommand parameters and returns
+# the modified tree. An emitter takes the final tree and all subcommand
+# parameters and writes the subcommand output.
+Transform = Callable[..., Tree]
+Emitter = Callable[..., None]
+# A streamer takes a binary handle of a Newick or Nexus tree and the subcommand
+# parameters and writes the subcommand output without building the tree.
+Streamer = Callable[..., None]
+# Checks whether a streamer can handle a tree handle (without consuming it) and
+# the subcommand parameters
+StreamCheck = Callable[..., bool]
+
+# Map from subcommand callbacks to a function that applies the transformation
+# to a tree given the full subcommand parameter dictionary and to the emitter.
+# This is used by `smot pipe` to run the transformations without any I/O.
+_stages: Dict[
+    Callable[..., None], Tuple[Callable[[Tree, Dict[str, Any]], Tree], Emitter]
+] = dict()
+
+# Map from subcommand callbacks to a function that reads, transforms and emits
+# one tree file given the full subcommand parameter dictionary
+_processors: Dict[Callable[..., None], Callable[[BinaryIO, Dict[str, Any]], None]]
+_processors = dict()
+
+
+# The number of bytes at the start of a tree file that peekable guarantees
+# can be seen without consuming them (enough for the binary and nexus headers)
+PEEK_SIZE = 16
+
+
+class _Prefixed(io.RawIOBase):
+    """
+    A handle that returns the given prefix and then the rest of another handle
+    """
+
+    def __init__(self, prefix: bytes, fh: BinaryIO):
+        self.prefix = prefix
+        self.fh = fh
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        if self.prefix:
+            data = self.prefix[: len(buffer)]
+            self.prefix = self.prefix[len(data) :]
+        else:
+            data = cast(io.BufferedReader, self.fh).read1(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def peekable(fh: BinaryIO, size: int = PEEK_SIZE) -> BinaryIO:
+    """
+    Return a handle that reads the same bytes as a tree file handle and whose
+    `peek` shows at least its first `size` bytes (or all of them, if there are
+    fewer). A pipe may hold fewer bytes than `peek` asks for, in which case the
+    start of the file is read until it is complete and then put back.
+    """
+    peek = getattr(fh, "peek", None)
+    if peek is None or fh.seekable() or len(peek(size)) >= size:
+        return fh
+    prefix = b""
+    while len(prefix) < size:
+        chunk = cast(io.BufferedReader, fh).read1(size - len(prefix))
+        if not chunk:
+            break
+        prefix += chunk
+    return cast(BinaryIO, io.BufferedReader(_Prefixed(prefix, fh)))
+
+
+def peekHead(fh: BinaryIO, size: int) -> bytes:
+    """
+    The first `size` bytes of a handle from peekable (or b"" if it cannot peek)
+    """
+    peek = getattr(fh, "peek", None)
+    return b"" if peek is None else peek(size)[:size]
+
+
+def streamable(fh: BinaryIO) -> bool:
+    """
+    Check whether a tree file (a handle from peekable) is text that can be
+    streamed, without consuming it
+    """
+    from smot.binary import MAGIC, is_binary
+
+    return hasattr(fh, "peek") and not is_binary(peekHead(fh, len(MAGIC)))
+
+
+def tree_transform(
+    emit: Emitter = emit_tree,
+    stream: Optional[Streamer] = None,
+    stream_if: Optional[StreamCheck] = None,
+) -> Callable[[Transform], Callable]:
+    """
+    Make a subcommand callback from a tree transformation.
+
+    The transformation takes the parsed tree as its first argument and the
+    subcommand parameters it needs as keyword arguments. The callback reads
+    TREE, applies the transformation, and passes the result to `emit`. If a
+    `stream` function is given, it is used instead for text input (when
+    `stream_if`, if given, accepts the input and parameters).
+    """
+
+    def _decorator(transform: Transform) -> Callable[..., None]:
+        accepted = set(inspect.signature(transform).parameters)
+        # the stage name used by --timings (e.g., "sample para")
+        name = transform.__name__.replace("_cmd", "").replace("_", " ")
+
+        def _apply(tree_obj: Tree, params: Dict[str, Any]) -> Tree:
+            with timing.stage(name) as stage:
+                tree_obj = transform(
+                    tree_obj, **{k: v for (k, v) in params.items() if k in accepted}
+                )
+                stage.count(tree_obj)
+            return tree_obj
+
+        def _emit(tree_obj: Tree, **params: Any) -> None:
+            with timing.stage("write") as stage:
+                stage.count(tree_obj)
+                emit(tree_obj, **params)
+
+        def _process(fh: BinaryIO, params: Dict[str, Any]) -> None:
+            fh = peekable(fh)
+            if (
+                stream is not None
+                and streamable(fh)
+                and (stream_if is None or stream_if(fh, **params))
+            ):
+                with timing.stage(f"{name} (streamed)"):
+                    stream(fh, **params)
+            else:
+                _emit(_apply(read_tree(fh), params), **params)
+
+        @functools.wraps(transform)
+        def _callback(
+            tree: Tuple[str, ...],
+            jobs: int,
+            outdir: Optional[str],
+            multi: bool,
+            **params: Any,
+        ) -> None:
+            paths = expandTreePaths(tree)
+            if multi:
+                runMulti(paths, params, jobs=jobs, outdir=outdir)
+            elif len(paths) == 1 and outdir is None:
+                with click.open_file(paths[0], "rb") as fh:
+                    _process(cast(BinaryIO, fh), params)
+            else:
+                runBatch(paths, params, jobs=jobs, outdir=outdir)
+
+        _stages[_callback] = (_apply, _emit)
+        _processors[_callback] = _process
+        return _callback
+
+    return _decorator
+
+
+def dec_tree(function):
+    function = click.option(
+        "--multi",
+        is_flag=True,
+        help="Process every tree in each file, e.g., posterior or bootstrap trees (trees are written as newick, one per line, with tip colors on the tips)",
+    )(function)
+
+    function = click.option(
+        "--outdir",
+        type=click.Path(file_okay=False),
+        help="With many trees, write the output for each tree to a file of the same name in this folder",
+    )(function)
+
+    function = click.option(
+        "-j",
+        "--jobs",
+        type=click.IntRange(min=1),
+        default=1,
+        help="Number of trees to process in parallel",
+    )(function)
+
+    function = click.argument(
+        "TREE", nargs=-1, type=click.Path(dir_okay=False, allow_dash=True)
+    )(function)
+
+    return function
+
+
+def expandTreePaths(trees: Tuple[str, ...]) -> List[str]:
+    """
+    Expand any TREE arguments that are glob patterns rather than files. With
+    no arguments, the tree is read from STDIN.
+    """
+    import glob
+
+    paths: List[str] = []
+    for tree in trees:
+        if tree != "-" and not os.path.exists(tree) and glob.has_magic(tree):
+            matches = sorted(glob.glob(tree))
+            if not matches:
+                die(f"No tree files match '{tree}'")
+            paths += matches
+        else:
+            paths.append(tree)
+    return paths or ["-"]
+
+
+def commandNames() -> List[str]:
+    """
+    The subcommand path of the running command (e.g., ["sample", "para"])
+    """
+    names: List[str] = []
+    ctx: Optional[click.Context] = click.get_current_context()
+    while ctx is not None and ctx.parent is not None:
+        names.insert(0, cast(str, ctx.info_name))
+        ctx = ctx.parent
+    return names
+
+
+@contextlib.contextmanager
+def redirectStdout(fh: BinaryIO) -> Iterator[None]:
+    """
+    Send everything written to STDOUT (text or binary) to a binary file handle
+    """
+    stdout = sys.stdout
+    sys.stdout = io.TextIOWrapper(cast(IO[bytes], fh), encoding="utf-8")
+    try:
+        yield
+        sys.stdout.flush()
+    finally:
+        cast(io.TextIOWrapper, sys.stdout).detach()
+        sys.stdout = stdout
+
+
+def runBatchTask(
+    names: List[str],
+    params: Dict[str, Any],
+    path: str,
+    outdir: Optional[str],
+    global_settings: Dict[str, Any],
+) -> bytes:
+    """
+    Process one tree file in batch mode. The output is written to a file in
+    `outdir`, if given, otherwise it is returned.
+    """
+    process = commandProcessor(names)
+
+    # recreate the top-level context so global options are visible to workers
+    with click.Context(cli, obj=dict(global_settings)), open(path, "rb") as fh:
+        if outdir is not None:
+            with open(os.path.join(outdir, os.path.basename(path)), "wb") as out:
+                with redirectStdout(out):
+                    process(fh, params)
+            return b""
+        else:
+            buf = io.BytesIO()
+            with redirectStdout(buf):
+                process(fh, params)
+            return buf.getvalue()
+
+
+def runBatchWorker(
+    timings: bool, *task: Any
+) -> Tuple[bytes, List[Dict[str, Any]]]:
+    """
+    Run runBatchTask in a worker process, returning the stages it recorded
+    (for --timings) with its output
+    """
+    if timings:
+        # drop the stages of the main process that a forked worker copies
+        timing.enable()
+        timing.take()
+    return (runBatchTask(*task), timing.take())
+
+
+def commandProcessor(names: List[str]) -> Callable[[BinaryIO, Dict[str, Any]], None]:
+    """
+    The function that processes one tree file for a subcommand path
+    """
+    command: click.Command = cli
+    for name in names:
+        command = cast(click.Group, command).commands[name]
+    return _processors[cast(Callable[..., None], command.callback)]
+
+
+def runBatch(
+    paths: List[str], params: Dict[str, Any], jobs: int, outdir: Optional[str]
+) -> None:
+    """
+    Apply the running subcommand to many tree files, using up to `jobs`
+    processes. Each file is processed exactly as it would be on its own (with
+    the same --seed), and outputs are written in the order of the inputs.
+    """
+    import concurrent.futures
+
+    if "-" in paths:
+        die("Trees cannot be read from STDIN when many trees are given")
+    makeOutdir(paths, outdir)
+
+    names = commandNames()
+    tasks = [(names, params, path, outdir, settings()) for path in paths]
+
+    if jobs == 1:
+        outputs: Iterable[bytes] = (runBatchTask(*task) for task in tasks)
+        for output in outputs:
+            writeBytes(output)
+    else:
+        timings = [timing.enabled()] * len(tasks)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            for (output, records) in pool.map(runBatchWorker, timings, *zip(*tasks)):
+                timing.merge(records)
+                writeBytes(output)
+
+
+def makeOutdir(paths: List[str], outdir: Optional[str]) -> None:
+    if outdir is not None:
+        basenames = [os.path.basename(path) for path in paths]
+        if "-" in paths:
+            die("Trees cannot be read from STDIN when --outdir is used")
+        if len(set(basenames)) < len(basenames):
+            die("Tree files must have unique names when --outdir is used")
+        os.makedirs(outdir, exist_ok=True)
+
+
+# Trees that may wait in the worker pool for each worker in multi-tree mode,
+# enough to keep the workers busy while bounding memory
+MULTI_IN_FLIGHT = 4
+
+# The subcommand path, parameters, Nexus header and global settings of a
+# multi-tree worker, set once when the worker starts
+_multiTask: Optional[Tuple[List[str], Dict[str, Any], str, Dict[str, Any]]] = None
+
+
+def runMulti(
+    paths: List[str], params: Dict[str, Any], jobs: int, outdir: Optional[str]
+) -> None:
+    """
+    Apply the running subcommand to every tree in each file, using up to
+    `jobs` processes. The trees are split apart without being parsed, each is
+    parsed and processed by a worker, and the outputs are written in the order
+    of the trees. Trees are written in newick format, one per line, with tip
+    colors written on the tips (see multiOutput).
+    """
+    import collections
+    import concurrent.futures
+    from smot.stream import StreamError, split_trees
+
+    makeOutdir(paths, outdir)
+    if "newick" in params:
+        params = dict(params, newick=True)
+    names = commandNames()
+
+    for path in paths:
+        with contextlib.ExitStack() as stack:
+            fh = cast(BinaryIO, stack.enter_context(click.open_file(path, "rb")))
+            fh = peekable(fh)
+            if outdir is not None:
+                out = open(os.path.join(outdir, os.path.basename(path)), "wb")
+                stack.enter_context(redirectStdout(stack.enter_context(out)))
+            # tells the writers that they write one tree of many
+            global_settings = dict(settings(), multi=True)
+            if not streamable(fh):
+                # a binary tree file holds a single tree
+                with click.Context(cli, obj=global_settings):
+                    commandProcessor(names)(fh, params)
+                continue
+            try:
+                (header, statements) = split_trees(fh)
+                task = (names, params, header, global_settings)
+                if jobs == 1:
+                    initMultiWorker(*task)
+                    for statement in statements:
+                        writeBytes(runMultiTask(statement))
+                    continue
+                with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=jobs,
+                    initializer=initMultiWorker,
+                    initargs=task + (timing.enabled(),),
+                ) as pool:
+                    pending: Deque[concurrent.futures.Future] = collections.deque()
+                    for statement in statements:
+                        pending.append(pool.submit(runMultiWorker, statement))
+                        if len(pending) >= MULTI_IN_FLIGHT * jobs:
+                            writeWorkerOutput(pending.popleft().result())
+                    for future in pending:
+                        writeWorkerOutput(future.result())
+            except StreamError as e:
+                die(f"Failed to split the trees in '{path}': {e}")
+
+
+def initMultiWorker(
+    names: List[str],
+    params: Dict[str, Any],
+    header: str,
+    global_settings: Dict[str, Any],
+    timings: bool = False,
+) -> None:
+    global _multiTask
+    _multiTask = (names, params, header, global_settings)
+    if timings:
+        # drop the stages of the main process that a forked worker copies
+        timing.enable()
+        timing.take()
+
+
+def runMultiTask(statement: str) -> bytes:
+    """
+    Process one tree of a multi-tree file, given as a newick tree or a Nexus
+    TREE statement, and return the output
+    """
+    from smot.stream import tree_text
+
+    (names, params, header, global_settings) = cast(Tuple, _multiTask)
+    process = commandProcessor(names)
+    text = tree_text(header, statement)
+    fh = io.BufferedReader(io.BytesIO(text.encode("utf-8")))  # type: ignore
+    buf = io.BytesIO()
+    with click.Context(cli, obj=dict(global_settings)), redirectStdout(buf):
+        process(cast(BinaryIO, fh), params)
+    return buf.getvalue()
+
+
+def runMultiWorker(statement: str) -> Tuple[bytes, List[Dict[str, Any]]]:
+    """
+    Run runMultiTask in a worker process, returning the stages it recorded
+    (for --timings) with its output
+    """
+    return (runMultiTask(statement), timing.take())
+
+
+def writeWorkerOutput(result: Tuple[bytes, List[Dict[str, Any]]]) -> None:
+    (output, records) = result
+    timing.merge(records)
+    writeBytes(output)
+
+
+def writeBytes(output: bytes) -> None:
+    if output:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(output)
+        sys.stdout.buffer.flush()
+
+
+def emit_tips(tree_obj: Tree, **kwargs: Any) -> None:
+    import smot.algorithm as alg
 
     for tip in alg.tips(tree_obj.tree):
         print(tip)
 
 
+def stream_tips(fh: BinaryIO, **kwargs: Any) -> None:
+    from smot.stream import tips
+
+    write = sys.stdout.write
+    for tip in tips(fh):
+        write(tip + "\n")
+
+
+#      smot tips [<filename>]
+@click.command()
+@dec_tree
+@tree_transform(emit=emit_tips, stream=stream_tips)
+def tips(tree_obj: Tree) -> Tree:
+    """
+    Print the tree tip labels. The order of tips matches the order in the tree
+    (top-to-bottom). Newick and Nexus trees are scanned without building the
+    tree in memory, so this works on trees of any size.
+    """
+    return tree_obj
+
+
 def factoring(function):
     function = click.option(
         "--factor-by-capture",
@@ -254,6 +918,12 @@ dec_min_tips = click.option(
 
 dec_seed = click.option("--seed", type=click.IntRange(min=1), help="Random seed")
 
+dec_replicates = click.option(
+    "--replicates",
+    type=click.IntRange(min=1),
+    help="Write this many samples of the tree, drawn with the seeds --seed, --seed + 1, and so on (or with random seeds). The tree is factored and grouped once for all samples.",
+)
+
 dec_keep = click.option(
     "-k", "--keep", default=[], type=ListOfStrings, help="Factors to keep"
 )
@@ -281,6 +951,31 @@ dec_patristic = click.option(
 )
 
 
+def sampleReplicates(
+    tree_obj: Tree, plan: Any, replicates: int, seed: Optional[int]
+) -> Tree:
+    """
+    Draw the replicate samples of a tree from its sampling plan (see
+    `smot.algorithm.SamplingPlan`). Replicate i (from 0) keeps the tips that
+    sampling with the seed `seed + i` keeps. The replicates are forks of the
+    tree that share the clades they keep whole (see `smot.sharing.Snapshot`),
+    and each is made as it is written, so only one is held at a time.
+    """
+    import smot.algorithm as alg
+    from smot.sharing import Snapshot
+
+    snapshot = Snapshot(tree_obj.tree)
+
+    def _replicates() -> Iterator[AnyNode]:
+        for i in range(replicates):
+            selected = alg.drawSample(plan, None if seed is None else seed + i)
+            node = snapshot.keep(selected, plan.clades)
+            yield makeNode() if node is None else node
+
+    tree_obj.replicates = _replicates()
+    return tree_obj
+
+
 @click.command(name="equal")
 @factoring
 @dec_keep
@@ -289,17 +984,16 @@ dec_patristic = click.option(
 @click.option("--zero", is_flag=True, help="Set branches without lengths to 0")
 @dec_newick
 @dec_tree
+@tree_transform()
 def sample_equal_cmd(
+    tree_obj: Tree,
     factor_by_capture: Optional[str],
     factor_by_field: Optional[int],
     factor_by_table: Optional[str],
     keep: List[str],
     default: Optional[str],
     max_tips: int,
-    zero: bool,
-    newick: bool,
-    tree: TextIO,
-) -> None:
+) -> Tree:
     """
 
     Equal sampling. Descend from root to tip. At each node, determine if all
@@ -320,7 +1014,6 @@ def sample_equal_cmd(
 
     import smot.algorithm as alg
 
-    tree_obj = read_tree(tree)
     tree_obj.tree = factorTree(
         node=tree_obj.tree,
         factor_by_capture=factor_by_capture,
@@ -328,12 +1021,11 @@ def sample_equal_cmd(
         factor_by_table=factor_by_table,
         default=default,
     )
-    tree_obj.tree = alg.sampleEqual(tree_obj.tree, keep=keep, maxTips=max_tips)
+    with timing.stage("sample") as stage:
+        tree_obj.tree = alg.sampleEqual(tree_obj.tree, keep=keep, maxTips=max_tips)
+        stage.count(tree_obj)
 
-    if newick:
-        print(sf.newick(tree_obj))
-    else:
-        print(sf.nexus(tree_obj))
+    return tree_obj
 
 
 @click.command(name="mono")
@@ -346,10 +1038,13 @@ def sample_equal_cmd(
 @dec_scale
 @dec_number
 @dec_seed
+@dec_replicates
 @dec_newick
 @click.option("--zero", is_flag=True, help="Set branches without lengths to 0")
 @dec_tree
+@tree_transform()
 def sample_mono_cmd(
+    tree_obj: Tree,
     factor_by_capture: Optional[str],
     factor_by_field: Optional[int],
     factor_by_table: Optional[str],
@@ -361,10 +1056,8 @@ def sample_mono_cmd(
     scale: Optional[float],
     number: Optional[int],
     seed: Optional[int],
-    newick: bool,
-    zero: bool,
-    tree: TextIO,
-) -> None:
+    replicates: Optional[int],
+) -> Tree:
     """
     Monophyletic sampling. Randomly sample --proportion of the tips (0 to 1)
     from each monophyletic subtree. Retain at least --min-tips tips in each
@@ -401,7 +1094,6 @@ def sample_mono_cmd(
     if not (proportion or scale or number):
         die("Please add either a --proportion or --scale or --number option")
 
-    tree_obj = read_tree(tree)
     tree_obj.tree = factorTree(
         node=tree_obj.tree,
         factor_by_capture=factor_by_capture,
@@ -409,21 +1101,33 @@ def sample_mono_cmd(
         factor_by_table=factor_by_table,
         default=default,
     )
-    tree_obj.tree = alg.sampleMonophyletic(
-        tree_obj.tree,
-        keep=keep,
-        keep_regex=keep_regex,
-        proportion=proportion,
-        scale=scale,
-        number=number,
-        minTips=min_tips,
-        seed=seed,
-    )
+    if replicates is not None:
+        with timing.stage("plan"):
+            plan = alg.monophyleticPlan(
+                tree_obj.tree,
+                keep=keep,
+                keep_regex=keep_regex,
+                proportion=proportion,
+                scale=scale,
+                number=number,
+                minTips=min_tips,
+            )
+        return sampleReplicates(tree_obj, plan, replicates, seed)
+
+    with timing.stage("sample") as stage:
+        tree_obj.tree = alg.sampleMonophyletic(
+            tree_obj.tree,
+            keep=keep,
+            keep_regex=keep_regex,
+            proportion=proportion,
+            scale=scale,
+            number=number,
+            minTips=min_tips,
+            seed=seed,
+        )
+        stage.count(tree_obj)
 
-    if newick:
-        print(sf.newick(tree_obj))
-    else:
-        print(sf.nexus(tree_obj))
+    return tree_obj
 
 
 @click.command(name="para")
@@ -436,10 +1140,13 @@ def sample_mono_cmd(
 @dec_scale
 @dec_number
 @dec_seed
+@dec_replicates
 @dec_newick
 @click.option("--zero", is_flag=True, help="Set branches without lengths to 0")
 @dec_tree
+@tree_transform()
 def sample_para_cmd(
+    tree_obj: Tree,
     factor_by_capture: Optional[str],
     factor_by_field: Optional[int],
     factor_by_table: Optional[str],
@@ -451,10 +1158,8 @@ def sample_para_cmd(
     scale: Optional[float],
     number: Optional[int],
     seed: Optional[int],
-    newick: bool,
-    zero: bool,
-    tree: TextIO,
-) -> None:
+    replicates: Optional[int],
+) -> Tree:
     """
     Paraphyletic sampling. The sampling algorithm starts at the root and
     descends to the tips. At each node, we store monophyletic subtrees in a
@@ -477,6 +1182,11 @@ def sample_para_cmd(
       \b
       # Sample 3 of the members in each paraphyletic human or swine grouping
       smot sample para --factor-by-capture="(swine|human)" -n 3 pdm.tre
+
+      \b
+      # Write 100 samples, one per line, drawn with the seeds 1 to 100 (the
+      # same samples as 100 runs with --seed=1 to --seed=100)
+      smot sample para --factor-by-capture="(swine|human)" -p 0.1 --seed=1 --replicates=100 --newick pdm.tre
     """
 
     import smot.algorithm as alg
@@ -484,7 +1194,6 @@ def sample_para_cmd(
     if not (proportion or scale or number):
         die("Please add either a --proportion or --scale or --number option")
 
-    tree_obj = read_tree(tree)
     tree_obj.tree = factorTree(
         node=tree_obj.tree,
         factor_by_capture=factor_by_capture,
@@ -492,21 +1201,64 @@ def sample_para_cmd(
         factor_by_table=factor_by_table,
         default=default,
     )
-    tree_obj.tree = alg.sampleParaphyletic(
-        tree_obj.tree,
-        keep=keep,
-        keep_regex=keep_regex,
-        proportion=proportion,
-        scale=scale,
-        number=number,
-        minTips=min_tips,
-        seed=seed,
-    )
+    if replicates is not None:
+        with timing.stage("plan"):
+            plan = alg.paraphyleticPlan(
+                tree_obj.tree,
+                keep=keep,
+                keep_regex=keep_regex,
+                proportion=proportion,
+                scale=scale,
+                number=number,
+                minTips=min_tips,
+            )
+        return sampleReplicates(tree_obj, plan, replicates, seed)
+
+    with timing.stage("sample") as stage:
+        tree_obj.tree = alg.sampleParaphyletic(
+            tree_obj.tree,
+            keep=keep,
+            keep_regex=keep_regex,
+            proportion=proportion,
+            scale=scale,
+            number=number,
+            minTips=min_tips,
+            seed=seed,
+        )
+        stage.count(tree_obj)
 
-    if newick:
-        print(sf.newick(tree_obj))
+    return tree_obj
+
+
+def emit_factor(
+    tree_obj: Tree, method: str, default: Optional[str], newick: bool, **kwargs: Any
+) -> None:
+    import smot.algorithm as alg
+
+    # create TAB-delimited, table with columns for the tip labels and the
+    # (possibly imputed) factor
+    if method.lower() == "table":
+
+        def _fun_treefold(b: List[str], x: AnyNodeData) -> List[str]:
+            if x.isLeaf:
+                if x.factor is None:
+                    if default is None:
+                        factor = ""
+                    else:
+                        factor = default
+                else:
+                    factor = x.factor
+                b.append(f"{x.label}\t{factor}")
+            return b
+
+        row: str
+        b: List[str] = []
+        for row in alg.treefold(tree_obj.tree, _fun_treefold, b):
+            print(row)
+
+    # print the tree with the factor prepended or appended to the tip labels
     else:
-        print(sf.nexus(tree_obj))
+        write_tree(tree_obj, newick=newick)
 
 
 @click.command()
@@ -519,7 +1271,9 @@ def sample_para_cmd(
 @dec_patristic
 @dec_newick
 @dec_tree
+@tree_transform(emit=emit_factor)
 def factor(
+    tree_obj: Tree,
     method: str,
     factor_by_capture: Optional[str],
     factor_by_field: Optional[int],
@@ -527,9 +1281,7 @@ def factor(
     default: Optional[str],
     impute: bool,
     patristic: bool,
-    newick: bool,
-    tree: TextIO,
-) -> None:
+) -> Tree:
     """
     Impute, annotate with, and/or tabulate factors. The --impute option will
     fill in missing factors in monophyletic branches. This is useful, for
@@ -545,7 +1297,6 @@ def factor(
 
     import smot.algorithm as alg
 
-    tree_obj = read_tree(tree)
     tree_obj.tree = factorTree(
         node=tree_obj.tree,
         factor_by_capture=factor_by_capture,
@@ -556,29 +1307,8 @@ def factor(
         patristic=patristic,
     )
 
-    # create TAB-delimited, table with columns for the tip labels and the
-    # (possibly imputed) factor
-    if method.lower() == "table":
-
-        def _fun_treefold(b: List[str], x: AnyNodeData) -> List[str]:
-            if x.isLeaf:
-                if x.factor is None:
-                    if default is None:
-                        factor = ""
-                    else:
-                        factor = default
-                else:
-                    factor = x.factor
-                b.append(f"{x.label}\t{factor}")
-            return b
-
-        row: str
-        b: List[str] = []
-        for row in alg.treefold(tree_obj.tree, _fun_treefold, b):
-            print(row)
-
-    # prepend or append the factor to the tip labels and print the resulting tree
-    else:
+    # prepend or append the factor to the tip labels
+    if method.lower() != "table":
 
         def _fun_treemap(x: NodeData) -> NodeData:
             if x.isLeaf:
@@ -590,104 +1320,610 @@ def factor(
                     x.label = f"{x.label}|{x.factor}"
             return x
 
-        tree_obj.tree = alg.treemap(tree_obj.tree, _fun_treemap)
+        tree_obj.tree = alg.treemap(tree_obj.tree, _fun_treemap)
+
+    return tree_obj
+
+
+def stream_tipsed(
+    fh: BinaryIO, pattern: str, replacement: str, newick: bool = False, **kwargs: Any
+) -> None:
+    import smot.stream as ss
+    import re
+
+    pat = re.compile(pattern)
+    precision = settings().get("precision", sf.DEFAULT_PRECISION)
+    write_stream(
+        ss.relabel(fh, lambda label: pat.sub(replacement, label), precision),
+        newick=newick,
+    )
+
+
+#      smot tipsed <pattern> <replacement> [<filename>]
+@click.command()
+@click.argument("PATTERN", type=str)
+@click.argument("REPLACEMENT", type=str)
+@dec_newick
+@dec_tree
+@tree_transform(stream=stream_tipsed, stream_if=rewritable)
+def tipsed(tree_obj: Tree, pattern: str, replacement: str) -> Tree:
+    """
+    Search and replace patterns in tip labels.
+
+    Newick input (or any input with --newick) is rewritten as it is read,
+    without building the tree in memory.
+    """
+
+    import smot.algorithm as alg
+    import re
+
+    pat = re.compile(pattern)
+
+    def fun_(nodeData: AnyNodeData) -> AnyNodeData:
+        if nodeData.label:
+            nodeData.label = re.sub(pat, replacement, nodeData.label)
+        return nodeData
+
+    tree_obj.tree = alg.treemap(tree_obj.tree, fun_)
+    tree_obj.colmap = {
+        re.sub(pat, replacement, k): v for (k, v) in tree_obj.colmap.items()
+    }
+
+    return tree_obj
+
+
+def grepMatcher(
+    pattern: str, invert_match: bool, perl: bool, file: bool
+) -> Callable[[str], bool]:
+    """
+    Make the function that decides which tip labels `smot grep` keeps
+    """
+    import re
+
+    if file:
+        with open(pattern, "r") as f:
+            patterns = [p.strip() for p in f.readlines()]
+            if invert_match:
+                matcher = lambda s: not any([p in s for p in patterns])
+            else:
+                matcher = lambda s: any([p in s for p in patterns])
+    elif perl:
+        regex = re.compile(pattern)
+        if invert_match:
+            matcher = lambda s: not re.search(regex, s)
+        else:
+            matcher = lambda s: bool(re.search(regex, s))
+    else:
+        if invert_match:
+            matcher = lambda s: pattern not in s
+        else:
+            matcher = lambda s: pattern in s
+    return matcher
+
+
+def prunable(fh: BinaryIO, **params: Any) -> bool:
+    # the pruned tree is written in a second pass over the input
+    return fh.seekable() and rewritable(fh, **params)
+
+
+def stream_grep(
+    fh: BinaryIO,
+    pattern: str,
+    invert_match: bool,
+    perl: bool,
+    file: bool,
+    newick: bool = False,
+    **kwargs: Any,
+) -> None:
+    import smot.stream as ss
+
+    matcher = grepMatcher(pattern, invert_match, perl, file)
+    precision = settings().get("precision", sf.DEFAULT_PRECISION)
+    write_stream(ss.prune(fh, matcher, precision), newick=newick)
+
+
+@click.command()
+@click.argument("PATTERN", type=str)
+@click.option(
+    "-v", "--invert-match", is_flag=True, help="Keep all leafs NOT matching the pattern"
+)
+@click.option(
+    "-P", "--perl", is_flag=True, help="Interpret the pattern as a regular expression"
+)
+@click.option(
+    "-f",
+    "--file",
+    is_flag=True,
+    help="Read patterns from a file instead of a set string",
+)
+@dec_newick
+@dec_tree
+@tree_transform(stream=stream_grep, stream_if=prunable)
+def grep(
+    tree_obj: Tree, pattern: str, invert_match: bool, perl: bool, file: bool
+) -> Tree:
+    """
+    Prune a tree to preserve only the tips that match a pattern.
+
+    Newick input (or any input with --newick) that is read from a file is
+    pruned as it is read, without building the tree in memory.
+    """
+
+    import smot.algorithm as alg
+
+    matcher = grepMatcher(pattern, invert_match, perl, file)
+
+    def fun_(node: AnyNode) -> List[AnyNode]:
+        return [
+            kid for kid in node.kids if (not kid.data.isLeaf or matcher(kid.data.label))
+        ]
+
+    tree_obj.tree = alg.treecut(tree_obj.tree, fun_)
+    with timing.stage("clean") as stage:
+        tree_obj.tree = alg.clean(tree_obj.tree)
+        stage.count(tree_obj)
+
+    return tree_obj
+
+
+@click.command()
+@click.argument("PATTERN", type=str)
+@click.option(
+    "-P", "--perl", is_flag=True, help="Interpret the pattern as a regular expression"
+)
+@click.option(
+    "-f",
+    "--file",
+    is_flag=True,
+    help="Read patterns from a file instead of a set string",
+)
+@click.option(
+    "--color",
+    metavar="COLOR",
+    help="Color the branches of the clade (e.g., '#FFA000') rather than extracting it",
+)
+@dec_newick
+@dec_tree
+@tree_transform()
+def mrca(
+    tree_obj: Tree, pattern: str, perl: bool, file: bool, color: Optional[str]
+) -> Tree:
+    """
+    Extract or color the clade of the most recent common ancestor of the tips
+    that match a pattern.
+
+    Patterns are matched as in `smot grep`. The whole clade is kept, including
+    the tips within it that do not match.
+
+    Examples:
+
+      smot mrca -f patterns 1B.tre
+
+      smot mrca --perl --color "#FFA000" "swine.*2020-" 1B.tre
+    """
+    import smot.algorithm as alg
+
+    matcher = grepMatcher(pattern, False, perl, file)
+    with timing.stage("mrca"):
+        node = alg.MRCAIndex(tree_obj.tree).mrcaOfMatches(matcher)
+    if node is None:
+        die("No tips match the pattern")
+    elif color is None:
+        tree_obj.tree = node
+    else:
+        alg.colorTree(node, color)
+    return tree_obj
+
+
+@click.command()
+@click.option("--midpoint", is_flag=True, help="Root halfway between the farthest tips")
+@click.option(
+    "--outgroup",
+    metavar="PATTERN",
+    help="Root on the branch above the tips that match a pattern",
+)
+@click.option(
+    "-P", "--perl", is_flag=True, help="Interpret the pattern as a regular expression"
+)
+@click.option(
+    "-f",
+    "--file",
+    is_flag=True,
+    help="Read patterns from a file instead of a set string",
+)
+@dec_newick
+@dec_tree
+@tree_transform()
+def root(
+    tree_obj: Tree,
+    midpoint: bool,
+    outgroup: Optional[str],
+    perl: bool,
+    file: bool,
+) -> Tree:
+    """
+    Reroot a tree.
+
+    With --midpoint, the root is placed halfway between the two tips that are
+    farthest apart, which requires branch lengths. With --outgroup, the root is
+    placed halfway along the branch above the MRCA of the tips that match a
+    pattern (matched as in `smot grep`). If these tips span the current root,
+    the tree is rooted above the MRCA of the other tips instead.
+
+    Branch lengths, colors and the labels of internal nodes (such as support
+    values) are moved with their branches. The old root is removed if it is
+    left with a single child.
+
+    Examples:
+
+      smot root --midpoint 1B.tre
+
+      smot root --outgroup "|1B.2.2.1|" 1B.tre
+    """
+    import smot.algorithm as alg
+
+    if midpoint == (outgroup is not None):
+        die("Expected exactly one of --midpoint or --outgroup")
+    else:
+        try:
+            with timing.stage("root"):
+                node: Optional[AnyNode]
+                if outgroup is None:
+                    node = alg.rootMidpoint(tree_obj.tree)
+                else:
+                    matcher = grepMatcher(outgroup, False, perl, file)
+                    node = alg.rootOutgroup(tree_obj.tree, matcher)
+        except ValueError as e:
+            die(str(e))
+        else:
+            if node is None:
+                die("No tips match the pattern")
+            else:
+                tree_obj.tree = node
+    return tree_obj
+
+
+def emit_dist(
+    tree_obj: Tree,
+    nearest: Optional[int] = None,
+    matrix: Optional[str] = None,
+    **kwargs: Any,
+) -> None:
+    import smot.algorithm as alg
+    import smot.distance as sd
+
+    try:
+        (tipNodes, depths, between) = alg.patristicProfile(tree_obj.tree)
+    except ValueError as e:
+        die(str(e))
+        return
+    labels = [tip.data.label or "" for tip in tipNodes]
+    precision = settings().get("precision", sf.DEFAULT_PRECISION)
+    formatLength = sf.makeLengthFormatter(precision)
+
+    if matrix is not None:
+        error = sd.write_distance_matrix(matrix, depths, between)
+        if error is not None:
+            die(error)
+        for label in labels:
+            print(label)
+    elif nearest is not None:
+        sd.write_nearest_table(
+            labels, depths, between, nearest, sys.stdout, formatLength
+        )
+    else:
+        sd.write_distance_table(labels, depths, between, sys.stdout, formatLength)
+
+
+@click.command()
+@click.option(
+    "-k",
+    "--nearest",
+    type=click.IntRange(min=1),
+    help="Write only the K nearest tips of each tip, as rows of tip, neighbor and distance",
+)
+@click.option(
+    "--matrix",
+    type=click.Path(dir_okay=False),
+    help="Write a float32 NumPy matrix (.npy) to this file and the tip labels to STDOUT",
+)
+@dec_tree
+@tree_transform(emit=emit_dist)
+def dist(tree_obj: Tree) -> Tree:
+    """
+    Write the patristic distances between all tips.
+
+    By default, the distances are written as a TAB-delimited matrix with tip
+    labels in the first row and column. The rows are computed and written a
+    block at a time (vectorized with NumPy, if it is installed), so memory use
+    does not grow with the size of the matrix. All branches must have lengths.
+
+    Examples:
+
+      smot dist 1B.tre
+
+      smot dist --nearest 3 1B.tre
+    """
+    return tree_obj
+
+
+def dateReader(
+    date_by_capture: Optional[str], date_by_field: Optional[int]
+) -> Optional[Callable[[Optional[str]], str]]:
+    """
+    Make the function that reads the date column of `smot depth` from a tip
+    label, if a date was asked for
+    """
+    import smot.algorithm as alg
+    import re
+
+    if date_by_capture is not None:
+        pat = re.compile(date_by_capture)
+        return lambda label: alg.factorByCaptureFun(label, pat) or ""
+    elif date_by_field is not None:
+        field = date_by_field
+
+        def _field(label: Optional[str]) -> str:
+            fields = (label or "").split("|")
+            return fields[field - 1] if field <= len(fields) else ""
+
+        return _field
+    return None
+
+
+def write_depths(
+    depths: Iterable[Tuple[Optional[str], float]],
+    date_by_capture: Optional[str] = None,
+    date_by_field: Optional[int] = None,
+    **kwargs: Any,
+) -> None:
+    readDate = dateReader(date_by_capture, date_by_field)
+    precision = settings().get("precision", sf.DEFAULT_PRECISION)
+    formatLength = sf.makeLengthFormatter(precision)
+    write = sys.stdout.write
+    try:
+        for (label, depth) in depths:
+            row = f"{label or ''}\t{formatLength(depth)}"
+            if readDate is not None:
+                row += "\t" + readDate(label)
+            write(row + "\n")
+    except ValueError as e:
+        die(str(e))
+
+
+def emit_depth(tree_obj: Tree, **params: Any) -> None:
+    import smot.algorithm as alg
+
+    tipDepths = (
+        (node.data.label, depth)
+        for (node, depth) in alg.nodeDepths(tree_obj.tree)
+        if node.data.isLeaf
+    )
+    write_depths(tipDepths, **params)
+
+
+def stream_depth(fh: BinaryIO, **params: Any) -> None:
+    import smot.stream as ss
+
+    write_depths(ss.depths(fh), **params)
+
 
-        if newick:
-            print(sf.newick(tree_obj))
-        else:
-            print(sf.nexus(tree_obj))
+def rereadable(fh: BinaryIO, **params: Any) -> bool:
+    # the tree is read twice, once for the lengths of the internal nodes
+    return fh.seekable()
 
 
-#      smot tipsed <pattern> <replacement> [<filename>]
 @click.command()
-@click.argument("PATTERN", type=str)
-@click.argument("REPLACEMENT", type=str)
-@dec_newick
+@click.option(
+    "--date-by-capture",
+    type=str,
+    help="Add a column with the date captured from each label by this regular expression",
+)
+@click.option(
+    "--date-by-field",
+    type=click.IntRange(min=1),
+    help="Add a column with this 1-based field ('|' delimited) of each label",
+)
 @dec_tree
-def tipsed(pattern: str, replacement: str, newick: bool, tree: TextIO) -> None:
-    """
-    Search and replace patterns in tip labels.
+@tree_transform(emit=emit_depth, stream=stream_depth, stream_if=rereadable)
+def depth(tree_obj: Tree) -> Tree:
     """
+    Write the distance from the root to each tip.
 
-    import smot.algorithm as alg
-    import re
+    Rows hold the tip label, the root-to-tip distance and, if asked for, a date
+    read from the label (e.g., for checks of temporal signal). All branches must
+    have lengths. Newick and Nexus trees that are read from a file are read
+    without building the tree in memory.
 
-    pat = re.compile(pattern)
+    Examples:
 
-    def fun_(nodeData: AnyNodeData) -> AnyNodeData:
-        if nodeData.label:
-            nodeData.label = re.sub(pat, replacement, nodeData.label)
-        return nodeData
+      smot depth 1B.tre
 
-    tree_obj = read_tree(tree)
-    tree_obj.tree = alg.treemap(tree_obj.tree, fun_)
-    tree_obj.colmap = {
-        re.sub(pat, replacement, k): v for (k, v) in tree_obj.colmap.items()
-    }
+      smot depth --date-by-field 7 1B.tre
+    """
+    return tree_obj
 
-    if newick:
-        print(sf.newick(tree_obj))
-    else:
-        print(sf.nexus(tree_obj))
 
+def read_first_tree(path: str) -> Tree:
+    trees = read_trees(path)
+    try:
+        return next(trees)
+    except StopIteration:
+        die(f"No trees were found in '{path}'")
+        raise
+    finally:
+        trees.close()
 
-@click.command()
-@click.argument("PATTERN", type=str)
-@click.option(
-    "-v", "--invert-match", is_flag=True, help="Keep all leafs NOT matching the pattern"
-)
-@click.option(
-    "-P", "--perl", is_flag=True, help="Interpret the pattern as a regular expression"
-)
-@click.option(
-    "-f",
-    "--file",
+
+dec_rooted = click.option(
+    "--rooted",
     is_flag=True,
-    help="Read patterns from a file instead of a set string",
+    help="Compare the clades of rooted trees, rather than the splits of unrooted trees",
 )
-@dec_newick
-@dec_tree
-def grep(
-    pattern: str, tree: TextIO, invert_match: bool, perl: bool, newick: bool, file: bool
-):
-    """
-    Prune a tree to preserve only the tips that match a pattern.
+
+
+@click.command()
+@click.argument("REFERENCE", type=click.Path(dir_okay=False, allow_dash=True))
+@click.argument("TREES", nargs=-1)
+@dec_rooted
+def compare(reference: str, trees: Tuple[str, ...], rooted: bool) -> None:
     """
+    Compare trees to a reference tree by their splits.
 
+    For each tree in the TREES files (a file may hold many trees), a
+    TAB-delimited row is written with the file, the index of the tree in the
+    file, the number of tips shared with the reference, the number of shared
+    splits, the Robinson-Foulds distance, and the distance divided by the
+    number of splits in both trees. Splits are compared on the shared tips, so
+    sampled trees can be compared to the full tree.
+
+    Example:
+
+      smot compare pdm.tre pdm-equal.tre pdm-para.tre pdm-prop.tre
+    """
     import smot.algorithm as alg
-    import re
+    import smot.bipartition as bp
+
+    ref = read_first_tree(reference).tree
+    keys = bp.TipKeys()
+    refTips = alg.tipSet(ref)
+    refSplits = bp.splitSet(ref, keys, rooted)
+    formatLength = sf.makeLengthFormatter(
+        settings().get("precision", sf.DEFAULT_PRECISION)
+    )
 
-    if file:
-        with open(pattern, "r") as f:
-            patterns = [p.strip() for p in f.readlines()]
-            if invert_match:
-                matcher = lambda s: not any([p in s for p in patterns])
+    for path in expandTreePaths(trees):
+        for (i, tree_obj) in enumerate(read_trees(path), 1):
+            common = refTips & alg.tipSet(tree_obj.tree)
+            if common == refTips:
+                a = refSplits
             else:
-                matcher = lambda s: any([p in s for p in patterns])
-    elif perl:
-        regex = re.compile(pattern)
-        if invert_match:
-            matcher = lambda s: not re.search(regex, s)
-        else:
-            matcher = lambda s: bool(re.search(regex, s))
-    else:
-        if invert_match:
-            matcher = lambda s: pattern not in s
-        else:
-            matcher = lambda s: pattern in s
+                a = bp.splitSet(ref, keys, rooted, common)
+            b = bp.splitSet(tree_obj.tree, keys, rooted, common)
+            (shared, rf, normalized) = bp.robinsonFoulds(a, b)
+            print(
+                f"{path}\t{i}\t{len(common)}\t{shared}\t{rf}\t{formatLength(normalized)}"
+            )
 
-    def fun_(node: AnyNode) -> List[AnyNode]:
-        return [
-            kid for kid in node.kids if (not kid.data.isLeaf or matcher(kid.data.label))
-        ]
 
-    tree_obj = read_tree(tree)
-    tree_obj.tree = alg.clean(alg.treecut(tree_obj.tree, fun_))
+@click.command()
+@click.argument("REFERENCE", type=click.Path(dir_okay=False, allow_dash=True))
+@click.argument("TREES", nargs=-1)
+@dec_rooted
+@dec_newick
+def support(
+    reference: str, trees: Tuple[str, ...], rooted: bool, newick: bool
+) -> None:
+    """
+    Label the nodes of a reference tree with the proportion of trees that hold
+    their splits (e.g., the support from a set of bootstrap trees).
 
-    if newick:
-        print(sf.newick(tree_obj))
-    else:
-        print(sf.nexus(tree_obj))
+    The TREES files may each hold many trees, which are read one at a time.
+    Existing labels of internal nodes of the reference are replaced. Splits are
+    compared on the tips each tree shares with the reference.
+
+    Example:
+
+      smot support pdm.tre pdm-equal.tre pdm-para.tre pdm-prop.tre
+    """
+    import smot.bipartition as bp
+
+    ref_obj = read_first_tree(reference)
+    replicates = (
+        tree_obj.tree for path in expandTreePaths(trees) for tree_obj in read_trees(path)
+    )
+    (counts, ntrees) = bp.splitSupport(ref_obj.tree, replicates, bp.TipKeys(), rooted)
+    if ntrees == 0:
+        die("Expected at least one tree to count the splits of")
+
+    formatLength = sf.makeLengthFormatter(
+        settings().get("precision", sf.DEFAULT_PRECISION)
+    )
+    stack = [ref_obj.tree]
+    while stack:
+        node = stack.pop()
+        if id(node) in counts:
+            node.data.label = formatLength(counts[id(node)] / ntrees)
+        stack.extend(node.kids)
+
+    write_tree(ref_obj, newick=newick)
+
+
+@click.command()
+@click.argument("TREES", nargs=-1)
+@factoring
+@dec_default
+@dec_keep
+@dec_keep_regex
+@dec_max_tips
+@dec_min_tips
+@dec_proportion
+@dec_scale
+@dec_number
+def stat(
+    trees: Tuple[str, ...],
+    factor_by_capture: Optional[str],
+    factor_by_field: Optional[int],
+    factor_by_table: Optional[str],
+    default: Optional[str],
+    keep: List[str],
+    keep_regex: str,
+    max_tips: int,
+    min_tips: int,
+    proportion: Optional[float],
+    scale: Optional[float],
+    number: Optional[int],
+) -> None:
+    """
+    Summarize trees before sampling them.
+
+    For each tree in the TREES files (a file may hold many trees, which are
+    read one at a time), TAB-delimited rows are written with the file, the
+    index of the tree in the file, the name of a statistic and its values:
+
+      \b
+      tips, nodes     the number of tips and of internal nodes
+      max-depth       the most branches from the root to a tip
+      max-height      the greatest distance from the root to a tip
+      polytomies      the number of nodes with more than two children
+      polytomy        a number of children and the nodes that have it
+      missing-lengths the number of branches without lengths
+      branch-lengths  the minimum, quartiles and maximum branch length
+      factor          a factor, its tips, the number of its monophyletic
+                      groups and their least, median and greatest size
+      unfactored      the same for tips without a factor
+      sample          a sampler and the number of tips it keeps
+
+    The samplers are given the same options as `smot sample`. `equal` uses
+    --max-tips. `mono` and `para` are reported if --proportion, --scale or
+    --number is given, and `para` is an upper bound.
+
+    Example:
+
+      smot stat --factor-by-capture="(1B[.][^|]*)" -p 0.1 --min-tips=3 1B.tre
+    """
+    import smot.algorithm as alg
+    import smot.stats as st
+    import re
+
+    factor = factorLabeler(factor_by_capture, factor_by_field, factor_by_table, default)
+    keep_fun = (lambda label: bool(re.search(keep_regex, label))) if keep_regex else None
+    formatLength = sf.makeLengthFormatter(
+        settings().get("precision", sf.DEFAULT_PRECISION)
+    )
+    sampling = proportion is not None or scale is not None or number is not None
+
+    for path in expandTreePaths(trees):
+        for (i, tree_obj) in enumerate(read_trees(path), 1):
+            with timing.stage("stat"):
+                stats = st.treeStats(tree_obj.tree, factor, keep_fun, max_tips)
+            sizes = [("equal", st.equalSize(stats, keep, max_tips))]
+            if sampling:
+                mono = alg.monophyleticCounter(proportion, scale, number, min_tips)
+                para = alg.paraphyleticCounter(proportion, scale, number, min_tips)
+                sizes.append(("mono", st.monoSize(stats, keep, mono)))
+                sizes.append(("para", st.paraSize(stats, keep, para)))
+            st.write_stats(f"{path}\t{i}\t", stats, sizes, sys.stdout, formatLength)
 
 
 @click.command(name="filter")
@@ -734,9 +1970,12 @@ def grep(
 @dec_default
 @dec_patristic
 @dec_seed
+@dec_replicates
 @dec_newick
 @dec_tree
+@tree_transform()
 def filter_cmd(
+    tree_obj: Tree,
     # conditions
     all_match: List[str],
     some_match: List[str],
@@ -756,10 +1995,8 @@ def filter_cmd(
     # phylogenetic options
     patristic: bool,
     seed: Optional[int],
-    # boilerplate
-    newick: bool,
-    tree: TextIO,
-) -> None:
+    replicates: Optional[int],
+) -> Tree:
     """
     Subset or modify taxa by group.
 
@@ -780,11 +2017,14 @@ def filter_cmd(
       \b
       # Downsample any monophyletic group with more than 100 members
       smot filter --factor-by-capture="(1B[^|]*)" --larger-than=10 --sample=0.1 1B.tre
+
+      \b
+      # Write 5 such samples, drawn with the seeds 1 to 5, to one nexus file
+      smot filter --factor-by-capture="(1B[^|]*)" --larger-than=10 --sample=0.1 --seed=1 --replicates=5 1B.tre
     """
     import smot.algorithm as alg
     import re
 
-    tree_obj = read_tree(tree)
     tree_obj.tree = factorTree(
         node=tree_obj.tree,
         factor_by_capture=factor_by_capture,
@@ -822,6 +2062,21 @@ def filter_cmd(
             )
         )
 
+    if replicates is not None:
+        if sample is None or remove or color is not None:
+            die("--replicates can only be used with the --sample action")
+        else:
+            _sample = sample
+
+            def cladePlan(x):
+                return alg.monophyleticPlan(
+                    x, proportion=_sample, scale=None, minTips=3, keep_regex=""
+                )
+
+            with timing.stage("plan"):
+                plan = alg.filterPlan(tree_obj.tree, condition, cladePlan)
+            return sampleReplicates(tree_obj, plan, replicates, seed)
+
     action: Callable[[AnyNode], Optional[AnyNode]]
     if remove:
 
@@ -859,15 +2114,14 @@ def filter_cmd(
 
     if filteredNode is None:
         # make an empty tree
-        tree_obj.tree = makeTree(makeNode())
+        tree_obj.tree = makeNode()
     else:
         # otherwise clean the existing node
-        tree_obj.tree = alg.clean(filteredNode)
+        with timing.stage("clean") as stage:
+            tree_obj.tree = alg.clean(filteredNode)
+            stage.count(tree_obj)
 
-    if newick:
-        print(sf.newick(tree_obj))
-    else:
-        print(sf.nexus(tree_obj))
+    return tree_obj
 
 
 @click.command()
@@ -882,7 +2136,8 @@ def filter_cmd(
     "-P", "--perl", is_flag=True, help="Interpret the pattern as a regular expression"
 )
 @dec_tree
-def leaf(pattern: List[Tuple[str, str]], perl: bool, tree: TextIO) -> None:
+@tree_transform()
+def leaf(tree_obj: Tree, pattern: List[Tuple[str, str]], perl: bool) -> Tree:
     """
     Color the taxa labels on a tree.
 
@@ -891,7 +2146,8 @@ def leaf(pattern: List[Tuple[str, str]], perl: bool, tree: TextIO) -> None:
     The tips are colored in the order that the `-p` options are specified, so
     previously colored labels may be recolored by subsequent commands.
 
-    The output file is always in nexus format.
+    The output file is always in nexus format (or newick with tip colors written
+    on the tips, with --multi).
 
     Examples:
 
@@ -902,8 +2158,6 @@ def leaf(pattern: List[Tuple[str, str]], perl: bool, tree: TextIO) -> None:
     import smot.algorithm as alg
     import re
 
-    tree_obj = read_tree(tree)
-
     tips = alg.tips(tree_obj.tree)
 
     for (pat_str, col) in pattern:
@@ -916,7 +2170,7 @@ def leaf(pattern: List[Tuple[str, str]], perl: bool, tree: TextIO) -> None:
             if matcher(tip):
                 tree_obj.colmap[tip] = col
 
-    print(sf.nexus(tree_obj))
+    return tree_obj
 
 
 colormap_arg = click.option(
@@ -961,17 +2215,15 @@ def chooseColorScheme(factors: List[str]) -> Dict[str, str]:
 
 
 def colorBranches(
+    tree_obj: Tree,
     is_para: bool,
     factor_by_capture: Optional[str],
     factor_by_field: Optional[int],
     factor_by_table: Optional[str],
     colormap: Optional[str],
-    tree: TextIO,
-):
+) -> Tree:
     import smot.algorithm as alg
 
-    tree_obj = read_tree(tree)
-
     tree_obj.tree = factorTree(
         node=tree_obj.tree,
         factor_by_capture=factor_by_capture,
@@ -982,21 +2234,8 @@ def colorBranches(
 
     factors = sorted(list(tree_obj.tree.data.factorCount.keys()))
 
-    _colormap = dict()
     if colormap:
-        with open(colormap, "r") as f:
-            try:
-                _colormap = {
-                    f.strip(): c.strip().upper()
-                    for (f, c) in [p.strip().split("\t") for p in f.readlines()]
-                }
-                for clade, color in _colormap.items():
-                    if color[0] != "#":
-                        _colormap[clade] = "#" + color
-                    if len(color) != 7:
-                        die('Expected colors in hexadecimal (e.g., "#AA10FF")')
-            except ValueError:
-                die("Invalid color map: expected TAB-delimited, two-column file")
+        _colormap = readColormap(colormap)
     else:
         _colormap = chooseColorScheme(factors)
 
@@ -1005,14 +2244,21 @@ def colorBranches(
     else:
         tree_obj.tree = alg.colorMono(tree_obj.tree, colormap=_colormap)
 
-    print(sf.nexus(tree_obj))
+    return tree_obj
 
 
 @click.command(name="mono")
 @factoring
 @colormap_arg
 @dec_tree
-def mono_color_cmd(**kwargs):
+@tree_transform()
+def mono_color_cmd(
+    tree_obj: Tree,
+    factor_by_capture: Optional[str],
+    factor_by_field: Optional[int],
+    factor_by_table: Optional[str],
+    colormap: Optional[str],
+) -> Tree:
     """
     Color a tree by monophyletic factor.
 
@@ -1040,14 +2286,28 @@ def mono_color_cmd(**kwargs):
 
     Any factors/clades not included in the colormap will default to black.
     """
-    colorBranches(is_para=False, **kwargs)
+    return colorBranches(
+        tree_obj,
+        is_para=False,
+        factor_by_capture=factor_by_capture,
+        factor_by_field=factor_by_field,
+        factor_by_table=factor_by_table,
+        colormap=colormap,
+    )
 
 
 @click.command(name="para")
 @factoring
 @colormap_arg
 @dec_tree
-def para_color_cmd(**kwargs):
+@tree_transform()
+def para_color_cmd(
+    tree_obj: Tree,
+    factor_by_capture: Optional[str],
+    factor_by_field: Optional[int],
+    factor_by_table: Optional[str],
+    colormap: Optional[str],
+) -> Tree:
     """
     Color a tree by paraphyletic factor.
 
@@ -1071,7 +2331,14 @@ def para_color_cmd(**kwargs):
 
     Any factors/clades not included in the colormap will default to black.
     """
-    colorBranches(is_para=True, **kwargs)
+    return colorBranches(
+        tree_obj,
+        is_para=True,
+        factor_by_capture=factor_by_capture,
+        factor_by_field=factor_by_field,
+        factor_by_table=factor_by_table,
+        colormap=colormap,
+    )
 
 
 @click.command(name="rm")
@@ -1081,13 +2348,13 @@ def para_color_cmd(**kwargs):
     help="Write output in newick format (metadata will be lost)",
 )
 @dec_tree
-def rm_color(newick: bool, tree: TextIO) -> None:
+@tree_transform()
+def rm_color(tree_obj: Tree) -> Tree:
     """
     Remove all color annotations from a tree
     """
     import smot.algorithm as alg
 
-    tree_obj = read_tree(tree)
     tree_obj.colmap = dict()
 
     def _fun(d):
@@ -1097,10 +2364,7 @@ def rm_color(newick: bool, tree: TextIO) -> None:
 
     tree_obj.tree = alg.treemap(tree_obj.tree, _fun)
 
-    if newick:
-        print(sf.newick(tree_obj))
-    else:
-        print(sf.nexus(tree_obj))
+    return tree_obj
 
 
 # Remove all black color
@@ -1153,37 +2417,260 @@ def make_node2tip(
 
 @click.command(name="pull")
 @dec_tree
-def pull_color(tree: TextIO) -> None:
+@tree_transform()
+def pull_color(tree_obj: Tree) -> Tree:
     "Pull colors from tips to nodes"
 
     import smot.algorithm as alg
 
-    tree_obj = read_tree(tree)
-
     colmap = tree_obj.colmap
 
     tree_obj.tree = alg.treemap(tree_obj.tree, make_unblack(colmap))
     tree_obj.tree = alg.treepull(tree_obj.tree, make_tip2node(colmap))
     tree_obj.tree = alg.treepush(tree_obj.tree, make_node2tip(colmap))
 
-    print(sf.nexus(tree_obj))
+    return tree_obj
 
 
 @click.command(name="push")
 @dec_tree
-def push_color(tree: TextIO):
+@tree_transform()
+def push_color(tree_obj: Tree) -> Tree:
     "Push colors from nodes to tips"
 
     import smot.algorithm as alg
 
-    tree_obj = read_tree(tree)
-
     colmap = tree_obj.colmap
 
     tree_obj.tree = alg.treemap(tree_obj.tree, make_unblack(colmap))
     tree_obj.tree = alg.treepush(tree_obj.tree, make_node2tip(colmap))
 
-    print(sf.nexus(tree_obj))
+    return tree_obj
+
+
+def emit_converted(tree_obj: Tree, to: str, **kwargs: Any) -> None:
+    import smot.binary as sb
+
+    if to.lower() == "binary":
+        if settings().get("multi"):
+            die("Binary trees cannot be written with --multi")
+        sys.stdout.flush()
+        sb.write_binary(tree_obj, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    else:
+        write_tree(tree_obj, newick=to.lower() == "newick")
+
+
+@click.command()
+@click.option(
+    "--to",
+    "to",
+    type=click.Choice(["nexus", "newick", "binary"], case_sensitive=False),
+    default="nexus",
+    help="The output format",
+)
+@dec_tree
+@tree_transform(emit=emit_converted)
+def convert(tree_obj: Tree) -> Tree:
+    """
+    Convert a tree between nexus, newick and the compact smot binary format.
+
+    Binary trees load much faster than text trees and every smot command
+    accepts them as input. The format is specific to smot, so convert back to
+    nexus or newick before passing a tree to other programs.
+
+    Examples:
+
+      \b
+      smot convert --to=binary 1B.tre > 1B.smot
+      smot convert --to=newick 1B.smot
+    """
+    return tree_obj
+
+
+def resetNodeData(tree_obj: Tree) -> Tree:
+    """
+    Clear the factors and counts left on the nodes by a previous subcommand,
+    so each stage of a pipe sees the same tree it would read from a file.
+    """
+    stack = [tree_obj.tree]
+    while stack:
+        node = stack.pop()
+        node.data.factor = None
+        node.data.nleafs = None
+        node.data.factorCount = None
+        node.data.factorDist = dict()
+        stack.extend([kid for kid in node.kids if kid is not None])
+    return tree_obj
+
+
+def resolveStage(
+    ctx: click.Context, stage: str
+) -> Tuple[Callable[[Tree, Dict[str, Any]], Tree], Emitter, Dict[str, Any]]:
+    """
+    Find the subcommand for a pipe stage (e.g., "sample para -p 0.1") and
+    parse its arguments
+    """
+    import shlex
+
+    args = shlex.split(stage)
+    command: click.Command = cli
+    names: List[str] = []
+    while isinstance(command, click.Group):
+        if not args:
+            raise click.UsageError(f"Incomplete pipe stage '{stage}'", ctx)
+        subcommand = command.get_command(ctx, args[0])
+        if subcommand is None:
+            raise click.UsageError(
+                f"No subcommand '{args[0]}' in pipe stage '{stage}'", ctx
+            )
+        names.append(args.pop(0))
+        command = subcommand
+    if command.callback not in _stages:
+        raise click.UsageError(f"'{' '.join(names)}' cannot be used in a pipe", ctx)
+    stage_ctx = command.make_context(" ".join(names), args, parent=ctx)
+    (apply, emit) = _stages[command.callback]
+    return (apply, emit, stage_ctx.params)
+
+
+@click.command()
+@click.argument("STAGES", nargs=-1)
+@click.option(
+    "-f",
+    "--script",
+    type=click.File("r"),
+    help="Read stages from a file, one per line (blank lines and lines starting with '#' are skipped)",
+)
+@click.option(
+    "-t",
+    "--tree",
+    type=click.File("rb"),
+    default="-",
+    help="The input tree (default: STDIN)",
+)
+@click.pass_context
+def pipe(
+    ctx: click.Context, stages: Tuple[str, ...], script: Optional[TextIO], tree: BinaryIO
+) -> None:
+    """
+    Chain subcommands in one process. The tree is read once, each stage
+    (a quoted subcommand with its options, but without a TREE argument)
+    modifies the tree in memory, and only the output of the last stage is
+    written. Since the tree is not written between stages, branch lengths keep
+    their full precision.
+
+    Example:
+
+      \b
+      smot pipe -t pdm.tre 'grep -v Ohio' 'color branch para --factor-by-capture="(swine|human)"' 'color push'
+    """
+    if script is not None:
+        lines = [line.strip() for line in script.readlines()]
+        stages = tuple(stages) + tuple(x for x in lines if x and not x.startswith("#"))
+
+    if not stages:
+        raise click.UsageError("Expected at least one pipe stage", ctx)
+
+    # resolve every stage before reading the tree, so errors show up early
+    resolved = [resolveStage(ctx, stage) for stage in stages]
+
+    tree_obj = read_tree(tree)
+    runStages(tree_obj, resolved)
+
+
+def runStages(
+    tree_obj: Tree,
+    resolved: List[
+        Tuple[Callable[[Tree, Dict[str, Any]], Tree], Emitter, Dict[str, Any]]
+    ],
+) -> None:
+    """
+    Apply each resolved stage to the tree and emit the output of the last one
+    """
+    if any(params.get("replicates") for (_, _, params) in resolved[:-1]):
+        raise click.UsageError("--replicates can only be used in the last stage")
+    for (i, (apply, emit, params)) in enumerate(resolved):
+        if i > 0:
+            tree_obj = resetNodeData(tree_obj)
+        tree_obj = apply(tree_obj, params)
+    emit(tree_obj, **params)
+
+
+def answerRequest(
+    ctx: click.Context, cache: TreeCache, request: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Answer one `smot serve` request. The request names a tree file and the
+    stages to run on it, as for `smot pipe`, and the response holds the output
+    of the last stage or an error message.
+    """
+    if request.get("stats"):
+        return dict(ok=True, stats=cache.stats())
+
+    stages = request.get("stages")
+    if isinstance(stages, str):
+        stages = [stages]
+    if not isinstance(request.get("tree"), str) or not stages:
+        return dict(ok=False, error="Expected a 'tree' path and a list of 'stages'")
+
+    out = io.BytesIO()
+    err = io.StringIO()
+    try:
+        # the request runs in a worker thread, where the click context must be
+        # pushed again for subcommands to see the global options
+        with ctx, redirectStdout(out), contextlib.redirect_stderr(err):
+            resolved = [resolveStage(ctx, str(stage)) for stage in stages]
+            runStages(cache.get(request["tree"]), resolved)
+    except click.ClickException as e:
+        return dict(ok=False, error=e.format_message())
+    except OSError as e:
+        return dict(ok=False, error=str(e))
+    except SystemExit:
+        return dict(ok=False, error=err.getvalue().strip())
+    except Exception as e:
+        # e.g., a tree file that does not parse or a bad regular expression,
+        # neither of which should take down the server or the connection
+        return dict(ok=False, error=str(e) or type(e).__name__)
+    return dict(ok=True, output=out.getvalue().decode("utf-8"))
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    required=True,
+    help="The path of the Unix socket to listen on",
+)
+@click.option(
+    "--max-memory",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_MEMORY,
+    help="Megabytes of loaded trees to keep before the least recently used are dropped",
+)
+@click.pass_context
+def serve(ctx: click.Context, socket_path: str, max_memory: int) -> None:
+    """
+    Keep trees loaded and answer requests on a Unix socket. Each request is a
+    JSON object on one line with a "tree" path and a list of "stages" that are
+    run as by `smot pipe`. Each response is a JSON object on one line, either
+    {"ok": true, "output": ...} or {"ok": false, "error": ...}. The request
+    {"stats": true} describes the trees in the cache.
+
+    Parsed trees are cached in memory (up to --max-memory) and reloaded when
+    their files change. Many clients may connect at once, their requests are
+    run one at a time.
+
+    For example, with a server started by `smot serve --socket /tmp/smot.sock`,
+    this prints the tips of a subsampled tree as JSON:
+
+      \b
+      echo '{"tree": "1B.tre", "stages": ["sample para -p 0.1 --seed 4", "tips"]}' | nc -U /tmp/smot.sock
+    """
+    from smot.server import serve as serveSocket
+
+    cache = TreeCache(max_memory * 1024 * 1024, cache_dir=settings().get("cache_dir"))
+    serveSocket(socket_path, lambda request: answerRequest(ctx, cache, request))
 
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -1195,8 +2682,52 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
     epilog=make_epilog("smot color"),
 )
 @click.version_option(__version__, "-v", "--version", message=__version__)
-def cli():
-    pass
+@click.option(
+    "--precision",
+    type=Precision,
+    default=str(sf.DEFAULT_PRECISION),
+    help="Significant digits in written branch lengths, or 'exact' to write lengths that read back exactly",
+)
+@click.option(
+    "--translate",
+    is_flag=True,
+    help="Write nexus trees with a TRANSLATE table and integer tip indices",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    envvar="SMOT_CACHE_DIR",
+    help="Keep binary copies of parsed trees in this folder and reuse them when the same input is read again (or set SMOT_CACHE_DIR)",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    help="Report the time, node count and peak memory of each stage to STDERR (or set SMOT_TIMINGS=1)",
+)
+@click.option(
+    "--timings-json",
+    is_flag=True,
+    help="Report timings as JSON (or set SMOT_TIMINGS=json)",
+)
+@click.pass_context
+def cli(
+    ctx,
+    precision: Optional[int],
+    translate: bool,
+    cache_dir: Optional[str],
+    timings: bool,
+    timings_json: bool,
+):
+    ctx.ensure_object(dict)
+    ctx.obj["precision"] = precision
+    ctx.obj["translate"] = translate
+    ctx.obj["cache_dir"] = cache_dir
+
+    env = os.environ.get("SMOT_TIMINGS", "").lower()
+    as_json = timings_json or env == "json"
+    if timings or as_json or env not in ["", "0", "false", "no"]:
+        timing.enable()
+        ctx.call_on_close(lambda: timing.report(sys.stderr, as_json=as_json))
 
 
 @click.group(context_settings=CONTEXT_SETTINGS, epilog=make_epilog("smot sample para"))
@@ -1301,8 +2832,18 @@ cli.add_command(sample)
 cli.add_command(factor)
 cli.add_command(tipsed)
 cli.add_command(grep)
+cli.add_command(mrca)
+cli.add_command(root)
+cli.add_command(dist)
+cli.add_command(depth)
+cli.add_command(compare)
+cli.add_command(support)
+cli.add_command(stat)
 cli.add_command(filter_cmd)
 cli.add_command(color)
+cli.add_command(convert)
+cli.add_command(pipe)
+cli.add_command(serve)
 
 
 def main():
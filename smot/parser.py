@@ -1,16 +1,22 @@
 from __future__ import annotations
-from typing import TextIO, List, Dict, TypeVar, Tuple, Optional
+from typing import Any, TextIO, List, Dict, TypeVar, Tuple, Optional, Iterator, TYPE_CHECKING
 
 import parsec as p
 from parsec import Parser
 import re
 from smot.classes import makeNode, makeTree, Tree, AnyNode
 
+if TYPE_CHECKING:
+    from smot.sharing import SubtreeTable
+
 A = TypeVar("A")
 B = TypeVar("B")
 
 p_whitespace = p.regex(r"\s*", re.MULTILINE)
 
+# The end of a Nexus block, "end;" or "endblock;" at the start of a line
+_block_end = re.compile(r"^[ \t]*end(?:block)?[ \t]*;", re.I | re.M)
+
 
 def read_fh(treefh: TextIO) -> Tree:
     rawtree_lines = treefh.readlines()
@@ -28,6 +34,24 @@ def read_text(treestr: str) -> Tree:
     return p_tree.parse(treestr)
 
 
+def read_trees(treefile: str, table: Optional[SubtreeTable] = None) -> Iterator[Tree]:
+    """
+    Read the trees of a file that may hold many (e.g., a bootstrap or
+    posterior set), one at a time. If a SubtreeTable is given, the subtrees of
+    the trees are interned in it, so that trees share the clades they have in
+    common (see smot.sharing).
+    """
+    from smot.stream import split_trees, tree_text
+
+    with open(treefile, "rb") as fh:
+        (header, statements) = split_trees(fh)
+        for statement in statements:
+            tree_obj = read_text(tree_text(header, statement))
+            if table is not None:
+                tree_obj.tree = table.intern(tree_obj.tree)
+            yield tree_obj
+
+
 def p_parens(parser: Parser[A]) -> Parser[A]:
     return p.string("(") >> parser << p.string(")")
 
@@ -131,22 +155,39 @@ def p_nexus():
 @p.generate
 def p_nexus_section():
     tag = yield (
-        p.regex("begin\s+") >> p.regex("[^; ]*", re.I) << p.regex("\s*;\s*\n")
+        p.regex(r"begin\s+", re.I) >> p.regex("[^; ]*") << p.regex("\s*;\s*\n")
     ).parsecmap(lambda x: x.lower())
     if tag == "trees":
+        table = yield p.optional(p_translate_block)
         val = yield p.many1(p_nexus_tree_line).parsecmap(firstTree)
-    # The only thing I currently use the taxalist for is to extract colors. It
-    # can also be used as a map from integer indices in the newick to field
-    # names, but this is not yet something I want to support.
+        if table:
+            val = translateTips(val, table)
+    # The only thing I currently use the taxalist for is to extract colors.
+    # Integer indices in the newick are mapped to labels through the TRANSLATE
+    # block in the trees section, not through the taxalist.
     elif tag == "taxa":
         val = yield p_taxa_block
     else:
-        val = yield p.many(p.string("\t") >> p.regex("[^;]*") << p.string(";\n"))
-    yield p.regex("end;", re.I)
+        val = yield p_opaque_block
+    yield p.regex(r"[ \t]*end(block)?[ \t]*;", re.I)
     yield p_whitespace
     return (tag, val)
 
 
+@Parser
+def p_opaque_block(text: Any, index: int) -> p.Value:
+    """
+    The body of a block that smot does not use (e.g., DATA, CHARACTERS or
+    ASSUMPTIONS), which is kept as one verbatim string. The end of the block is
+    found with a regular expression search rather than by parsing the body, so
+    large character matrices load quickly.
+    """
+    m = _block_end.search(text, index)
+    if m is None:
+        return p.Value.failure(index, "end;")
+    return p.Value.success(m.start(), text[index : m.start()])
+
+
 @p.generate
 def p_taxa_block():
     yield p.regex("\tdimensions.*\n", re.I)
@@ -158,6 +199,36 @@ def p_taxa_block():
     return make_tip_color_map(vals)
 
 
+p_translate_label: Parser[str]
+p_translate_label = p_figtree_quote ^ p_dquoted(p_dchar) ^ p.regex(r"[^,;\s]+")
+
+p_translate_pair: Parser[Tuple[str, str]]
+p_translate_pair = (p.regex(r"\s*") >> p.regex(r"\d+") << p.regex(r"\s+")) + (
+    p_translate_label << p.regex(r"\s*")
+)
+
+p_translate_block: Parser[Dict[str, str]]
+p_translate_block = (
+    p.regex(r"\s*translate\s+", re.I)
+    >> p.sepBy1(p_translate_pair, p.string(","))
+    << p.regex(r";[ \t]*\n")
+).parsecmap(toDict)
+
+
+def translateTips(node: AnyNode, table: Dict[str, str]) -> AnyNode:
+    """
+    Replace integer tip tokens with the labels they index in a TRANSLATE table
+    """
+    stack = [node]
+    while stack:
+        x = stack.pop()
+        if x.kids:
+            stack.extend(x.kids)
+        elif x.data.label in table:
+            x.data.label = table[x.data.label]
+    return node
+
+
 @p.generate
 def p_nexus_tree_line():
     yield p.regex("\t\s*tree\s*[^ ]+\s*=[^(]*", re.I)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from smot.classes import Tree
+from smot.util import log
+from collections import OrderedDict
+import os
+
+# Default size limit of the tree cache in megabytes
+DEFAULT_MAX_MEMORY = 1024
+
+Handler = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+class TreeCache:
+    """
+    A least-recently-used cache of trees keyed by file path.
+
+    Trees are kept in the compact binary format and decoded for every request.
+    Decoding is fast compared to parsing, each request gets a tree that it can
+    freely modify, and the memory limit can be checked against the exact size
+    of the cached data. A tree is loaded again when its file changes.
+    """
+
+    def __init__(self, max_bytes: int, cache_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, Tuple[Tuple[int, int], bytes]] = OrderedDict()
+
+    def get(self, path: str) -> Tree:
+        from smot.binary import binary, is_binary, read_binary, read_bytes
+
+        key = os.path.realpath(path)
+        info = os.stat(key)
+        stamp = (info.st_mtime_ns, info.st_size)
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return read_binary(entry[1])
+
+        self.misses += 1
+        with open(key, "rb") as fh:
+            data = fh.read()
+        if is_binary(data):
+            tree = read_binary(data)
+        else:
+            tree = read_bytes(data, cache_dir=self.cache_dir)
+            data = binary(tree)
+
+        self._remove(key)
+        self._entries[key] = (stamp, data)
+        self.nbytes += len(data)
+        # the newest tree is kept even if it alone is over the limit
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+        return tree
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= len(entry[1])
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            trees=list(self._entries.keys()),
+            bytes=self.nbytes,
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses,
+        )
+
+
+async def _answer(reader, writer, handle: Handler, executor) -> None:
+    import asyncio
+    import json
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Expected a JSON object")
+            except ValueError as e:
+                response: Dict[str, Any] = dict(ok=False, error=f"Bad request: {e}")
+            else:
+                response = await loop.run_in_executor(executor, handle, request)
+            writer.write(json.dumps(response).encode("utf-8") + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _serve(socket_path: str, handle: Handler) -> None:
+    import asyncio
+    import concurrent.futures
+
+    # Requests are read and answered concurrently, but run one at a time in a
+    # single worker thread, since subcommands write their output to STDOUT.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        server = await asyncio.start_unix_server(
+            lambda r, w: _answer(r, w, handle, executor), path=socket_path
+        )
+        log(f"Listening on {socket_path}")
+        async with server:
+            await server.serve_forever()
+
+
+def serve(socket_path: str, handle: Handler) -> None:
+    """
+    Answer newline-delimited JSON requests on a Unix socket until interrupted
+    """
+    import asyncio
+    import stat
+
+    # remove the socket left behind by a previous server
+    if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        os.unlink(socket_path)
+
+    try:
+        asyncio.run(_serve(socket_path, handle))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,294 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from smot.classes import AnyNode, Node, makeNode, makeNodeData
+
+# Hash-consed subtrees, shared between the trees of a tree set
+#
+# The trees of a bootstrap or posterior set share most of their clades. A
+# SubtreeTable interns subtrees: each node is looked up by its label, form,
+# length (optionally) and the identities of its children, which are interned
+# first, so a clade that is written the same way in many trees is stored once
+# and the trees become one graph of shared nodes. Interning takes one pass
+# over a tree, children before parents. Children are compared in order, as
+# written.
+#
+# Interned nodes are shared, so they must never be modified in place. The
+# algorithms in smot.algorithm modify their input, so a tree is copied out of
+# the table with `unshare` before it is given to one of them (copy-on-write).
+#
+# A Snapshot makes cheap forks of one tree in the same way. The tree is
+# indexed once, and each fork (a tree with tips kept or removed, or with one
+# subtree replaced) is built by copying only the nodes on the paths from the
+# changed tips to the root. Every clade that a fork leaves whole is shared
+# with the snapshot, so many sampled variants of a tree cost about the size of
+# their changed paths each, rather than a copy of the tree each.
+
+
+class SubtreeTable:
+    """
+    Interns the subtrees of trees, so that the subtrees that many trees share
+    are stored once. If `lengths` is False, branch lengths are dropped and
+    subtrees are shared by their topology and labels alone.
+    """
+
+    def __init__(self, lengths: bool = True):
+        self.lengths = lengths
+        self._nodes: Dict[Tuple[Any, ...], AnyNode] = dict()
+        # the number of nodes in all interned trees
+        self.seen = 0
+
+    def __len__(self) -> int:
+        """
+        The number of distinct subtrees stored
+        """
+        return len(self._nodes)
+
+    def intern(self, node: AnyNode) -> AnyNode:
+        """
+        Intern a tree and return its shared root. The nodes of the tree are
+        reused for subtrees that are new to the table, so the tree that is
+        given must not be used afterwards.
+        """
+        # the nodes in preorder, with the parent and child index of each
+        nodes: List[AnyNode] = []
+        places: List[Tuple[int, int]] = []
+        stack = [(node, -1, 0)]
+        while stack:
+            (node, parent, j) = stack.pop()
+            nodes.append(node)
+            places.append((parent, j))
+            i = len(nodes) - 1
+            stack.extend((kid, i, j) for (j, kid) in enumerate(node.kids))
+
+        # children before parents, so the children of a node are interned
+        # (and the keys of its children are stable) when it is looked up
+        self.seen += len(nodes)
+        for i in range(len(nodes) - 1, -1, -1):
+            node = nodes[i]
+            data = node.data
+            key = (
+                data.label,
+                data.length if self.lengths else None,
+                tuple(sorted(data.form.items())) if data.form else (),
+                data.isLeaf,
+                tuple(id(kid) for kid in node.kids),
+            )
+            shared = self._nodes.get(key)
+            if shared is None:
+                if not self.lengths:
+                    data.length = None
+                shared = self._nodes[key] = node
+            nodes[i] = shared
+            (parent, j) = places[i]
+            if parent >= 0 and nodes[parent].kids[j] is not shared:
+                nodes[parent].kids[j] = shared
+        return nodes[0]
+
+
+def _copy(node: AnyNode, kids: Optional[List[AnyNode]] = None) -> AnyNode:
+    """
+    A new node with the intrinsic data of a node (label, form, length and
+    factor) and the given children
+    """
+    data = node.data
+    new: AnyNode = Node()
+    new.kids = [] if kids is None else kids
+    new.data = makeNodeData(
+        label=data.label,
+        form=dict(data.form),
+        length=data.length,
+        isLeaf=data.isLeaf,
+        factor=getattr(data, "factor", None),
+    )
+    return new
+
+
+def unshare(node: AnyNode) -> AnyNode:
+    """
+    Copy a tree out of a SubtreeTable or a Snapshot, so that it can be
+    modified without changing the trees that share its nodes. Only the
+    intrinsic data of the nodes (label, form, length and factor) is copied.
+    """
+    root = _copy(node)
+    stack = [(node, root)]
+    while stack:
+        (old, new) = stack.pop()
+        new.kids = [_copy(kid) for kid in old.kids]
+        stack.extend(zip(old.kids, new.kids))
+    return root
+
+
+class Snapshot:
+    """
+    A tree that is no longer modified in place, from which forks are made.
+
+    Forks share the nodes of the tree that they do not change, so neither the
+    tree nor a fork may be modified in place (use `unshare` for a private
+    copy). A fork can be snapshotted in turn.
+    """
+
+    def __init__(self, node: AnyNode):
+        self.root = node
+        # the nodes in preorder with the index of the parent and the number of
+        # tips of each
+        self._nodes: List[AnyNode] = []
+        self._parents: List[int] = []
+        stack = [(node, -1)]
+        while stack:
+            (node, parent) = stack.pop()
+            self._nodes.append(node)
+            self._parents.append(parent)
+            i = len(self._nodes) - 1
+            stack.extend((kid, i) for kid in reversed(node.kids))
+        self._index = {id(node): i for (i, node) in enumerate(self._nodes)}
+        self._tips: Dict[Optional[str], List[int]] = dict()
+        self._nleafs = [0] * len(self._nodes)
+        for i in range(len(self._nodes) - 1, -1, -1):
+            node = self._nodes[i]
+            if not node.kids:
+                self._nleafs[i] += 1
+                self._tips.setdefault(node.data.label, []).append(i)
+            if self._parents[i] >= 0:
+                self._nleafs[self._parents[i]] += self._nleafs[i]
+
+    def keep(
+        self, labels: Iterable[str], clades: Iterable[AnyNode] = ()
+    ) -> Optional[AnyNode]:
+        """
+        A fork with only the tips with the given labels. As in
+        `smot.algorithm.clean`, nodes that are left with one child are removed
+        and their lengths added to the child's. Returns None if no tip is kept.
+
+        Each of the nodes in `clades` is cleaned on its own first, as
+        `smot.algorithm.sampleMonophyletic` cleans each clade it samples: the
+        lengths removed within the clade are added up before those above it,
+        and a clade left with one tip is given a root without a length (which
+        drops the lengths of the removed nodes above it).
+        """
+        labels = set(labels)
+        # fewer paths change if the tips that are not kept are counted
+        if 2 * len(labels) > len(self._tips):
+            return self.remove(set(self._tips) - labels, clades)
+        return self._fork(self._count(labels), kept=True, clades=clades)
+
+    def remove(
+        self, labels: Iterable[Optional[str]], clades: Iterable[AnyNode] = ()
+    ) -> Optional[AnyNode]:
+        """
+        A fork without the tips with the given labels, cleaned as by `keep`.
+        Returns None if no tip is left.
+        """
+        return self._fork(self._count(labels), kept=False, clades=clades)
+
+    def replace(self, node: AnyNode, new: AnyNode) -> AnyNode:
+        """
+        A fork with a node of the tree replaced (e.g., by a recolored or
+        resampled copy of its subtree)
+        """
+        i = self._index[id(node)]
+        while self._parents[i] >= 0:
+            parent = self._nodes[self._parents[i]]
+            kids = [new if kid is self._nodes[i] else kid for kid in parent.kids]
+            new = _copy(parent, kids)
+            i = self._parents[i]
+        return new
+
+    def _count(self, labels: Iterable[Optional[str]]) -> Dict[int, int]:
+        """
+        The number of the given tips below each node above them
+        """
+        counts: Dict[int, int] = dict()
+        for label in set(labels):
+            for i in self._tips.get(label, []):
+                counts[i] = 1
+                # each path is walked up to the first node already counted
+                i = self._parents[i]
+                while i >= 0 and i not in counts:
+                    counts[i] = 0
+                    i = self._parents[i]
+        # then the counts are summed, children before parents
+        for i in sorted(counts, reverse=True):
+            if self._parents[i] >= 0:
+                counts[self._parents[i]] += counts[i]
+        return counts
+
+    def _fork(
+        self, counts: Dict[int, int], kept: bool, clades: Iterable[AnyNode] = ()
+    ) -> Optional[AnyNode]:
+        # only the counted nodes change, children before parents
+        forks: Dict[int, Optional[AnyNode]] = dict()
+        # the lengths of collapsed forks, from the kept node up through the
+        # removed ones, which are added once the fork is placed
+        chains: Dict[int, List[Optional[float]]] = dict()
+        isolated = {self._index[id(node)] for node in clades}
+
+        def _isolate(j: int, fork: AnyNode) -> AnyNode:
+            # clean a clade on its own, see `keep`
+            n = counts.get(j, 0) if kept else self._nleafs[j] - counts.get(j, 0)
+            if j not in isolated:
+                return fork
+            elif n == 1:
+                if j not in chains:
+                    fork = _copy(fork, list(fork.kids))
+                chains[j] = [_addLengths(chains.pop(j, [fork.data.length])), None]
+            elif j in chains:
+                chains[j] = [_addLengths(chains[j])]
+            return fork
+
+        for i in sorted(counts, reverse=True):
+            node = self._nodes[i]
+            n = counts[i] if kept else self._nleafs[i] - counts[i]
+            if n == 0:
+                forks[i] = None
+                continue
+            elif n == self._nleafs[i]:
+                forks[i] = node
+                continue
+            kids: List[Tuple[int, AnyNode]] = []
+            for kid in node.kids:
+                j = self._index[id(kid)]
+                fork = forks[j] if j in counts else (None if kept else kid)
+                if fork is not None:
+                    kids.append((j, _isolate(j, fork)))
+            if len(kids) == 1:
+                # remove the node, its length is added to its child's
+                ((j, kid),) = kids
+                if j in chains:
+                    chains[i] = chains.pop(j) + [node.data.length]
+                    forks[i] = kid
+                else:
+                    chains[i] = [kid.data.length, node.data.length]
+                    forks[i] = _copy(kid, list(kid.kids))
+            else:
+                forks[i] = _copy(node, [_place(j, kid, chains) for (j, kid) in kids])
+
+        root = forks.get(0, None if kept else self.root)
+        if root is not None:
+            root = _place(0, _isolate(0, root), chains)
+        if root is not None and not root.kids:
+            # a tree of one tip is given a root, as by `clean`
+            root = makeNode(kids=[root])
+        return root
+
+
+def _place(i: int, fork: AnyNode, chains: Dict[int, List[Optional[float]]]) -> AnyNode:
+    """
+    Set the length of a collapsed fork, adding the lengths of its chain from
+    the top down as `smot.algorithm.clean` does (so forks match it exactly,
+    and a missing length drops the lengths above it)
+    """
+    if i in chains:
+        fork.data.length = _addLengths(chains.pop(i))
+    return fork
+
+
+def _addLengths(lengths: List[Optional[float]]) -> Optional[float]:
+    """
+    Add the lengths of a chain of nodes, given from the bottom up, from the top
+    down as `smot.algorithm.clean` does
+    """
+    length = lengths[-1]
+    for x in reversed(lengths[:-1]):
+        length = x + length if x is not None and length is not None else x
+    return length
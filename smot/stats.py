@@ -0,0 +1,267 @@
+from __future__ import annotations
+from typing import (
+    Any,
+    Callable,
+    Counter,
+    Iterable,
+    List,
+    Optional,
+    Sized,
+    TextIO,
+    Tuple,
+)
+
+import collections
+import statistics
+
+from smot.classes import AnyNode
+
+# Summary statistics of a tree, for choosing sampling parameters
+#
+# The nodes are collected in preorder in one walk of the tree, with the depth
+# and height of each. The tip counts and factors of each clade are then summed
+# from the children up over the collected arrays, and a last pass down the
+# arrays finds the groups that the samplers work on:
+#
+#  * a clade is monophyletic if its factored tips share one factor (or it has
+#    none), the largest monophyletic clades are the groups that
+#    `smot sample mono` samples from
+#  * `smot sample equal` samples the highest clades below the root that have a
+#    single factor with at least --max-tips tips
+#
+# so the number of tips each sampler keeps is known without sampling.
+# Paraphyletic sampling groups are unions of the monophyletic groups, so
+# sampling each monophyletic group as it would be sampled is an upper bound on
+# the tips it keeps.
+
+# The factor of a clade whose factored tips have more than one factor
+_MIXED: Any = object()
+
+
+class TreeStats:
+    """
+    The statistics of a tree, see `treeStats`
+    """
+
+    def __init__(self) -> None:
+        self.tips = 0
+        # the number of internal nodes
+        self.nodes = 0
+        # the most branches between the root and a tip
+        self.maxDepth = 0
+        # the greatest distance from the root to a tip, None if any branch
+        # length (but the root's) is missing
+        self.maxHeight: Optional[float] = 0.0
+        # the number of nodes with more than two children, by number of children
+        self.polytomies: Counter[int] = collections.Counter()
+        # the branch lengths, but the root's, sorted
+        self.lengths: List[float] = []
+        self.missingLengths = 0
+        # the number of tips of each factor, with None for tips without one
+        self.factors: Counter[Optional[str]] = collections.Counter()
+        # the monophyletic groups as (factor, tips, tips matching the keep
+        # pattern), with None as the factor of groups with no factored tips
+        self.groups: List[Tuple[Optional[str], int, int]] = []
+        # the groups that equal sampling samples from, as (factor, tips)
+        self.equalGroups: List[Tuple[str, int]] = []
+
+
+def treeStats(
+    node: AnyNode,
+    factor: Optional[Callable[[Optional[str]], Optional[str]]] = None,
+    keep: Optional[Callable[[str], bool]] = None,
+    maxTips: int = 5,
+) -> TreeStats:
+    """
+    Measure a tree. `factor` finds the factor of a tip label, `keep` selects
+    the tips that the samplers always keep (--keep-regex) and `maxTips` is the
+    group size of equal sampling.
+    """
+    stats = TreeStats()
+    nodes: List[AnyNode] = []
+    parents: List[int] = []
+    stack: List[Tuple[AnyNode, int, int, Optional[float]]] = [(node, -1, 0, 0.0)]
+    while stack:
+        (node, parent, depth, height) = stack.pop()
+        nodes.append(node)
+        parents.append(parent)
+        i = len(nodes) - 1
+        if parent >= 0:
+            length = node.data.length
+            if length is None:
+                stats.missingLengths += 1
+                height = None
+            else:
+                stats.lengths.append(length)
+                height = None if height is None else height + length
+        if node.kids:
+            stats.nodes += 1
+            if len(node.kids) > 2:
+                stats.polytomies[len(node.kids)] += 1
+            stack.extend((kid, i, depth + 1, height) for kid in reversed(node.kids))
+        else:
+            stats.maxDepth = max(stats.maxDepth, depth)
+            if height is None or stats.maxHeight is None:
+                stats.maxHeight = None
+            else:
+                stats.maxHeight = max(stats.maxHeight, height)
+    stats.lengths.sort()
+
+    # the tips, factored tips and kept tips of each clade and its factor,
+    # children before parents
+    n = len(nodes)
+    tips = [0] * n
+    factored = [0] * n
+    kept = [0] * n
+    factors: List[Any] = [None] * n
+    for i in range(n - 1, -1, -1):
+        data = nodes[i].data
+        if not nodes[i].kids:
+            label = data.label or ""
+            f = factor(label) if factor else None
+            stats.tips += 1
+            stats.factors[f] += 1
+            tips[i] = 1
+            factored[i] = int(f is not None)
+            kept[i] = int(bool(keep and keep(label)))
+            factors[i] = f
+        p = parents[i]
+        if p >= 0:
+            tips[p] += tips[i]
+            factored[p] += factored[i]
+            kept[p] += kept[i]
+            if factors[p] is None or factors[i] is _MIXED:
+                factors[p] = factors[i]
+            elif factors[i] is not None and factors[i] != factors[p]:
+                factors[p] = _MIXED
+
+    # the highest monophyletic clades and the highest clades below the root
+    # that equal sampling samples, parents before children
+    inGroup = [False] * n
+    inEqualGroup = [False] * n
+    for i in range(n):
+        p = parents[i]
+        if p >= 0 and inGroup[p]:
+            inGroup[i] = True
+        elif factors[i] is not _MIXED:
+            inGroup[i] = True
+            stats.groups.append((factors[i], tips[i], kept[i]))
+        if p >= 0 and inEqualGroup[p]:
+            inEqualGroup[i] = True
+        elif (
+            p >= 0
+            and factors[i] is not None
+            and factors[i] is not _MIXED
+            and factored[i] >= maxTips
+        ):
+            inEqualGroup[i] = True
+            stats.equalGroups.append((factors[i], tips[i]))
+    return stats
+
+
+def equalSize(stats: TreeStats, keep: Iterable[str], maxTips: int) -> int:
+    """
+    The number of tips that `smot sample equal` keeps
+    """
+    keep = set(keep)
+    size = stats.tips
+    for (factor, tips) in stats.equalGroups:
+        if factor not in keep:
+            size -= tips - min(tips, maxTips)
+    return size
+
+
+def monoSize(
+    stats: TreeStats, keep: Iterable[str], count: Callable[[Sized], int]
+) -> int:
+    """
+    The number of tips that `smot sample mono` keeps, given the number of tips
+    it draws from a group (see `smot.algorithm.monophyleticCounter`)
+    """
+    keep = set(keep)
+    size = 0
+    for (factor, tips, kept) in stats.groups:
+        drawn = count(range(tips - kept))
+        if factor in keep or drawn >= tips - kept:
+            size += tips
+        else:
+            size += drawn + kept
+    return size
+
+
+def paraSize(
+    stats: TreeStats, keep: Iterable[str], count: Callable[[Sized], int]
+) -> int:
+    """
+    The most tips that `smot sample para` may keep, given the number of tips it
+    draws from a group (see `smot.algorithm.paraphyleticCounter`)
+    """
+    keep = set(keep)
+    size = 0
+    for (factor, tips, kept) in stats.groups:
+        if factor in keep:
+            size += tips
+        else:
+            size += count(range(tips - kept)) + kept
+    return size
+
+
+def _quantile(xs: List[float], q: float) -> float:
+    """
+    The qth quantile of sorted values, interpolating between the nearest two
+    """
+    position = q * (len(xs) - 1)
+    i = int(position)
+    if i + 1 >= len(xs):
+        return xs[-1]
+    return xs[i] + (xs[i + 1] - xs[i]) * (position - i)
+
+
+def write_stats(
+    prefix: str,
+    stats: TreeStats,
+    sizes: List[Tuple[str, int]],
+    fh: TextIO,
+    formatLength: Callable[[float], str],
+) -> None:
+    """
+    Write the statistics of a tree as TAB-delimited rows of `prefix`, the name
+    of a statistic and its values
+    """
+
+    def row(*values: Any) -> None:
+        fh.write(prefix + "\t".join(str(v) for v in values) + "\n")
+
+    row("tips", stats.tips)
+    row("nodes", stats.nodes)
+    row("max-depth", stats.maxDepth)
+    if stats.maxHeight is not None:
+        row("max-height", formatLength(stats.maxHeight))
+    row("polytomies", sum(stats.polytomies.values()))
+    for (size, count) in sorted(stats.polytomies.items()):
+        row("polytomy", size, count)
+    row("missing-lengths", stats.missingLengths)
+    if stats.lengths:
+        quantiles = (_quantile(stats.lengths, q) for q in (0, 0.25, 0.5, 0.75, 1))
+        row("branch-lengths", *map(formatLength, quantiles))
+
+    if any(factor is not None for factor in stats.factors):
+        groups: Any = collections.defaultdict(list)
+        for (factor, tips, _) in stats.groups:
+            groups[factor].append(tips)
+        for (factor, count) in sorted(
+            stats.factors.items(), key=lambda x: (x[0] is None, str(x[0]))
+        ):
+            sizes_ = groups[factor] or [0]
+            row(
+                "factor" if factor is not None else "unfactored",
+                *([factor] if factor is not None else []),
+                count,
+                len(groups[factor]),
+                min(sizes_),
+                statistics.median_low(sizes_),
+                max(sizes_),
+            )
+
+    for (method, size) in sizes:
+        row("sample", method, size)
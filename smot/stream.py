@@ -0,0 +1,538 @@
+from __future__ import annotations
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    cast,
+)
+
+import codecs
+import re
+
+# Streaming access to Newick and Nexus trees. The tree is tokenized while it is
+# read, in chunks, so memory does not grow with the size of the tree. Nexus
+# headers (e.g., TAXA and TRANSLATE blocks) are read whole, they grow with the
+# number of taxa rather than with the size of the tree.
+#
+# The tokens follow the grammar in smot.parser: FigTree style single quotes
+# (with '' for an apostrophe), double quotes, backslash escapes within quotes,
+# bracketed annotations (which may contain quoted values), and unquoted labels
+# that run up to the next special character.
+
+# Characters read from the input at once
+CHUNK_SIZE = 1 << 16
+
+# token kinds
+LABEL = "label"
+QUOTED = "quoted"
+FORMAT = "format"
+
+# node event kinds
+OPEN = "open"
+LEAF = "leaf"
+CLOSE = "close"
+
+# (kind, label, format token, branch length token) of a node event
+Event = Tuple[str, Optional[str], Optional[str], Optional[str]]
+
+_token = re.compile(
+    r"""
+    (?P<punct>[(),:;])
+  | (?P<squote>(?:'(?:[^'\\]|\\.)*')+)
+  | (?P<dquote>"(?:[^"\\]|\\.)*")
+  | (?P<format>\[(?:[^\]'"]|'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")*\])
+  | (?P<word>[^,:;()[\]]+)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# token kinds of the regular expression groups other than punctuation
+_kinds = {"word": LABEL, "squote": QUOTED, "dquote": QUOTED, "format": FORMAT}
+
+_NEXUS = "#NEXUS\n"
+
+_escape = re.compile(r"\\(.)", re.DOTALL)
+
+_nexus_tree = re.compile(r"^\t\s*tree\s*[^ ]+\s*=[^(]*\(", re.I | re.M)
+
+# A tree statement up to and including its ";". Quoted labels and bracketed
+# comments, which may hold a ";", are skipped whole. The pattern is unrolled
+# (runs of ordinary characters between special ones) so it scans quickly.
+_squoted = r"'[^'\\]*(?:\\.[^'\\]*)*'"
+_dquoted = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_bracketed = rf"\[[^\]'\"]*(?:(?:{_squoted}|{_dquoted})[^\]'\"]*)*\]"
+_statement = re.compile(
+    rf"[^;'\"[]*(?:(?:{_squoted}|{_dquoted}|{_bracketed})[^;'\"[]*)*;", re.DOTALL
+)
+
+_block_end = re.compile(r"end(?:block)?\s*;", re.I)
+
+_trees_block = re.compile(r"begin\s+trees\s*;\s*\n", re.I)
+
+
+class StreamError(ValueError):
+    pass
+
+
+def unquote(token: str) -> str:
+    """
+    The label written by a QUOTED token
+    """
+    if token[0] == "'":
+        parts = re.findall(r"'((?:[^'\\]|\\.)*)'", token)
+        return "'".join(_escape.sub(r"\1", x) for x in parts)
+    elif token[0] == '"':
+        return _escape.sub(r"\1", token[1:-1])
+    else:
+        raise ValueError(f"Not a quoted label: {token}")
+
+
+def read_chunks(fh: BinaryIO, size: Optional[int] = None) -> Iterator[str]:
+    """
+    Decode UTF-8 text in chunks, translating newlines as text mode does
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    held = ""
+    while True:
+        data = fh.read(size or CHUNK_SIZE)
+        text = held + decoder.decode(data, final=not data)
+        # a "\r" at the end may be the first half of "\r\n"
+        if data and text.endswith("\r"):
+            (text, held) = (text[:-1], "\r")
+        else:
+            held = ""
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if text:
+            yield text
+        if not data:
+            break
+
+
+def tokens(chunks: Iterator[str], text: str = "") -> Iterator[Tuple[str, str]]:
+    """
+    Split Newick text into (kind, token) pairs, where kind is one of the
+    characters "(),:;", LABEL (an unquoted label or a branch length), QUOTED
+    or FORMAT. Tokens end at the first ";".
+    """
+    match = _token.match
+    pos = 0
+    size = len(text)
+    done = False
+    while True:
+        m = match(text, pos)
+        if m is not None:
+            end = m.end()
+            group = cast(str, m.lastgroup)
+            token = m.group()
+            # a token that reaches the end of the text may continue in the next
+            # chunk, as may an unterminated quote or bracket. An unterminated
+            # quote is read as an unquoted label (as smot.parser does) only at
+            # the end.
+            if done or not (
+                end == size
+                or (group == "word" and token[0] in "'\"")
+                or (group == "squote" and text.startswith("'", end))
+            ):
+                pos = end
+                if group == "punct":
+                    yield (token, token)
+                    if token == ";":
+                        return
+                else:
+                    yield (_kinds[group], token)
+                continue
+        elif done:
+            if pos < size and not text[pos:].isspace():
+                raise StreamError(f"Failed to parse tree near '{text[pos:pos + 40]}'")
+            raise StreamError("Unexpected end of tree, expected ';'")
+        try:
+            text = text[pos:] + next(chunks)
+        except StopIteration:
+            done = True
+            text = text[pos:]
+        pos = 0
+        size = len(text)
+
+
+def _start(fh: BinaryIO) -> Tuple[Iterator[str], str, Optional[re.Match]]:
+    """
+    Start reading a Newick or Nexus file. Returns the remaining chunks, the
+    text read so far and, for Nexus, the match of the first tree statement
+    (from the start of its line to the opening parenthesis of the tree).
+    """
+    chunks = read_chunks(fh)
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        if len(text) >= len(_NEXUS):
+            break
+    if not text.startswith(_NEXUS):
+        return (chunks, text, None)
+    # read the header up to the first tree
+    m = _nexus_tree.search(text)
+    while m is None:
+        more = next(chunks, None)
+        if more is None:
+            raise StreamError("No tree found in the Nexus file")
+        # only the last, unfinished line needs to be searched again
+        start = text.rfind("\n") + 1
+        text += more
+        m = _nexus_tree.search(text, start)
+    return (chunks, text, m)
+
+
+def tree_tokens(fh: BinaryIO) -> Tuple[Iterator[Tuple[str, str]], Dict[str, str]]:
+    """
+    Tokenize the first tree in a Newick or Nexus file. Also returns the
+    TRANSLATE table of a Nexus file (or an empty table).
+    """
+    (chunks, text, m) = _start(fh)
+    if m is None:
+        return (tokens(chunks, text), dict())
+    return (tokens(chunks, text[m.end() - 1 :]), _translateTable(text[: m.start()]))
+
+
+def split_trees(fh: BinaryIO) -> Tuple[str, Iterator[str]]:
+    """
+    Split a file of many trees without parsing them. Returns the header of a
+    Nexus file (everything before the first TREE statement, "" for Newick)
+    and the tree statements: each Newick tree, or each Nexus TREE statement
+    with its leading tab, ending with ";".
+    """
+    (chunks, text, m) = _start(fh)
+    if m is None:
+        return ("", _statements(chunks, text, nexus=False))
+    return (text[: m.start()], _statements(chunks, text[m.start() :], nexus=True))
+
+
+def tree_text(header: str, statement: str) -> str:
+    """
+    The text of a file that holds one tree from split_trees. A Nexus tree is
+    given the header, so its TAXA and TRANSLATE blocks apply.
+    """
+    return f"{header}{statement}\nend;\n" if header else statement
+
+
+def _statements(chunks: Iterator[str], text: str, nexus: bool) -> Iterator[str]:
+    pos = 0
+    done = False
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        # a Nexus trees block ends with "end;", a Newick file at its end
+        if nexus and _block_end.match(text, pos):
+            return
+        # a failed match is slow, so only try when a ";" is waiting
+        m = _statement.match(text, pos) if text.find(";", pos) >= 0 else None
+        if m is not None:
+            pos = m.end()
+            yield "\t" + m.group() if nexus else m.group()
+        elif done:
+            if pos < len(text):
+                raise StreamError(f"Unterminated tree near '{text[pos:pos + 40]}'")
+            if nexus:
+                raise StreamError("Expected 'end;' after the Nexus trees")
+            return
+        else:
+            # read more than doubles the waiting text, so that a long tree is
+            # scanned only a few times
+            parts = [text[pos:]]
+            (size, wanted) = (len(parts[0]), 2 * len(parts[0]))
+            while not done and size <= wanted:
+                more = next(chunks, None)
+                if more is None:
+                    done = True
+                else:
+                    parts.append(more)
+                    size += len(more)
+            (text, pos) = ("".join(parts), 0)
+
+
+def _translateTable(header: str) -> Dict[str, str]:
+    from smot.parser import p_translate_block
+    import parsec as p
+
+    m = None
+    for m in _trees_block.finditer(header):
+        pass
+    if m is None:
+        return dict()
+    table = p.optional(p_translate_block).parse(header[m.end() :])
+    return table or dict()
+
+
+def tips(fh: BinaryIO) -> Iterator[str]:
+    """
+    Yield the tip labels of a tree in order without building the tree
+    """
+    (toks, table) = tree_tokens(fh)
+    last: Optional[str] = None
+    for (kind, token) in toks:
+        # a label directly after "(" or "," is a tip, after ")" it labels an
+        # internal node and after ":" it is a branch length
+        if kind in (LABEL, QUOTED) and last in ("(", ","):
+            label = unquote(token) if kind == QUOTED else token
+            yield table.get(label, label)
+        last = kind
+
+
+def events(fh: BinaryIO) -> Iterator[Event]:
+    """
+    Yield an OPEN event when an internal node starts and a LEAF or CLOSE event,
+    with the label, format and branch length, when a node ends. Tip labels are
+    translated through the Nexus TRANSLATE table.
+    """
+    (toks, table) = tree_tokens(fh)
+    node: Optional[List[Any]] = None
+    last: Optional[str] = None
+    for (kind, token) in toks:
+        if kind in (LABEL, QUOTED, FORMAT):
+            if node is None:
+                if last not in ("(", ","):
+                    raise StreamError(f"Unexpected label '{token}' outside a node")
+                node = [LEAF, None, None, None]
+            if last == ":":
+                node[3] = token
+            elif kind == FORMAT:
+                node[2] = token
+            else:
+                node[1] = unquote(token) if kind == QUOTED else token
+        elif kind != ":":
+            if node is None and last in ("(", ",") and kind in (",", ")"):
+                # an unlabeled tip
+                node = [LEAF, None, None, None]
+            if node is not None:
+                if node[0] == LEAF and node[1] is not None:
+                    node[1] = table.get(node[1], node[1])
+                yield tuple(node)
+                node = None
+            if kind == "(":
+                yield (OPEN, None, None, None)
+            elif kind == ")":
+                node = [CLOSE, None, None, None]
+        last = kind
+
+
+def _nodeData(event: Event) -> Any:
+    from smot.classes import makeNodeData
+    from smot.parser import p_format
+
+    (kind, label, form, length) = event
+    try:
+        return makeNodeData(
+            label=label,
+            form=None if form is None else p_format.parse(form),
+            length=None if length is None else float(length),
+            isLeaf=kind == LEAF,
+        )
+    except ValueError:
+        raise StreamError(f"Failed to parse the node '{label}{form or ''}:{length}'")
+
+
+def relabel(
+    fh: BinaryIO, fun: Callable[[str], str], precision: Optional[int]
+) -> Iterator[str]:
+    """
+    Generate the newick string of a tree (without the final semicolon) with
+    `fun` applied to every node label
+    """
+    from smot.format import makeLengthFormatter, nodeInfo
+
+    formatLength = makeLengthFormatter(precision)
+    last: Optional[str] = None
+    for event in events(fh):
+        kind = event[0]
+        # a node that starts right after another ends is its sibling
+        if kind != CLOSE and last in (LEAF, CLOSE):
+            yield ","
+        if kind == OPEN:
+            yield "("
+        else:
+            data = _nodeData(event)
+            if data.label:
+                data.label = fun(data.label)
+            yield (")" if kind == CLOSE else "") + nodeInfo(data, formatLength)
+        last = kind
+
+
+def _survivors(fh: BinaryIO, keep: Callable[[str], bool]) -> bytearray:
+    """
+    Count the children of each internal node (in preorder) that hold a kept
+    tip, up to 2
+    """
+    counts = bytearray()
+    stack: List[int] = []
+    for (kind, label, _, _) in events(fh):
+        if kind == OPEN:
+            stack.append(len(counts))
+            counts.append(0)
+        elif kind == LEAF:
+            if label is not None and keep(label):
+                counts[stack[-1]] = min(counts[stack[-1]] + 1, 2)
+        else:
+            i = stack.pop()
+            if counts[i] and stack:
+                counts[stack[-1]] = min(counts[stack[-1]] + 1, 2)
+    return counts
+
+
+def prune(
+    fh: BinaryIO, keep: Callable[[str], bool], precision: Optional[int]
+) -> Iterator[str]:
+    """
+    Generate the newick string of a tree (without the final semicolon) that
+    keeps only the tips whose labels pass `keep`. Like smot.algorithm.clean,
+    nodes left with one child are replaced by the child, adding the branch
+    lengths, and empty nodes are removed.
+
+    Whether a node keeps more than one child is only known after all of it has
+    been read, so the tree is read twice: once to count the kept children of
+    each node (one byte per internal node) and once to write the pruned tree.
+    Otherwise memory grows only with the depth of the tree. The handle must be
+    seekable.
+    """
+    from smot.format import makeLengthFormatter, nodeInfo
+
+    formatLength = makeLengthFormatter(precision)
+    start = fh.tell()
+    counts = _survivors(fh, keep)
+    fh.seek(start)
+
+    # the kept children count of each open node that is written or collapsed,
+    # and the nearest written node (with a count of 2) at or above it, which
+    # holds whether a child has been written yet
+    stack: List[Tuple[int, Optional[List[bool]]]] = []
+    # the data of a kept node whose parent is being collapsed into it, and the
+    # branch lengths of the collapsed parents that have closed (innermost first)
+    pending: Optional[Tuple[Any, bool]] = None
+    collapsed: List[Optional[float]] = []
+    # index of the next internal node and the depth within a removed subtree
+    index = 0
+    skip = 0
+
+    def separate() -> bool:
+        # a kept node begins, it follows a comma if the nearest written node
+        # above it already has a child
+        written = stack[-1][1] if stack else None
+        if written is None:
+            return False
+        (comma, written[0]) = (written[0], True)
+        return comma
+
+    def ending(data: Any, isLeaf: bool) -> Iterator[str]:
+        nonlocal pending
+        if stack and stack[-1][0] == 1:
+            pending = (data, isLeaf)
+            return
+        if collapsed:
+            # add the lengths from the top down, as clean does, so the sums
+            # are exactly the same
+            total = collapsed.pop()
+            while collapsed:
+                length = collapsed.pop()
+                if length is not None and total is not None:
+                    length += total
+                total = length
+            if data.length is not None and total is not None:
+                data.length += total
+        if isLeaf and not stack:
+            # a tree that keeps one tip still needs a root
+            yield "(" + nodeInfo(data, formatLength) + ")"
+        else:
+            yield nodeInfo(data, formatLength)
+
+    for event in events(fh):
+        kind = event[0]
+        if kind == OPEN:
+            count = counts[index]
+            index += 1
+            if skip or (count == 0 and stack):
+                skip += 1
+                continue
+            if count == 2:
+                if separate():
+                    yield ","
+                stack.append((count, [False]))
+                yield "("
+            else:
+                # the one kept child takes the place of this node
+                stack.append((count, stack[-1][1] if stack else None))
+        elif skip:
+            if kind == CLOSE:
+                skip -= 1
+        elif kind == LEAF:
+            if event[1] is not None and keep(event[1]):
+                if separate():
+                    yield ","
+                yield from ending(_nodeData(event), True)
+        else:
+            (count, _) = stack.pop()
+            data = _nodeData(event)
+            if count == 1 and pending is not None:
+                (kept, isLeaf) = pending
+                pending = None
+                collapsed.append(data.length)
+                yield from ending(kept, isLeaf)
+            else:
+                if count == 2:
+                    yield ")"
+                yield from ending(data, False)
+
+
+def _length(token: Optional[str]) -> float:
+    if token is None:
+        raise StreamError("Expected all branch lengths to be defined")
+    try:
+        length = float(token)
+    except ValueError:
+        raise StreamError(f"Failed to parse the branch length '{token}'")
+    if length < 0:
+        raise StreamError("Expected all branch lengths to be positive")
+    return length
+
+
+def depths(fh: BinaryIO) -> Iterator[Tuple[Optional[str], float]]:
+    """
+    Yield the label of each tip with its distance from the root, like
+    smot.algorithm.nodeDepths but without building the tree.
+
+    The length of an internal node is only read after all of its descendants,
+    so the tree is read twice: once to collect the lengths of the internal nodes
+    (in preorder, eight bytes each) and once to add them up over each path from
+    the root. The handle must be seekable.
+    """
+    from array import array
+
+    start = fh.tell()
+    lengths = array("d")
+    stack: List[int] = []
+    for (kind, _, _, length) in events(fh):
+        if kind == OPEN:
+            stack.append(len(lengths))
+            lengths.append(0.0)
+        elif kind == CLOSE:
+            i = stack.pop()
+            # the root branch is not counted
+            if stack:
+                lengths[i] = _length(length)
+        elif stack:
+            # fail before writing anything if a tip has no length
+            _length(length)
+    fh.seek(start)
+
+    i = 0
+    path: List[float] = []
+    for (kind, label, _, length) in events(fh):
+        if kind == OPEN:
+            path.append(path[-1] + lengths[i] if path else 0.0)
+            i += 1
+        elif kind == CLOSE:
+            path.pop()
+        else:
+            yield (label, path[-1] + _length(length) if path else 0.0)
@@ -0,0 +1,207 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, TypeVar, cast
+
+import contextlib
+import functools
+import sys
+import time
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# The stages recorded in this process, None until timings are enabled
+_records: Optional[List[Dict[str, Any]]] = None
+
+# The records of the stages that are running, innermost last
+_running: List[Dict[str, Any]] = []
+
+
+class Stage:
+    """
+    Handle for a running stage, used to give the tree that the stage made
+    """
+
+    def __init__(self, record: Optional[Dict[str, Any]]):
+        self.record = record
+        self.node: Any = None
+
+    def count(self, tree: Any) -> None:
+        """
+        Count the nodes of this tree (or node) when the stage ends
+        """
+        if self.record is not None:
+            self.node = tree
+
+
+def enable() -> None:
+    """
+    Start recording stages
+    """
+    global _records
+    if _records is None:
+        _records = []
+
+
+def enabled() -> bool:
+    return _records is not None
+
+
+def take() -> List[Dict[str, Any]]:
+    """
+    Remove and return the stages recorded so far. A worker process takes its
+    stages after each task and the main process adds them with `merge`.
+    """
+    global _records
+    if _records is None:
+        return []
+    (records, _records) = (_records, [])
+    return records
+
+
+def merge(records: List[Dict[str, Any]]) -> None:
+    """
+    Add the stages recorded by a worker process, nested in the running stage
+    """
+    if _records is not None:
+        for record in records:
+            _records.append(dict(record, depth=record["depth"] + len(_running)))
+
+
+def countNodes(tree: Any) -> int:
+    stack = [getattr(tree, "tree", tree)]
+    n = 0
+    while stack:
+        node = stack.pop()
+        if node is not None:
+            n += 1
+            stack.extend(node.kids)
+    return n
+
+
+def maxRSS() -> Optional[int]:
+    """
+    The peak resident memory of the process in bytes, if it can be measured
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _tracedPeak() -> Optional[int]:
+    import tracemalloc
+
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    return None
+
+
+def _raisePeak(record: Dict[str, Any], peak: Optional[int]) -> None:
+    if peak is not None:
+        record["peak_bytes"] = max(record["peak_bytes"] or 0, peak)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[Stage]:
+    """
+    Record the wall time, CPU time and peak memory of a block.
+
+    The peak resident memory of the process is always recorded. Tracing every
+    allocation slows Python down many times over, so the peak traced memory of
+    each stage is only recorded if tracemalloc is already running (e.g., when
+    PYTHONTRACEMALLOC=1 is set). Before Python 3.9, the traced peak cannot be
+    reset, so each stage records the peak of the run up to its end.
+    """
+    if _records is None:
+        yield Stage(None)
+        return
+
+    import tracemalloc
+
+    tracing = tracemalloc.is_tracing()
+    if tracing and hasattr(tracemalloc, "reset_peak"):
+        # the peak of an enclosing stage must include everything before this one
+        if _running:
+            _raisePeak(_running[-1], _tracedPeak())
+        tracemalloc.reset_peak()
+
+    record: Dict[str, Any] = dict(
+        stage=name,
+        depth=len(_running),
+        wall=0.0,
+        cpu=0.0,
+        nodes=None,
+        max_rss_bytes=None,
+        peak_bytes=None,
+    )
+    _records.append(record)
+    _running.append(record)
+    handle = Stage(record)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield handle
+    finally:
+        record["wall"] = time.perf_counter() - wall
+        record["cpu"] = time.process_time() - cpu
+        record["max_rss_bytes"] = maxRSS()
+        _running.pop()
+        if tracing:
+            _raisePeak(record, _tracedPeak())
+            if _running:
+                _raisePeak(_running[-1], record["peak_bytes"])
+        if handle.node is not None:
+            record["nodes"] = countNodes(handle.node)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """
+    Decorator that records each call of a function that returns a tree or node
+    as a stage
+    """
+
+    def _decorator(f: F) -> F:
+        @functools.wraps(f)
+        def _timed(*args: Any, **kwargs: Any) -> Any:
+            if _records is None:
+                return f(*args, **kwargs)
+            with stage(name) as handle:
+                result = f(*args, **kwargs)
+                handle.count(result)
+            return result
+
+        return cast(F, _timed)
+
+    return _decorator
+
+
+def _megabytes(x: Optional[int]) -> str:
+    return "" if x is None else f"{x / 1e6:.1f}"
+
+
+def report(fh: TextIO, as_json: bool = False) -> None:
+    """
+    Write the recorded stages as a table or as JSON
+    """
+    import json
+
+    if _records is None:
+        return
+    if as_json:
+        json.dump(_records, fh, indent=2)
+        fh.write("\n")
+        return
+    fh.write(
+        f"{'stage':<24}{'wall (s)':>10}{'cpu (s)':>10}{'nodes':>10}"
+        f"{'rss (MB)':>10}{'peak (MB)':>11}\n"
+    )
+    for record in _records:
+        name = "  " * record["depth"] + record["stage"]
+        nodes = "" if record["nodes"] is None else str(record["nodes"])
+        fh.write(
+            f"{name:<24}{record['wall']:>10.3f}{record['cpu']:>10.3f}{nodes:>10}"
+            f"{_megabytes(record['max_rss_bytes']):>10}"
+            f"{_megabytes(record['peak_bytes']):>11}\n"
+        )